@@ -8,7 +8,10 @@ from flask import Flask, render_template, request, jsonify, make_response
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import pandas as pd
+import numpy as np
 import pickle
+import json
+import joblib
 import os
 import re
 import xml.etree.ElementTree as ET
@@ -38,6 +41,13 @@ from flask import request, jsonify, session, redirect, url_for
 from supabase import create_client, Client
 import ssl
 import os
+import warnings
+import threading
+import multiprocessing
+import socket
+import time
+import hashlib
+from collections import OrderedDict
 from datetime import timedelta
 
 # Load environment variables from .env file
@@ -138,11 +148,301 @@ db = SQLAlchemy(app)
 
 # --- MODEL LOADING LOGIC ---
 
-MODEL_FILENAME = 'cnc_laser_pricing_model.pkl'
+MODEL_FILENAME = 'cnc_laser_pricing_model.pkl'  # Legacy single-pickle format (model + metadata dict)
+MODEL_ARTIFACT_FILENAME = 'cnc_laser_pricing_model.joblib'  # Estimator only - metadata lives in the sidecar
 DATASET_FILENAME = 'cnc_historical_jobs.csv'
 
+def model_metadata_path(artifact_path):
+    """JSON sidecar that sits next to a model artifact"""
+    return os.path.splitext(artifact_path)[0] + '.json'
+
+def write_json_atomic(path, data):
+    """Write JSON via temp file + rename so readers never see a half-written file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def flat_forest_path(artifact_path):
+    """Flat node arrays exported next to a model artifact"""
+    return os.path.splitext(artifact_path)[0] + '.forest.joblib'
+
+def price_table_path(artifact_path):
+    """Precomputed standard-job prices saved next to a model artifact"""
+    return os.path.splitext(artifact_path)[0] + '.prices.joblib'
+
+def save_model_artifact(estimator, metadata, artifact_path, flat_forest=None, price_table=None):
+    """
+    Save the estimator with joblib plus a small JSON metadata sidecar. The flat
+    forest is saved uncompressed next to it so its node arrays can be
+    memory-mapped on load. The sidecar is written last - its presence marks a
+    complete artifact.
+    """
+    tmp_path = f"{artifact_path}.{os.getpid()}.tmp"
+    joblib.dump(estimator, tmp_path)
+    os.replace(tmp_path, artifact_path)
+    
+    for extra_path, extra in ((flat_forest_path(artifact_path), flat_forest),
+                              (price_table_path(artifact_path), price_table)):
+        if extra is not None:
+            tmp_path = f"{extra_path}.{os.getpid()}.tmp"
+            joblib.dump(extra.to_dict(), tmp_path)
+            os.replace(tmp_path, extra_path)
+        elif os.path.exists(extra_path):
+            os.remove(extra_path)
+    
+    write_json_atomic(model_metadata_path(artifact_path), metadata)
+
+def load_model_artifact(artifact_path):
+    """
+    Load estimator + sidecar. The estimator is a private copy per worker: sklearn
+    copies tree nodes into its own buffers on unpickling, so memory-mapping the
+    file would not share them. The serving FlatForest is what is shared
+    (load_flat_forest() maps it read-only, through the page cache).
+    """
+    estimator = joblib.load(artifact_path)
+    with open(model_metadata_path(artifact_path)) as f:
+        metadata = json.load(f)
+    return estimator, metadata
+
+def load_legacy_model_pickle(pickle_path):
+    """Unpickle an old-format .pkl once, splitting it into (estimator, metadata)"""
+    with open(pickle_path, 'rb') as f:
+        saved_data = pickle.load(f)
+    
+    # Handle case where pickle contains just the model or a dict of metadata
+    if isinstance(saved_data, dict) and 'model' in saved_data:
+        metadata = {k: v for k, v in saved_data.items() if k != 'model'}
+        if metadata.get('columns') is not None:
+            metadata['columns'] = list(metadata['columns'])
+        return saved_data['model'], metadata
+    return saved_data, {}
+
+# --- FLAT TREE ENSEMBLE (fast single-row inference) ---
+
+class FlatForest:
+    """
+    A RandomForestRegressor flattened into contiguous node arrays.
+    All trees live in one set of arrays (feature, threshold, left, right, value)
+    and rows are pushed down every tree at once with a fixed number of
+    vectorized steps, avoiding sklearn's per-call validation and per-tree
+    dispatch. Leaves point to themselves, so extra steps are no-ops.
+    """
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+    
+    @classmethod
+    def from_estimator(cls, estimator):
+        """Export a fitted forest of regression trees (None if not a tree ensemble)"""
+        estimators = getattr(estimator, 'estimators_', None)
+        if not estimators or not all(hasattr(est, 'tree_') for est in estimators):
+            return None
+        
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        for est in estimators:
+            tree = est.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            values.append(tree.value[:, 0, 0])
+            offset += tree.node_count
+        
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            value=np.concatenate(values).astype(np.float64),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max(est.tree_.max_depth for est in estimators)
+        )
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+    
+    def to_dict(self):
+        """Plain arrays only, so the file loads without importing this class"""
+        return {
+            'feature': self.feature,
+            'threshold': self.threshold,
+            'left': self.left,
+            'right': self.right,
+            'value': self.value,
+            'roots': self.roots,
+            'max_depth': self.max_depth
+        }
+    
+    def tree_predictions(self, X):
+        """Per-tree predictions, shape (n_rows, n_trees)"""
+        # sklearn evaluates trees on float32 inputs - match it for identical splits
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes]
+    
+    def predict(self, X):
+        return self.tree_predictions(X).mean(axis=1)
+
+def load_flat_forest(artifact_path, estimator):
+    """Memory-map the exported node arrays, or flatten the estimator if none were saved"""
+    forest_path = flat_forest_path(artifact_path)
+    try:
+        if artifact_path.endswith('.joblib') and os.path.exists(forest_path):
+            return FlatForest.from_dict(joblib.load(forest_path, mmap_mode='r'))
+        return FlatForest.from_estimator(estimator)
+    except Exception as e:
+        print(f"Flat forest unavailable, using sklearn predict: {e}")
+        return None
+
+# Set USE_FLAT_FOREST=0 to always predict through sklearn
+USE_FLAT_FOREST = os.environ.get('USE_FLAT_FOREST', '1') != '0'
+
+# --- MODEL VERSION REGISTRY (shared by all gunicorn workers) ---
+
+class ModelRegistry:
+    """
+    Versioned model artifacts on the persistent instance/ volume plus a
+    manifest naming the active version. Artifacts are complete before the
+    manifest is atomically replaced, so a reader never sees a half-written
+    model; workers compare the manifest's stat stamp to notice new versions.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, 'manifest.json')
+    
+    def artifact_path(self, version):
+        base = os.path.splitext(MODEL_ARTIFACT_FILENAME)[0]
+        return os.path.join(self.root, f"{base}_v{int(version):04d}.joblib")
+    
+    def manifest_stamp(self):
+        """Cheap change detector: (mtime, inode) of the manifest, None if absent"""
+        try:
+            st = os.stat(self.manifest_path)
+            return (st.st_mtime_ns, st.st_ino)
+        except OSError:
+            return None
+    
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def versions(self):
+        """All complete versions on disk (artifact + sidecar present), oldest first"""
+        found = []
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                match = re.search(r'_v(\d+)\.json$', name)
+                if match and os.path.exists(self.artifact_path(match.group(1))):
+                    found.append(int(match.group(1)))
+        return sorted(found)
+    
+    def publish(self, estimator, metadata, flat_forest=None, activate=True, price_table=None):
+        """Save a new version (and by default make it active). Returns (version, artifact_path)."""
+        os.makedirs(self.root, exist_ok=True)
+        manifest = self.read_manifest() or {}
+        version = max(self.versions() + [int(manifest.get('version', 0))]) + 1
+        
+        path = self.artifact_path(version)
+        save_model_artifact(estimator, dict(metadata, version=version), path,
+                            flat_forest=flat_forest, price_table=price_table)
+        if activate:
+            self.activate(version)
+        return version, path
+    
+    def activate(self, version):
+        """Point the manifest at an existing version (atomic replace) and record it as promoted"""
+        if int(version) not in self.versions():
+            raise FileNotFoundError(f"Model version {version} is not in the registry")
+        # Only versions still on disk, so the list stays as short as the registry
+        promoted = (set(self.promoted_versions()) & set(self.versions())) | {int(version)}
+        write_json_atomic(self.manifest_path, {
+            'version': int(version),
+            'artifact': os.path.basename(self.artifact_path(version)),
+            'activated_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'promoted': sorted(promoted)
+        })
+    
+    def promoted_versions(self, manifest=None):
+        """
+        Versions that have served traffic (promoted or activated by hand), oldest first.
+        Manifests written before this was recorded fall back to the sidecars'
+        promotion result - versions saved before the promotion gate were all activated.
+        """
+        manifest = manifest if manifest is not None else (self.read_manifest() or {})
+        if 'promoted' in manifest:
+            return sorted(int(v) for v in manifest['promoted'])
+        
+        promoted = {int(manifest['version'])} if 'version' in manifest else set()
+        for version in self.versions():
+            try:
+                with open(model_metadata_path(self.artifact_path(version))) as f:
+                    promotion = json.load(f).get('promotion')
+            except (OSError, ValueError):
+                continue
+            if promotion is None or promotion.get('promoted'):
+                promoted.add(version)
+        return sorted(promoted)
+    
+    def prune(self, keep, keep_candidates=0):
+        """
+        Delete all but the newest `keep` promoted versions (the rollback targets) and the
+        newest `keep_candidates` never-promoted ones - never the active one, so rejected
+        candidates cannot push promoted versions out. Returns the removed versions.
+        """
+        manifest = self.read_manifest() or {}
+        versions = self.versions()
+        promoted = set(self.promoted_versions(manifest))
+        served = [v for v in versions if v in promoted]
+        candidates = [v for v in versions if v not in promoted]
+        
+        removed = candidates[:-keep_candidates] if keep_candidates > 0 else candidates
+        if keep > 0:
+            removed += served[:-keep]
+        removed = sorted(v for v in removed if v != manifest.get('version'))
+        for version in removed:
+            path = self.artifact_path(version)
+            # Sidecar first, so a half-pruned version no longer counts as complete
+            for file_path in (model_metadata_path(path), path, flat_forest_path(path), price_table_path(path)):
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+        return removed
+
+model_registry = ModelRegistry(os.path.join(INSTANCE_PATH, 'models'))
+# Guards the model/encoder/flat_forest globals while a worker swaps versions
+model_swap_lock = threading.Lock()
+
 # Logic: Check Persistent Storage (instance/) first. If missing, use Default (data/).
-if os.path.exists(os.path.join(INSTANCE_PATH, MODEL_FILENAME)):
+# The registry's active version wins, then an unversioned artifact, then any legacy pickle.
+active_manifest = model_registry.read_manifest()
+model_manifest_stamp = model_registry.manifest_stamp()
+model_version = active_manifest['version'] if active_manifest else None
+
+if active_manifest:
+    MODEL_PATH = model_registry.artifact_path(active_manifest['version'])
+elif os.path.exists(model_metadata_path(os.path.join(INSTANCE_PATH, MODEL_ARTIFACT_FILENAME))):
+    MODEL_PATH = os.path.join(INSTANCE_PATH, MODEL_ARTIFACT_FILENAME)
+elif os.path.exists(os.path.join(INSTANCE_PATH, MODEL_FILENAME)):
     MODEL_PATH = os.path.join(INSTANCE_PATH, MODEL_FILENAME)
     # Startup logging deferred to app context
 else:
@@ -155,18 +455,35 @@ if os.path.exists(os.path.join(INSTANCE_PATH, DATASET_FILENAME)):
 else:
     DATASET_PATH = os.path.join(DATA_PATH, DATASET_FILENAME)
 
-# Load the model safely
+# Load the model safely - exactly once; columns and stats come from the same load
 try:
-    with open(MODEL_PATH, 'rb') as f:
-        model_data = pickle.load(f)
-        # Handle case where pickle contains just the model or a dict of metadata
-        if isinstance(model_data, dict) and 'model' in model_data:
-            model = model_data['model']
-        else:
-            model = model_data
+    if MODEL_PATH.endswith('.joblib'):
+        model, model_metadata = load_model_artifact(MODEL_PATH)
+    else:
+        model, model_metadata = load_legacy_model_pickle(MODEL_PATH)
 except Exception as e:
     print(f"CRITICAL ERROR loading model: {e}")
     model = None
+    model_metadata = {}
+
+flat_forest = load_flat_forest(MODEL_PATH, model) if model is not None and USE_FLAT_FOREST else None
+
+def read_model_metadata():
+    """
+    Model stats without touching the estimator. Reads the JSON sidecar of the
+    registry's active version (so it reflects retrains done by any worker);
+    legacy pickles fall back to the metadata captured at startup.
+    """
+    manifest = model_registry.read_manifest()
+    artifact_path = model_registry.artifact_path(manifest['version']) if manifest else MODEL_PATH
+    sidecar_path = model_metadata_path(artifact_path)
+    if artifact_path.endswith('.joblib') and os.path.exists(sidecar_path):
+        try:
+            with open(sidecar_path) as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error reading model metadata: {e}")
+    return model_metadata
 
 # ========================================
 # DATABASE MODEL
@@ -414,6 +731,117 @@ class Offcut(db.Model):
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
         }
 
+# ========================================
+# FEATURE ENCODER
+# ========================================
+
+# Categorical job fields and the one-hot prefixes used by pd.get_dummies at training time
+CATEGORICAL_FEATURES = {'material': 'mat_', 'cutting_type': 'cut_'}
+
+class FeatureEncoder:
+    """
+    Encodes job dicts straight into the model's feature layout.
+    Built once from the saved `columns` list so predictions need no DataFrame:
+    numeric fields are written by column index and each category sets a single
+    one-hot slot, exactly like get_dummies + reindex did.
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.n_features = len(self.columns)
+        self.numeric_index = []  # (field, column index)
+        self.category_index = {field: {} for field in CATEGORICAL_FEATURES}
+        
+        for idx, col in enumerate(self.columns):
+            for field, prefix in CATEGORICAL_FEATURES.items():
+                if col.startswith(prefix):
+                    self.category_index[field][col[len(prefix):]] = idx
+                    break
+            else:
+                self.numeric_index.append((col, idx))
+    
+    def lookup(self, field, value):
+        """
+        Return the one-hot column index for a category value, or None if never seen.
+        Matching is exact (case-sensitive) like get_dummies: 'acrylic' is a different
+        category from a trained 'Acrylic' and gets no one-hot slot.
+        """
+        return self.category_index[field].get(str(value))
+    
+    def encode_into(self, job_data, row):
+        """Write one job into a zeroed feature row; returns list of unseen (field, value)"""
+        for field, idx in self.numeric_index:
+            row[idx] = float(job_data.get(field, 0) or 0)
+        
+        unseen = []
+        for field in CATEGORICAL_FEATURES:
+            value = job_data.get(field)
+            idx = self.lookup(field, value)
+            if idx is None:
+                unseen.append((field, value))
+            else:
+                row[idx] = 1.0
+        return unseen
+    
+    def encode(self, jobs):
+        """Encode a list of jobs into one preallocated (n_jobs, n_features) matrix"""
+        X = np.zeros((len(jobs), self.n_features), dtype=np.float64)
+        unseen = set()
+        for i, job_data in enumerate(jobs):
+            unseen.update(self.encode_into(job_data, X[i]))
+        
+        for field, value in sorted(unseen, key=str):
+            print(f"⚠ WARNING: {field} '{value}' was never seen in training data - "
+                  f"the model will price it without any {field} information. Retrain to include it.")
+        return X
+
+class OrdinalFeatureEncoder(FeatureEncoder):
+    """
+    Encoder for engines with native categorical support (HistGradientBoosting):
+    each categorical field is a single column holding its category code, and
+    unseen values are NaN, which the model routes like missing values.
+    """
+    def __init__(self, columns, categories):
+        self.columns = list(columns)
+        self.n_features = len(self.columns)
+        self.numeric_index = [(col, idx) for idx, col in enumerate(self.columns)
+                              if col not in CATEGORICAL_FEATURES]
+        self.field_index = {field: self.columns.index(field) for field in CATEGORICAL_FEATURES}
+        self.category_index = {
+            field: {value: code for code, value in enumerate(categories[field])}
+            for field in CATEGORICAL_FEATURES
+        }
+    
+    def encode_into(self, job_data, row):
+        for field, idx in self.numeric_index:
+            row[idx] = float(job_data.get(field, 0) or 0)
+        
+        unseen = []
+        for field in CATEGORICAL_FEATURES:
+            value = job_data.get(field)
+            code = self.lookup(field, value)
+            if code is None:
+                unseen.append((field, value))
+                row[self.field_index[field]] = np.nan
+            else:
+                row[self.field_index[field]] = code
+        return unseen
+
+def build_feature_encoder(feature_columns, categories=None):
+    """
+    Build the encoder for a column list (None if no model columns are available).
+    `categories` (from the model metadata) selects the ordinal layout used by
+    native-categorical engines; without it columns are one-hot.
+    """
+    if feature_columns is None:
+        return None
+    try:
+        if categories:
+            return OrdinalFeatureEncoder(feature_columns, categories)
+        return FeatureEncoder(feature_columns)
+    except Exception as e:
+        print(f"Error building feature encoder: {e}")
+        return None
+
 # ========================================
 # LOAD TRAINED MODEL (already loaded above at lines 106-116)
 # ========================================
@@ -421,21 +849,10 @@ class Offcut(db.Model):
 # Use DATASET_PATH (set at lines 100-103) for CSV operations
 CSV_PATH = DATASET_PATH
 
-# Extract columns from the already-loaded model
-try:
-    if model is not None:
-        # Try to get columns from saved model data
-        with open(MODEL_PATH, 'rb') as f:
-            saved_data = pickle.load(f)
-            if isinstance(saved_data, dict) and 'columns' in saved_data:
-                columns = saved_data['columns']
-            else:
-                columns = None
-    else:
-        columns = None
-except Exception as e:
-    print(f"Error extracting columns: {e}")
-    columns = None
+# Columns come from the metadata captured when the model was loaded
+columns = model_metadata.get('columns') if model is not None else None
+
+encoder = build_feature_encoder(columns, model_metadata.get('categories'))
 
 # ========================================
 # APPLICATION SETTINGS MODEL
@@ -579,16 +996,16 @@ def get_dxf_unit_factor(unit_code):
     }
     return unit_factors.get(unit_code, 1.0)
 
+# Include ALL meaningful entity types - an entity's position here is its EntityGeometry type code
+DXF_ENTITY_TYPES = [
+    'LINE', 'LWPOLYLINE', 'POLYLINE', 'CIRCLE', 'ARC',
+    'ELLIPSE', 'SPLINE', 'INSERT', 'TEXT', 'MTEXT'
+]
+DXF_TYPE_CODES = {entity_type: code for code, entity_type in enumerate(DXF_ENTITY_TYPES)}
+
 def is_meaningful_entity(entity):
     """Check if entity should be considered for spatial analysis"""
-    entity_type = entity.dxftype()
-    
-    # Include ALL meaningful entity types
-    meaningful_types = [
-        'LINE', 'LWPOLYLINE', 'POLYLINE', 'CIRCLE', 'ARC', 
-        'ELLIPSE', 'SPLINE', 'INSERT', 'TEXT', 'MTEXT'
-    ]
-    return entity_type in meaningful_types
+    return entity.dxftype() in DXF_TYPE_CODES
 
 def create_default_dxf_item(name):
     """Create default DXF item"""
@@ -603,241 +1020,311 @@ def create_default_dxf_item(name):
         'cutting_time_minutes': 10
     }
 
-def get_entity_bounding_box(entity, unit_factor):
-    """Calculate bounding box - IMPROVED TEXT DETECTION"""
-    try:
-        entity_type = entity.dxftype()
-        points = []
-        
-        if entity_type == 'LINE':
-            if hasattr(entity.dxf, 'start') and hasattr(entity.dxf, 'end'):
-                start = entity.dxf.start
-                end = entity.dxf.end
-                points.extend([
-                    (start.x if hasattr(start, 'x') else start[0], 
-                     start.y if hasattr(start, 'y') else start[1]),
-                    (end.x if hasattr(end, 'x') else end[0], 
-                     end.y if hasattr(end, 'y') else end[1])
-                ])
-                
-        elif entity_type == 'LWPOLYLINE':
-            if hasattr(entity, 'vertices'):
-                for v in entity.vertices():
-                    points.append((v[0], v[1]))
-                    
-        elif entity_type == 'POLYLINE':
-            if hasattr(entity, 'vertices'):
-                for vertex in entity.vertices:
-                    if hasattr(vertex.dxf, 'location'):
-                        loc = vertex.dxf.location
-                        points.append((loc.x if hasattr(loc, 'x') else loc[0], 
-                                     loc.y if hasattr(loc, 'y') else loc[1]))
-                
-        elif entity_type == 'CIRCLE':
-            if hasattr(entity.dxf, 'center') and hasattr(entity.dxf, 'radius'):
-                center = entity.dxf.center
-                radius = entity.dxf.radius
-                cx = center.x if hasattr(center, 'x') else center[0]
-                cy = center.y if hasattr(center, 'y') else center[1]
-                points.extend([
-                    (cx - radius, cy - radius),
-                    (cx + radius, cy + radius)
-                ])
-                
-        elif entity_type == 'ARC':
-            if hasattr(entity.dxf, 'center') and hasattr(entity.dxf, 'radius'):
-                center = entity.dxf.center
-                radius = entity.dxf.radius
-                cx = center.x if hasattr(center, 'x') else center[0]
-                cy = center.y if hasattr(center, 'y') else center[1]
-                points.extend([
-                    (cx - radius, cy - radius),
-                    (cx + radius, cy + radius)
-                ])
-                
-        elif entity_type == 'ELLIPSE':
-            if hasattr(entity.dxf, 'center') and hasattr(entity.dxf, 'major_axis'):
-                center = entity.dxf.center
-                major_axis = entity.dxf.major_axis
-                cx = center.x if hasattr(center, 'x') else center[0]
-                cy = center.y if hasattr(center, 'y') else center[1]
-                radius = abs(major_axis.x if hasattr(major_axis, 'x') else major_axis[0])
-                points.extend([
-                    (cx - radius, cy - radius),
-                    (cx + radius, cy + radius)
-                ])
-                
-        elif entity_type in ['TEXT', 'MTEXT']:
-            if hasattr(entity.dxf, 'insert'):
-                insert_point = entity.dxf.insert
-                ix = insert_point.x if hasattr(insert_point, 'x') else insert_point[0]
-                iy = insert_point.y if hasattr(insert_point, 'y') else insert_point[1]
-                
-                # Better text size estimation
-                text_height = getattr(entity.dxf, 'height', 3)  # Default 3mm
-                
-                # Get actual text for better width estimation
-                text_content = ""
-                if entity_type == 'TEXT' and hasattr(entity.dxf, 'text'):
-                    text_content = str(entity.dxf.text)
-                elif entity_type == 'MTEXT' and hasattr(entity, 'text'):
-                    text_content = str(entity.text)
-                
-                text_length = len(text_content) if text_content else 3
-                estimated_width = text_height * 0.7 * text_length  # Char width ~70% of height
-                
-                points.extend([
-                    (ix, iy),
-                    (ix + estimated_width, iy + text_height)
-                ])
-                
-        elif entity_type == 'INSERT':
-            if hasattr(entity.dxf, 'insert'):
-                insert_point = entity.dxf.insert
-                ix = insert_point.x if hasattr(insert_point, 'x') else insert_point[0]
-                iy = insert_point.y if hasattr(insert_point, 'y') else insert_point[1]
-                
-                block_size = 20
-                points.extend([
-                    (ix - block_size/2, iy - block_size/2),
-                    (ix + block_size/2, iy + block_size/2)
-                ])
-        
-        elif entity_type == 'SPLINE':
-            if hasattr(entity, 'control_points'):
-                for cp in entity.control_points:
-                    points.append((cp[0], cp[1]))
+def entity_points(entity, entity_type):
+    """Points (drawing units) whose extent is the entity's bounding box - IMPROVED TEXT DETECTION"""
+    dxf = entity.dxf
+    
+    if entity_type == 'LINE':
+        return [dxf.start, dxf.end]
+    
+    if entity_type == 'LWPOLYLINE':
+        return list(entity.vertices())
+    
+    if entity_type == 'POLYLINE':
+        return [vertex.dxf.location for vertex in entity.vertices]
+    
+    if entity_type in ('CIRCLE', 'ARC'):
+        center, radius = dxf.center, dxf.radius
+        return [(center[0] - radius, center[1] - radius), (center[0] + radius, center[1] + radius)]
+    
+    if entity_type == 'ELLIPSE':
+        center, radius = dxf.center, abs(dxf.major_axis[0])
+        return [(center[0] - radius, center[1] - radius), (center[0] + radius, center[1] + radius)]
+    
+    if entity_type in ('TEXT', 'MTEXT'):
+        insert_point = dxf.insert
         
-        # Convert to millimeters and calculate bounding box
-        if points:
-            xs = [p[0] * unit_factor for p in points]
-            ys = [p[1] * unit_factor for p in points]
-            
-            return {
-                'min_x': min(xs),
-                'min_y': min(ys),
-                'max_x': max(xs),
-                'max_y': max(ys),
-                'width': max(xs) - min(xs),
-                'height': max(ys) - min(ys)
-            }
+        # Better text size estimation
+        text_height = getattr(dxf, 'height', 3)  # Default 3mm
         
-        return None
+        # Get actual text for better width estimation
+        text_content = str(dxf.text) if entity_type == 'TEXT' else str(entity.text)
+        text_length = len(text_content) if text_content else 3
+        estimated_width = text_height * 0.7 * text_length  # Char width ~70% of height
         
-    except Exception as e:
-        print(f"Error calculating bbox for {entity.dxftype()}: {e}")
-        return None
+        return [(insert_point[0], insert_point[1]),
+                (insert_point[0] + estimated_width, insert_point[1] + text_height)]
+    
+    if entity_type == 'INSERT':
+        insert_point = dxf.insert
+        block_size = 20
+        return [(insert_point[0] - block_size/2, insert_point[1] - block_size/2),
+                (insert_point[0] + block_size/2, insert_point[1] + block_size/2)]
+    
+    if entity_type == 'SPLINE':
+        return list(entity.control_points)
+    
+    return []
 
-def calculate_cluster_bounding_box(cluster):
-    """Calculate overall bounding box for a cluster of entities"""
-    if not cluster:
-        return None
+class EntityGeometry:
+    """
+    Columnar geometry of a drawing's meaningful entities: one row per entity
+    holding its type code (DXF_ENTITY_TYPES position), bounding box and centre
+    in mm as contiguous NumPy arrays. `index` points each row back into
+    `entities`; the ezdxf objects themselves are only read again for text and
+    line connectivity. Rows keep the drawing's entity order.
+    """
+    def __init__(self, entities, index, type_code, bounds, scanned=None):
+        self.entities = entities
+        self.scanned = len(entities) if scanned is None else scanned  # entities looked at, kept or not
+        self.index = np.asarray(index, dtype=np.int64)
+        self.type_code = np.asarray(type_code, dtype=np.int8)
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self.min_x, self.min_y, self.max_x, self.max_y = (np.ascontiguousarray(bounds[:, k]) for k in range(4))
+        self.center_x = self.min_x + (self.max_x - self.min_x) / 2
+        self.center_y = self.min_y + (self.max_y - self.min_y) / 2
     
-    min_x = min(entity['bbox']['min_x'] for entity in cluster)
-    min_y = min(entity['bbox']['min_y'] for entity in cluster)
-    max_x = max(entity['bbox']['max_x'] for entity in cluster)
-    max_y = max(entity['bbox']['max_y'] for entity in cluster)
+    def __len__(self):
+        return len(self.index)
     
-    return {
-        'min_x': min_x,
-        'min_y': min_y,
-        'max_x': max_x,
-        'max_y': max_y,
-        'width': max_x - min_x,
-        'height': max_y - min_y
-    }
+    def bbox(self, rows):
+        """Overall bounding box of the given rows"""
+        min_x, min_y = float(self.min_x[rows].min()), float(self.min_y[rows].min())
+        max_x, max_y = float(self.max_x[rows].max()), float(self.max_y[rows].max())
+        return {
+            'min_x': min_x,
+            'min_y': min_y,
+            'max_x': max_x,
+            'max_y': max_y,
+            'width': max_x - min_x,
+            'height': max_y - min_y
+        }
+    
+    def entities_of(self, rows, entity_types):
+        """The ezdxf entities of the given rows that have one of entity_types"""
+        wanted = np.zeros(len(DXF_ENTITY_TYPES), dtype=bool)
+        wanted[[DXF_TYPE_CODES[entity_type] for entity_type in entity_types]] = True
+        return [self.entities[i] for i in self.index[rows[wanted[self.type_code[rows]]]]]
 
-def calculate_entity_distance(entity1, entity2):
-    """Calculate minimum distance between two entity bounding boxes"""
-    # Simple center-to-center distance
-    dx = entity1['center_x'] - entity2['center_x']
-    dy = entity1['center_y'] - entity2['center_y']
-    return (dx**2 + dy**2)**0.5
+class StreamedEntity:
+    """
+    The few fields analyze_entity_cluster() reads from a LINE (start, end),
+    TEXT (dxf.text) or MTEXT (text), copied off a parsed entity so the entity
+    itself can be freed while streaming a large drawing.
+    """
+    __slots__ = ('entity_type', 'start', 'end', 'text')
+    
+    def __init__(self, entity_type, start=None, end=None, text=None):
+        self.entity_type = entity_type
+        if start is not None:
+            self.start, self.end = start, end
+        if text is not None:
+            self.text = text
+    
+    @property
+    def dxf(self):
+        return self
+    
+    def dxftype(self):
+        return self.entity_type
+    
+    @classmethod
+    def detach(cls, entity, entity_type):
+        """Copy of the fields the analyser needs, or None for entities it only needs the box of"""
+        if entity_type == 'LINE':
+            return cls(entity_type, start=entity.dxf.start, end=entity.dxf.end)
+        if entity_type == 'TEXT':
+            return cls(entity_type, text=entity.dxf.text)
+        if entity_type == 'MTEXT':
+            return cls(entity_type, text=entity.text)
+        return None
 
-def should_merge_clusters(cluster1, cluster2, threshold):
-    """Check if two clusters should be merged based on bounding box proximity"""
-    # Calculate combined bounding box for each cluster
-    bbox1 = calculate_cluster_bounding_box(cluster1)
-    bbox2 = calculate_cluster_bounding_box(cluster2)
+def extract_entity_geometry(entities, unit_factor, min_size=0.1, detach=False):
+    """
+    Single pass over the entities collecting each one's type code and bounding
+    box in drawing units; unit_factor is then applied as one vector multiply.
+    Entities without a usable box, or not wider and taller than min_size mm,
+    are left out.
+    With detach=True `entities` may be any iterable (e.g. a streaming reader):
+    the geometry then keeps StreamedEntity copies of the text and LINE entities
+    instead of the entities themselves.
+    """
+    index = []
+    type_codes = []
+    bounds = []
+    kept = [] if detach else entities
+    scanned = 0
+    
+    for i, entity in enumerate(entities):
+        entity_type = entity.dxftype()
+        code = DXF_TYPE_CODES.get(entity_type)
+        if detach:
+            kept.append(None)
+        if code is None:
+            continue
+        scanned += 1
+        try:
+            points = entity_points(entity, entity_type)
+            if not points:
+                continue
+            xs = [p[0] for p in points]
+            ys = [p[1] for p in points]
+            bounds.append((min(xs), min(ys), max(xs), max(ys)))
+            if detach:
+                kept[i] = StreamedEntity.detach(entity, entity_type)
+        except Exception as e:
+            print(f"Error calculating bbox for {entity_type}: {e}")
+            continue
+        index.append(i)
+        type_codes.append(code)
     
-    # Check if bounding boxes overlap or are close
-    horizontal_gap = max(0, bbox1['min_x'] - bbox2['max_x'], bbox2['min_x'] - bbox1['max_x'])
-    vertical_gap = max(0, bbox1['min_y'] - bbox2['max_y'], bbox2['min_y'] - bbox1['max_y'])
+    # Convert to millimeters
+    bounds = np.array(bounds, dtype=float).reshape(-1, 4) * unit_factor
+    keep = ((bounds[:, 2] - bounds[:, 0]) > min_size) & ((bounds[:, 3] - bounds[:, 1]) > min_size)
     
-    max_gap = max(horizontal_gap, vertical_gap)
-    return max_gap < threshold
+    return EntityGeometry(kept, np.array(index, dtype=np.int64)[keep],
+                          np.array(type_codes, dtype=np.int8)[keep], bounds[keep], scanned)
 
-def merge_close_clusters(clusters, merge_threshold):
-    """Merge clusters that are close to each other"""
+def group_rows(labels):
+    """Row indices grouped by label, groups ordered by label (rows ascending within each)"""
+    order = np.argsort(labels, kind='stable')
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return np.split(order, boundaries)
+
+def merge_close_clusters(clusters, merge_threshold, geometry):
+    """
+    Merge clusters (arrays of geometry rows) whose bounding boxes are less than
+    merge_threshold apart on both axes, until no two remaining clusters are close.
+    
+    Each cluster's bounding box is computed once and then kept as a running
+    min/max aggregate as clusters merge. Candidate pairs come from a
+    sort-and-sweep over x-intervals widened by merge_threshold, the y gap is
+    checked for the whole sweep window at once, and close pairs are joined
+    with a union-find. Merging grows boxes, so the sweep repeats until a pass
+    finds nothing - the same fixed point the old pairwise loop reached.
+    Merged clusters keep the order of their first cluster.
+    """
     if len(clusters) <= 1:
         return clusters
     
-    merged = True
-    while merged and len(clusters) > 1:
-        merged = False
-        new_clusters = []
-        used = set()
+    rows = np.concatenate(clusters)
+    labels = np.repeat(np.arange(len(clusters)), [len(cluster) for cluster in clusters])
+    min_x = np.full(len(clusters), np.inf)
+    min_y = np.full(len(clusters), np.inf)
+    max_x = np.full(len(clusters), -np.inf)
+    max_y = np.full(len(clusters), -np.inf)
+    np.minimum.at(min_x, labels, geometry.min_x[rows])
+    np.minimum.at(min_y, labels, geometry.min_y[rows])
+    np.maximum.at(max_x, labels, geometry.max_x[rows])
+    np.maximum.at(max_y, labels, geometry.max_y[rows])
+    
+    parent = np.arange(len(clusters))
+    alive = np.arange(len(clusters))  # one index per current cluster (its lowest input index)
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    while len(alive) > 1:
+        order = alive[np.argsort(min_x[alive], kind='stable')]
+        sorted_min_x = min_x[order]
+        # Sweep window ends, padded so float rounding can only widen it; the exact test follows
+        window_end = np.searchsorted(sorted_min_x, (max_x[order] + merge_threshold) * (1 + 1e-12) + 1e-9, side='right')
         
-        for i in range(len(clusters)):
-            if i in used:
+        merged = False
+        for position in range(len(order)):
+            end = window_end[position]
+            if end <= position + 1:
                 continue
-                
-            current_cluster = clusters[i]
-            merged_this_round = False
-            
-            for j in range(i + 1, len(clusters)):
-                if j in used:
-                    continue
-                    
-                # Check if clusters should be merged
-                if should_merge_clusters(current_cluster, clusters[j], merge_threshold):
-                    current_cluster.extend(clusters[j])
-                    used.add(j)
+            i = order[position]
+            others = order[position + 1:end]
+            # Sorted by min_x, so the other side's x gap is never positive
+            close = others[(min_x[others] - max_x[i] < merge_threshold) &
+                           (min_y[others] - max_y[i] < merge_threshold) &
+                           (min_y[i] - max_y[others] < merge_threshold)]
+            for j in close:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
                     merged = True
-                    merged_this_round = True
-            
-            new_clusters.append(current_cluster)
-            used.add(i)
-        
-        # Add any unused clusters
-        for i in range(len(clusters)):
-            if i not in used:
-                new_clusters.append(clusters[i])
         
-        clusters = new_clusters
+        if not merged:
+            break
+        
+        # Fold every merged cluster's box into its root's
+        for i in alive:
+            root = find(i)
+            if root != i:
+                min_x[root] = min(min_x[root], min_x[i])
+                min_y[root] = min(min_y[root], min_y[i])
+                max_x[root] = max(max_x[root], max_x[i])
+                max_y[root] = max(max_y[root], max_y[i])
+        alive = np.array([i for i in alive if parent[i] == i])
     
-    return clusters
+    roots = np.array([find(i) for i in range(len(clusters))])
+    return [np.sort(rows[group]) for group in group_rows(roots[labels])]
+
+def grid_cluster_entities(center_x, center_y, cluster_threshold):
+    """
+    Connected groups of entities whose centres are closer than cluster_threshold,
+    as arrays of geometry rows. Centres are bucketed into a uniform grid of
+    cluster_threshold-sized cells, so a neighbour can only sit in the 3x3 block
+    of cells around an entity; close pairs are joined with a union-find.
+    Near-linear in entity count.
+    
+    This is a superset of the old greedy rule (join the first cluster with any
+    close entity): an entity close to two greedy clusters joins both. Such
+    clusters' bounding boxes are then within cluster_threshold of each other, so
+    merge_close_clusters() would have merged them anyway - the final jobs match.
+    Groups are ordered by their first row.
+    """
+    parent = list(range(len(center_x)))
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    xs, ys = center_x.tolist(), center_y.tolist()
+    cells = {}
+    for i, cell in enumerate(zip(np.floor(center_x / cluster_threshold).astype(np.int64).tolist(),
+                                 np.floor(center_y / cluster_threshold).astype(np.int64).tolist())):
+        cells.setdefault(cell, []).append(i)
+    
+    # Each pair of neighbouring cells is visited once: the cell itself plus 4 of its 8 neighbours
+    for (cell_x, cell_y), members in cells.items():
+        for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+            neighbours = cells.get((cell_x + dx, cell_y + dy))
+            if neighbours is None:
+                continue
+            for position, i in enumerate(members):
+                x, y = xs[i], ys[i]
+                for j in (members[position + 1:] if neighbours is members else neighbours):
+                    # Centre-to-centre distance
+                    if ((x - xs[j])**2 + (y - ys[j])**2)**0.5 < cluster_threshold:
+                        root_i, root_j = find(i), find(j)
+                        if root_i != root_j:
+                            parent[max(root_i, root_j)] = min(root_i, root_j)
+    
+    # Roots are the smallest row of each group, so groups come out in first-row order
+    return group_rows(np.array([find(i) for i in range(len(parent))], dtype=np.int64))
 
-def spatial_cluster_entities(entity_boxes, cluster_threshold=50):
+def spatial_cluster_entities(geometry, cluster_threshold=50):
     """
     Cluster entities based on spatial proximity
     cluster_threshold: distance in mm to consider entities part of same job
+    Returns one array of geometry rows per cluster.
     """
-    if not entity_boxes:
+    if not len(geometry):
         return []
     
-    clusters = []
-    
-    for entity_box in entity_boxes:
-        added_to_cluster = False
-        
-        for cluster in clusters:
-            # Check if entity is close to any entity in the cluster
-            for cluster_entity in cluster:
-                distance = calculate_entity_distance(entity_box, cluster_entity)
-                if distance < cluster_threshold:
-                    cluster.append(entity_box)
-                    added_to_cluster = True
-                    break
-            if added_to_cluster:
-                break
-        
-        if not added_to_cluster:
-            # Start new cluster
-            clusters.append([entity_box])
+    clusters = grid_cluster_entities(geometry.center_x, geometry.center_y, cluster_threshold)
     
     # Merge clusters that are close to each other
-    clusters = merge_close_clusters(clusters, cluster_threshold * 1.5)
+    clusters = merge_close_clusters(clusters, cluster_threshold * 1.5, geometry)
     
     return clusters
 
@@ -988,56 +1475,53 @@ def estimate_improved_cutting_time(shape_count, text_count, width, height):
     
     return round(final_time, 1)
 
-def analyze_entity_cluster(cluster, job_name, unit_factor):
-    """Analyze a cluster of entities as a single job - HIGHLY IMPROVED VERSION"""
+# Shapes counted one per entity, as a lookup table by type code; LINEs are grouped by connectivity instead
+DXF_SHAPE_MASK = np.isin(DXF_ENTITY_TYPES, ['LWPOLYLINE', 'POLYLINE', 'CIRCLE', 'ARC', 'ELLIPSE', 'SPLINE', 'INSERT'])
+
+def analyze_entity_cluster(geometry, rows, job_name, unit_factor):
+    """
+    Analyze a cluster of entities (rows of an EntityGeometry) as a single job - HIGHLY IMPROVED VERSION
+    Shape counts and size come from the arrays; only text and lines read their entities.
+    """
     try:
-        shape_count = 0
         text_count = 0
-        line_segments = []
         text_entities = []
         
-        for entity_data in cluster:
-            entity = entity_data['entity']
+        # Count shape entities
+        shape_count = int(DXF_SHAPE_MASK[geometry.type_code[rows]].sum())
+        
+        # Special handling for lines - group connected lines as single shapes
+        line_segments = geometry.entities_of(rows, ['LINE'])
+        
+        # Count text entities and their characters
+        for entity in geometry.entities_of(rows, ['TEXT', 'MTEXT']):
             entity_type = entity.dxftype()
+            text_content = None
             
-            # Count text entities and their characters
-            if entity_type in ['TEXT', 'MTEXT']:
-                text_content = None
-                
-                if entity_type == 'TEXT':
-                    if hasattr(entity.dxf, 'text'):
-                        text_content = entity.dxf.text
-                    elif hasattr(entity, 'dxf') and hasattr(entity.dxf, 'text'):
-                        text_content = entity.dxf.text
-                        
-                elif entity_type == 'MTEXT':
-                    if hasattr(entity, 'text'):
-                        text_content = entity.text
-                    elif hasattr(entity, 'plain_text'):
-                        text_content = entity.plain_text()
-                
-                if text_content:
-                    # Clean and count actual visible characters
-                    clean_text = str(text_content).strip()
-                    # Remove formatting codes if present
-                    import re
-                    clean_text = re.sub(r'\\[A-Za-z][^;]*;', '', clean_text)
-                    # Count only alphanumeric characters and spaces
-                    char_count = len([c for c in clean_text if c.isalnum() or c.isspace()])
-                    text_count += char_count
-                    text_entities.append(entity_type)
-                    print(f"  Found {entity_type}: '{clean_text}' = {char_count} chars")
+            if entity_type == 'TEXT':
+                if hasattr(entity.dxf, 'text'):
+                    text_content = entity.dxf.text
+                elif hasattr(entity, 'dxf') and hasattr(entity.dxf, 'text'):
+                    text_content = entity.dxf.text
+                    
+            elif entity_type == 'MTEXT':
+                if hasattr(entity, 'text'):
+                    text_content = entity.text
+                elif hasattr(entity, 'plain_text'):
+                    text_content = entity.plain_text()
             
-            # Count shape entities
-            elif entity_type in ['LINE', 'LWPOLYLINE', 'POLYLINE', 'CIRCLE', 
-                                'ARC', 'ELLIPSE', 'SPLINE', 'INSERT']:
-                
-                # Special handling for lines - group connected lines as single shapes
-                if entity_type == 'LINE':
-                    line_segments.append(entity)
-                else:
-                    shape_count += 1
-        
+            if text_content:
+                # Clean and count actual visible characters
+                clean_text = str(text_content).strip()
+                # Remove formatting codes if present
+                import re
+                clean_text = re.sub(r'\\[A-Za-z][^;]*;', '', clean_text)
+                # Count only alphanumeric characters and spaces
+                char_count = len([c for c in clean_text if c.isalnum() or c.isspace()])
+                text_count += char_count
+                text_entities.append(entity_type)
+                print(f"  Found {entity_type}: '{clean_text}' = {char_count} chars")
+    
         # Intelligently count lines as shapes (connected lines = 1 shape)
         grouped_line_shapes = count_connected_line_groups(line_segments)
         shape_count += grouped_line_shapes
@@ -1045,13 +1529,9 @@ def analyze_entity_cluster(cluster, job_name, unit_factor):
         print(f"  Analysis: {shape_count} shapes, {text_count} letters, {len(text_entities)} text entities")
         
         # Use cluster bounding box for dimensions
-        cluster_bbox = calculate_cluster_bounding_box(cluster)
-        
-        if cluster_bbox:
-            width = cluster_bbox['width']
-            height = cluster_bbox['height']
-        else:
-            width = height = 100
+        cluster_bbox = geometry.bbox(rows)
+        width = cluster_bbox['width']
+        height = cluster_bbox['height']
         
         # Calculate complexity and time
         complexity = calculate_improved_complexity(shape_count, text_count, width, height)
@@ -1066,7 +1546,7 @@ def analyze_entity_cluster(cluster, job_name, unit_factor):
             'complexity_score': complexity,
             'has_intricate_details': 1 if complexity >= 4 else 0,
             'cutting_time_minutes': round(cutting_time, 1),
-            'cluster_size': len(cluster)
+            'cluster_size': len(rows)
         }
         
     except Exception as e:
@@ -1075,38 +1555,31 @@ def analyze_entity_cluster(cluster, job_name, unit_factor):
         print(traceback.format_exc())
         return create_default_dxf_item(job_name)
 
-def detect_spatial_jobs(entities, unit_factor):
-    """Detect separate jobs by spatial clustering of entities - WITH BETTER LOGGING"""
-    # Step 1: Calculate bounding boxes for all entities
-    entity_boxes = []
-    
-    print(f"\n=== Entity Type Breakdown ===")
-    entity_type_counts = {}
-    
-    for entity in entities:
-        entity_type = entity.dxftype()
-        entity_type_counts[entity_type] = entity_type_counts.get(entity_type, 0) + 1
-        
-        bbox = get_entity_bounding_box(entity, unit_factor)
-        if bbox and bbox['width'] > 0.1 and bbox['height'] > 0.1:  # Even smaller threshold
-            entity_boxes.append({
-                'entity': entity,
-                'bbox': bbox,
-                'center_x': bbox['min_x'] + bbox['width'] / 2,
-                'center_y': bbox['min_y'] + bbox['height'] / 2
-            })
+def detect_spatial_jobs(entities, unit_factor, on_job=None):
+    """
+    Detect separate jobs by spatial clustering of entities - WITH BETTER LOGGING
+    entities: the ezdxf entities, or an EntityGeometry already extracted from them
+    on_job(job_analysis), if given, is called as soon as each cluster is analyzed.
+    """
+    # Step 1: Type code, bounding box and centre of every entity as NumPy columns
+    if isinstance(entities, EntityGeometry):
+        geometry = entities
+    else:
+        geometry = extract_entity_geometry(entities, unit_factor)
     
     # Print entity type summary
-    for etype, count in sorted(entity_type_counts.items()):
-        print(f"  {etype}: {count}")
+    print(f"\n=== Entity Type Breakdown ===")
+    for code, count in enumerate(np.bincount(geometry.type_code, minlength=len(DXF_ENTITY_TYPES))):
+        if count:
+            print(f"  {DXF_ENTITY_TYPES[code]}: {count}")
     
-    print(f"\nEntities with valid bounding boxes: {len(entity_boxes)}/{len(entities)}")
+    print(f"\nEntities with valid bounding boxes: {len(geometry)}/{geometry.scanned}")
     
-    if not entity_boxes:
+    if not len(geometry):
         return [create_default_dxf_item("Design")]
     
     # Step 2: Cluster entities by spatial proximity
-    clusters = spatial_cluster_entities(entity_boxes)
+    clusters = spatial_cluster_entities(geometry)
     print(f"Spatial clusters found: {len(clusters)}")
     
     # Step 3: Analyze each cluster as a separate job
@@ -1114,11 +1587,13 @@ def detect_spatial_jobs(entities, unit_factor):
     for i, cluster in enumerate(clusters):
         job_name = f"Job {i + 1}" if len(clusters) > 1 else "Design"
         print(f"\n--- Analyzing {job_name} ({len(cluster)} entities) ---")
-        job_analysis = analyze_entity_cluster(cluster, job_name, unit_factor)
+        job_analysis = analyze_entity_cluster(geometry, cluster, job_name, unit_factor)
         jobs.append(job_analysis)
         print(f"✓ {job_name}: {job_analysis['width_mm']}x{job_analysis['height_mm']}mm, "
               f"{job_analysis['num_shapes']} shapes, {job_analysis['num_letters']} letters, "
               f"complexity {job_analysis['complexity_score']}/5")
+        if on_job:
+            on_job(job_analysis)
     
     return jobs
 
@@ -1126,81 +1601,324 @@ def detect_spatial_jobs(entities, unit_factor):
 # DXF FILE ANALYZER FUNCTIONS
 # ========================================
 
-def analyze_dxf_file(file_content):
-    """Analyze DXF file using spatial detection - Fixed bytes handling"""
+# Uploads this large are read with read_dxf_streaming() instead of loading the whole document
+DXF_STREAMING_THRESHOLD_MB = float(os.environ.get('DXF_STREAMING_THRESHOLD_MB', 20))
+
+def is_binary_dxf(stream):
+    """True for a binary DXF, which the streaming reader cannot parse; leaves the stream rewound"""
+    sentinel = stream.read(22)
+    stream.seek(0)
+    return sentinel.startswith(b'AutoCAD Binary DXF')
+
+def read_dxf_header(stream):
+    """
+    ($INSUNITS, text encoding) from the HEADER section of an ASCII DXF stream;
+    leaves the stream rewound. $INSUNITS is 0 if not set. Files from AutoCAD 2007
+    on (AC1021+) are UTF-8, older ones use $DWGCODEPAGE.
+    """
+    from ezdxf.tools.codepage import toencoding
+    
+    wanted = (b'$INSUNITS', b'$ACADVER', b'$DWGCODEPAGE')
+    values = {}
     try:
-        print(f"=== DXF Spatial Analysis Started ===")
-        print(f"File content type: {type(file_content)}")
-        print(f"File content length: {len(file_content) if file_content else 0}")
-        
-        # Ensure we have bytes (handle both string and bytes input)
-        if isinstance(file_content, str):
-            print("Converting string to bytes...")
-            file_content = file_content.encode('utf-8')
-        
-        if not file_content:
-            return {
-                'success': False,
-                'error': 'Empty file content',
-                'file_type': 'dxf'
-            }
+        while True:
+            code, value = stream.readline(), stream.readline()
+            if not value:
+                break
+            code, value = code.strip(), value.strip()
+            if code == b'0' and value in (b'ENDSEC', b'EOF'):
+                break
+            if code == b'9' and value in wanted:
+                stream.readline()
+                values[value] = stream.readline().strip()
+    finally:
+        stream.seek(0)
+    
+    try:
+        unit_code = int(values.get(b'$INSUNITS', 0))
+    except ValueError:
+        unit_code = 0
+    version = values.get(b'$ACADVER', b'AC1009').decode('ascii', 'replace')
+    if version >= 'AC1021':
+        encoding = 'utf-8'
+    else:
+        encoding = toencoding(values.get(b'$DWGCODEPAGE', b'ANSI_1252').decode('ascii', 'replace'))
+    return unit_code, encoding
+
+def iter_dxf_modelspace(stream, types, encoding):
+    """
+    Modelspace entities of an ASCII DXF stream in one pass, one at a time.
+    Follows ezdxf's iterdxf.single_pass_modelspace(), which never loads the
+    entity still buffered when the ENTITIES section ends - that last entity is
+    yielded here too. POLYLINE vertices and INSERT attributes are linked to
+    their parent entity as ezdxf does.
+    """
+    from ezdxf.entities import factory
+    from ezdxf.entities.subentity import entity_linker
+    from ezdxf.lldxf.extendedtags import ExtendedTags
+    from ezdxf.lldxf.tagger import tag_compiler
+    from ezdxf.lldxf.types import DXFTag
+    
+    requested = set(types)
+    if 'POLYLINE' in requested:
+        requested.update(('VERTEX', 'SEQEND'))
+    if 'INSERT' in requested:
+        requested.update(('ATTRIB', 'SEQEND'))
+    linked_entity = entity_linker()
+    
+    def raw_tags():
+        while True:
+            code = stream.readline()
+            if not code:
+                return
+            value = stream.readline().rstrip(b'\r\n')
+            yield DXFTag(int(code), value.decode(encoding, errors='surrogateescape'))
+    
+    def load(tags):
+        """The modelspace entity the tags describe, None if skipped or linked to the previous one"""
+        if not tags or tags[0].value not in requested:
+            return None
+        entity = factory.load(ExtendedTags(tags))
+        if linked_entity(entity) or entity.dxf.paperspace != 0:
+            return None
+        return entity
+    
+    in_entities = False
+    previous = None
+    queued = None  # Held back until the next entity, which may still link VERTEX/ATTRIB to it
+    tags = []
+    for tag in tag_compiler(raw_tags()):
+        if not in_entities:
+            in_entities = tag.code == 2 and previous == (0, 'SECTION') and tag.value == 'ENTITIES'
+            previous = (tag.code, tag.value)
+            continue
         
-        # Read DXF file with better error handling
-        import io
-        import tempfile
-        import os
+        if tag.code != 0:
+            tags.append(tag)
+            continue
         
-        # Method 1: Try BytesIO first
-        try:
-            dxf_stream = io.BytesIO(file_content)
-            import ezdxf
-            doc = ezdxf.read(dxf_stream)
-            print("✓ Successfully read DXF via BytesIO")
-            
-        except Exception as e1:
-            print(f"BytesIO method failed: {e1}")
-            
-            # Method 2: Try temporary file
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.dxf', mode='wb') as temp_file:
-                    temp_file.write(file_content)
-                    temp_path = temp_file.name
-                
-                import ezdxf
-                doc = ezdxf.readfile(temp_path)
-                print("✓ Successfully read DXF via temporary file")
-                
-                # Clean up temp file
-                os.unlink(temp_path)
-                
-            except Exception as e2:
-                print(f"Temporary file method failed: {e2}")
-                return {
-                    'success': False, 
-                    'error': f'Cannot read DXF file. File may be corrupted. Errors: {str(e1)}, {str(e2)}',
-                    'file_type': 'dxf'
-                }
+        entity = load(tags)
+        if entity is not None:
+            if queued is not None:
+                yield queued
+            queued = entity
+        if tag.value == 'ENDSEC':
+            break
+        tags = [tag]
+    
+    if queued is not None:
+        yield queued
+
+def read_dxf_streaming(stream):
+    """
+    Low-memory read of an ASCII DXF binary stream: modelspace entities go one
+    at a time from iter_dxf_modelspace() straight into an EntityGeometry,
+    keeping only the fields the analyser needs - no document is built and
+    the upload is not copied.
+    Returns (geometry, unit_factor).
+    """
+    unit_code, encoding = read_dxf_header(stream)
+    unit_factor = get_dxf_unit_factor(unit_code)
+    print(f"Units: {unit_code} → Factor: {unit_factor}")
+    
+    entities = iter_dxf_modelspace(stream, DXF_ENTITY_TYPES, encoding)
+    return extract_entity_geometry(entities, unit_factor, detach=True), unit_factor
+
+# Result of check_dxf_streaming_reader(): None until it has run, then whether large uploads may stream
+dxf_streaming_verified = None
+
+def dxf_streaming_sample():
+    """
+    A small drawing with every entity type the analyser reads, POLYLINE vertices,
+    an INSERT with attributes, non-ASCII text and a paperspace entity. Its last
+    modelspace entity is a separate job, so a reader that drops it loses a job.
+    """
+    doc = ezdxf.new('R2010')
+    doc.header['$INSUNITS'] = 4
+    block = doc.blocks.new('TAG')
+    block.add_circle((0, 0), 5)
+    block.add_attdef('ID', (0, -8), dxfattribs={'height': 3})
+    
+    msp = doc.modelspace()
+    msp.add_lwpolyline([(0, 0), (200, 0), (200, 80), (0, 80)], close=True)
+    msp.add_text('NAMEPLATE Ünïcödé', dxfattribs={'height': 12, 'insert': (10, 30)})
+    msp.add_mtext('LINE ONE\\PLINE TWO', dxfattribs={'char_height': 6, 'insert': (10, 75)})
+    msp.add_line((5, 5), (60, 5))
+    msp.add_polyline2d([(5, 10), (40, 10), (40, 25)])
+    msp.add_arc((150, 40), 20, 0, 180)
+    msp.add_ellipse((100, 40), major_axis=(30, 0), ratio=0.5)
+    msp.add_spline([(120, 10), (140, 30), (160, 10), (180, 30)])
+    msp.add_blockref('TAG', (180, 60)).add_auto_attribs({'ID': '42'})
+    doc.paperspace().add_circle((0, 0), 500)
+    msp.add_circle((1000, 1000), 40)
+    return doc
+
+def check_dxf_streaming_reader():
+    """
+    Analyse dxf_streaming_sample() with the streaming reader and with a full
+    ezdxf load. iter_dxf_modelspace() is built on ezdxf internals (tag compiler,
+    entity factory and linker) that can change between releases without notice.
+    Returns the differences - empty when both readers agree.
+    """
+    import contextlib
+    import io
+    
+    text = io.StringIO()
+    dxf_streaming_sample().write(text)
+    data = text.getvalue().encode('utf-8')
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        full = analyze_dxf_file(io.BytesIO(data), streaming=False)
+        streamed = analyze_dxf_file(io.BytesIO(data), streaming=True)
+    
+    if not (full.get('success') and streamed.get('success')):
+        return [f"full load: {full.get('error', 'ok')}, streaming: {streamed.get('error', 'ok')}"]
+    full_jobs, streamed_jobs = full['items'], streamed['items']
+    differences = []
+    if len(full_jobs) != len(streamed_jobs):
+        differences.append(f'{len(full_jobs)} jobs from a full load, {len(streamed_jobs)} streamed')
+    for number, (full_job, streamed_job) in enumerate(zip(full_jobs, streamed_jobs), 1):
+        fields = sorted(key for key in full_job.keys() | streamed_job.keys() if full_job.get(key) != streamed_job.get(key))
+        if fields:
+            differences.append(f"job {number} differs in {', '.join(fields)}")
+    return differences
+
+def verify_dxf_streaming_reader():
+    """Run check_dxf_streaming_reader() once; large uploads fall back to the full load if it fails"""
+    global dxf_streaming_verified
+    try:
+        differences = check_dxf_streaming_reader()
+    except Exception as e:
+        differences = [f'the check raised {e!r}']
+    
+    dxf_streaming_verified = not differences
+    if dxf_streaming_verified:
+        print(f"✓ Streaming DXF reader matches a full load (ezdxf {ezdxf.__version__})")
+    else:
+        app.logger.error(
+            "Streaming DXF reader disagrees with a full load on ezdxf %s - large uploads will load the "
+            "whole document until iter_dxf_modelspace() is fixed: %s", ezdxf.__version__, '; '.join(differences)
+        )
+    return dxf_streaming_verified
+
+def analyze_dxf_file(file_content, on_job=None, streaming=None):
+    """
+    Analyze DXF file using spatial detection - Fixed bytes handling
+    file_content: bytes/str, or a seekable binary file object such as the upload's stream
+    streaming: read with read_dxf_streaming() instead of loading the whole document;
+    None picks it for files of DXF_STREAMING_THRESHOLD_MB or more
+    on_job is passed on to detect_spatial_jobs()
+    """
+    try:
+        import io
+        import tempfile
+        import os
         
-        # Now analyze the DXF document
-        msp = doc.modelspace()
+        print(f"=== DXF Spatial Analysis Started ===")
+        print(f"File content type: {type(file_content)}")
+        
+        if hasattr(file_content, 'read'):
+            stream = file_content
+            stream.seek(0, os.SEEK_END)
+            size = stream.tell()
+            stream.seek(0)
+        else:
+            stream = None
+            # Ensure we have bytes (handle both string and bytes input)
+            if isinstance(file_content, str):
+                print("Converting string to bytes...")
+                file_content = file_content.encode('utf-8')
+            size = len(file_content) if file_content else 0
         
-        print(f"DXF Version: {doc.dxfversion}")
-        print(f"Total entities: {len(msp)}")
+        print(f"File content length: {size}")
         
-        # Get units
-        unit_code = doc.header.get('$INSUNITS', 0)
-        unit_factor = get_dxf_unit_factor(unit_code)
-        print(f"Units: {unit_code} → Factor: {unit_factor}")
+        if not size:
+            return {
+                'success': False,
+                'error': 'Empty file content',
+                'file_type': 'dxf'
+            }
         
-        # Extract all meaningful entities
-        all_entities = []
-        for entity in msp:
-            if is_meaningful_entity(entity):
-                all_entities.append(entity)
+        if streaming is None:
+            streaming = size >= DXF_STREAMING_THRESHOLD_MB * 1024 * 1024
+            if streaming and dxf_streaming_verified is None:
+                verify_dxf_streaming_reader()
+            streaming = streaming and dxf_streaming_verified
+        if streaming:
+            stream = stream or io.BytesIO(file_content)
+            if is_binary_dxf(stream):
+                print("Binary DXF - streaming reader not supported, loading full document")
+                streaming = False
+        
+        if streaming:
+            print(f"Streaming DXF modelspace ({size / 1024 / 1024:.1f} MB)")
+            try:
+                all_entities, unit_factor = read_dxf_streaming(stream)
+            except Exception as e:
+                print(f"Streaming read failed: {e}")
+                return {
+                    'success': False,
+                    'error': f'Cannot read DXF file. File may be corrupted. Errors: {str(e)}',
+                    'file_type': 'dxf'
+                }
+            entity_count = all_entities.scanned
+        else:
+            if stream is not None:
+                file_content = stream.read()
+            
+            # Method 1: Try BytesIO first
+            try:
+                dxf_stream = io.BytesIO(file_content)
+                import ezdxf
+                doc = ezdxf.read(dxf_stream)
+                print("✓ Successfully read DXF via BytesIO")
+            
+            except Exception as e1:
+                print(f"BytesIO method failed: {e1}")
+                
+                # Method 2: Try temporary file
+                try:
+                    with tempfile.NamedTemporaryFile(delete=False, suffix='.dxf', mode='wb') as temp_file:
+                        temp_file.write(file_content)
+                        temp_path = temp_file.name
+                    
+                    import ezdxf
+                    doc = ezdxf.readfile(temp_path)
+                    print("✓ Successfully read DXF via temporary file")
+                    
+                    # Clean up temp file
+                    os.unlink(temp_path)
+                
+                except Exception as e2:
+                    print(f"Temporary file method failed: {e2}")
+                    return {
+                        'success': False, 
+                        'error': f'Cannot read DXF file. File may be corrupted. Errors: {str(e1)}, {str(e2)}',
+                        'file_type': 'dxf'
+                    }
+            
+            # Now analyze the DXF document
+            msp = doc.modelspace()
+            
+            print(f"DXF Version: {doc.dxfversion}")
+            print(f"Total entities: {len(msp)}")
+            
+            # Get units
+            unit_code = doc.header.get('$INSUNITS', 0)
+            unit_factor = get_dxf_unit_factor(unit_code)
+            print(f"Units: {unit_code} → Factor: {unit_factor}")
+            
+            # Extract all meaningful entities
+            all_entities = []
+            for entity in msp:
+                if is_meaningful_entity(entity):
+                    all_entities.append(entity)
+            
+            entity_count = len(all_entities)
         
-        print(f"Meaningful entities found: {len(all_entities)}")
+        print(f"Meaningful entities found: {entity_count}")
         
-        if not all_entities:
+        if not entity_count:
             return {
                 'success': False,
                 'error': 'No meaningful design elements found in DXF file',
@@ -1208,7 +1926,7 @@ def analyze_dxf_file(file_content):
             }
         
         # Detect separate jobs using spatial clustering
-        jobs = detect_spatial_jobs(all_entities, unit_factor)
+        jobs = detect_spatial_jobs(all_entities, unit_factor, on_job)
         print(f"Spatial detection found {len(jobs)} separate jobs")
         
         # Return appropriate response
@@ -1243,6 +1961,300 @@ def analyze_dxf_file(file_content):
             'file_type': 'dxf'
         }
 
+# ========================================
+# ANALYSIS CACHE
+# ========================================
+
+# Bump whenever analyze_dxf_file() or analyze_svg_file() output changes - every
+# analysis cached by an older analyzer then misses
+ANALYZER_VERSION = 2
+ANALYSIS_CACHE_PATH = os.path.join(INSTANCE_PATH, 'analysis_cache')
+USE_ANALYSIS_CACHE = os.environ.get('USE_ANALYSIS_CACHE', '1') != '0'
+
+def file_sha256(stream, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a seekable binary stream, read in chunks and rewound afterwards"""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+class AnalysisCache:
+    """
+    Content-addressed cache of upload analyses keyed on the SHA-256 of the file
+    bytes, the analyzer kind and ANALYZER_VERSION. A bounded in-memory LRU sits in
+    front of an on-disk store shared by every gunicorn worker (one JSON file per
+    key, least recently used files pruned past max_disk_mb). Concurrent requests
+    for the same file wait on one computation instead of each running it.
+    Only successful analyses are stored.
+    """
+    def __init__(self, root, max_size=256, max_disk_mb=200):
+        self.root = root
+        self.max_size = max_size
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self._entries = OrderedDict()  # key -> serialized analysis
+        self._in_flight = {}  # key -> threading.Event set when its computation ends
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.shared = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def make_key(self, kind, digest):
+        return f'{kind}-v{ANALYZER_VERSION}-{digest}'
+    
+    def path(self, key):
+        return os.path.join(self.root, f'{key}.json')
+    
+    def _locked(self, key):
+        """
+        Exclusive lock shared by every gunicorn worker, striped on the last hex
+        digit pair of the hash (released when the file closes)
+        """
+        import fcntl
+        os.makedirs(self.root, exist_ok=True)
+        handle = open(os.path.join(self.root, f'{key[-2:]}.lock'), 'w')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+    
+    def _remember(self, key, payload):
+        """Add a serialized analysis to the memory LRU (caller holds the lock)"""
+        self._entries[key] = payload
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def _read_disk(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            os.utime(path)  # mark as recently used for pruning
+            return payload
+        except OSError:
+            return None
+    
+    def _write_disk(self, key, payload):
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+            self._prune_disk()
+        except OSError as e:
+            print(f"⚠ Could not store cached analysis {key}: {e}")
+    
+    def _prune_disk(self):
+        """Delete least recently used analyses until the store fits in max_disk_bytes"""
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+    
+    def get_or_compute(self, kind, digest, compute):
+        """
+        Return (analysis, source). source says where a cached analysis came from -
+        'memory', 'disk' or 'shared' (computed by a concurrent request this one
+        waited on) - and is None when compute() ran here. The analysis is always
+        a fresh copy the caller may modify.
+        """
+        key = self.make_key(kind, digest)
+        waited = False
+        while True:
+            with self._lock:
+                payload = self._entries.get(key)
+                if payload is not None:
+                    self._entries.move_to_end(key)
+                    if waited:
+                        self.shared += 1
+                    else:
+                        self.memory_hits += 1
+                    return json.loads(payload), 'shared' if waited else 'memory'
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    break
+            # Another request is analyzing the same file - wait, then look again
+            # (if its analysis failed, this request computes it next)
+            event.wait()
+            waited = True
+        
+        try:
+            # Other workers may be analyzing it too - whoever locks first computes
+            with self._locked(key):
+                payload = self._read_disk(key)
+                if payload is not None:
+                    analysis, source = json.loads(payload), 'disk'
+                else:
+                    analysis, source = compute(), None
+                    if not analysis.get('success'):
+                        with self._lock:
+                            self.misses += 1
+                        return analysis, None
+                    payload = json.dumps(analysis).encode('utf-8')
+                    self._write_disk(key, payload)
+            
+            with self._lock:
+                self._remember(key, payload)
+                if source == 'disk':
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+            return analysis, source
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+    
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits + self.shared
+            lookups = hits + self.misses
+            return {
+                'analyzer_version': ANALYZER_VERSION,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'max_disk_mb': round(self.max_disk_bytes / (1024 * 1024), 1),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'shared': self.shared,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0
+            }
+
+analysis_cache = AnalysisCache(ANALYSIS_CACHE_PATH,
+                               int(os.environ.get('ANALYSIS_CACHE_SIZE', 256)),
+                               float(os.environ.get('ANALYSIS_CACHE_DISK_MB', 200)))
+
+def cached_analysis(kind, stream, analyze):
+    """
+    Run analyze() through analysis_cache, keyed on the SHA-256 of the upload
+    stream (rewound before analyze() reads it). Adds cache_hit and cache_source
+    to the returned analysis.
+    """
+    if USE_ANALYSIS_CACHE:
+        analysis, source = analysis_cache.get_or_compute(kind, file_sha256(stream), analyze)
+    else:
+        analysis, source = analyze(), None
+    analysis['cache_hit'] = source is not None
+    analysis['cache_source'] = source
+    return analysis
+
+# ========================================
+# PREDICTION CACHE
+# ========================================
+
+# Decimal places the pricing forms allow (thickness/time step 0.1, DXF/SVG sizes rounded to 0.01)
+FEATURE_PRECISION = {
+    'thickness_mm': 1,
+    'width_mm': 2,
+    'height_mm': 2,
+    'cutting_time_minutes': 1
+}
+INTEGER_FEATURES = [
+    'num_letters', 'num_shapes', 'complexity_score',
+    'has_intricate_details', 'quantity', 'rush_job'
+]
+
+def normalize_job_features(job_data):
+    """Round floats to form precision and coerce integer fields - only model inputs are kept"""
+    normalized = {
+        'material': str(job_data.get('material', '')).strip(),
+        'cutting_type': str(job_data.get('cutting_type', '')).strip()
+    }
+    for field, places in FEATURE_PRECISION.items():
+        normalized[field] = round(float(job_data.get(field, 0) or 0), places)
+    for field in INTEGER_FEATURES:
+        normalized[field] = int(job_data.get(field, 0) or 0)
+    return normalized
+
+class PredictionCache:
+    """
+    Bounded LRU cache of (rounded price, interval) keyed on normalized job features.
+    Entries are tagged with the model version; bumping the version (retrain)
+    makes every older entry a miss at once.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.model_version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def make_key(self, job_data, feature_encoder):
+        """
+        Key on the one-hot slot each category resolves to plus the normalized numbers.
+        Unseen values all resolve to None and price identically anyway.
+        """
+        material_idx = feature_encoder.lookup('material', job_data['material'])
+        cutting_idx = feature_encoder.lookup('cutting_type', job_data['cutting_type'])
+        return (material_idx, cutting_idx) + tuple(
+            job_data[field] for field in list(FEATURE_PRECISION) + INTEGER_FEATURES
+        )
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self.model_version:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, price):
+        with self._lock:
+            self._entries[key] = (self.model_version, price)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def bump_version(self):
+        """Invalidate every cached price (call whenever the served model changes)"""
+        with self._lock:
+            self.model_version += 1
+            self._entries.clear()
+        return self.model_version
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'model_version': self.model_version,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+            }
+
+prediction_cache = PredictionCache(int(os.environ.get('PREDICTION_CACHE_SIZE', 1024)))
+
 # ========================================
 # PRICING FUNCTION
 # ========================================
@@ -1279,33 +2291,311 @@ def round_price_smartly(price):
         # ₦100,000+: round to nearest 1,000
         return math.ceil(price / 1000) * 1000
 
-def predict_price(job_data):
-    """Predict price using trained model - WITH SMART ROUNDING"""
-    if model is None or columns is None:
+def round_prices_smartly(prices):
+    """Vectorized round_price_smartly over an array of raw prices"""
+    prices = np.asarray(prices, dtype=np.float64)
+    steps = np.select(
+        [prices < 100, prices < 1000, prices < 10000, prices < 100000],
+        [10, 50, 100, 500],
+        default=1000
+    )
+    return np.ceil(prices / steps) * steps
+
+def predict_feature_matrix(X, estimator=None, serving_forest=None):
+    """Run the loaded model (or the given one) on an already-encoded feature matrix"""
+    if estimator is None:
+        estimator, serving_forest = model, flat_forest
+    if serving_forest is not None:
+        return serving_forest.predict(X)
+    
+    with warnings.catch_warnings():
+        # The forest was fitted on a DataFrame; the encoder guarantees the same column order
+        warnings.filterwarnings('ignore', message='X does not have valid feature names')
+        return estimator.predict(X)
+
+# Share of the individual tree predictions the price band covers
+PREDICTION_INTERVAL_COVERAGE = float(os.environ.get('PREDICTION_INTERVAL_COVERAGE', 0.8))
+# Band width relative to the price -> confidence label shown to sales staff
+CONFIDENCE_LEVELS = [(0.25, 'high'), (0.6, 'medium')]
+
+def tree_prediction_matrix(X, estimator=None, serving_forest=None):
+    """Per-tree predictions (n_rows, n_trees) for forest models, None for boosting"""
+    if estimator is None:
+        estimator, serving_forest = model, flat_forest
+    if serving_forest is not None:
+        return serving_forest.tree_predictions(X)
+    if not hasattr(estimator, 'estimators_'):
         return None
+    X = np.asarray(X, dtype=np.float32)
+    return np.column_stack([tree.predict(X) for tree in estimator.estimators_])
+
+def predict_with_intervals(X, estimator=None, serving_forest=None):
+    """
+    Mean price plus the spread of the individual trees in one pass.
+    Returns (raw_prices, low, high); low/high are None if the model has no trees to compare.
+    """
+    per_tree = tree_prediction_matrix(X, estimator, serving_forest)
+    if per_tree is None:
+        return predict_feature_matrix(X, estimator, serving_forest), None, None
+    
+    tail = (1 - PREDICTION_INTERVAL_COVERAGE) / 2
+    low, high = np.quantile(per_tree, [tail, 1 - tail], axis=1)
+    return per_tree.mean(axis=1), low, high
+
+def build_price_intervals(final_prices, low, high):
+    """Round the tree-spread band like the prices and label how confident the estimate is"""
+    if low is None:
+        return [None] * len(final_prices)
+    
+    low = np.minimum(round_prices_smartly(np.maximum(low, 0)), final_prices)
+    high = np.maximum(round_prices_smartly(high), final_prices)
+    relative_width = (high - low) / np.maximum(final_prices, 1)
+    
+    intervals = []
+    for lo, hi, width in zip(low, high, relative_width):
+        confidence = next((label for limit, label in CONFIDENCE_LEVELS if width <= limit), 'low')
+        intervals.append({
+            'low': int(lo),
+            'high': int(hi),
+            'coverage': PREDICTION_INTERVAL_COVERAGE,
+            'confidence': confidence
+        })
+    return intervals
+
+def predict_price(job_data, with_interval=False):
+    """
+    Predict price using trained model - WITH SMART ROUNDING.
+    With with_interval=True returns (price, interval), where interval is the
+    tree-spread band from build_price_intervals() (None for boosting models).
+    """
+    final_price, interval, _ = price_job(job_data)
+    return (final_price, interval) if with_interval else final_price
+
+def price_job(job_data):
+    """
+    Price one job: the standard price table on an exact match, then the
+    prediction cache, then the model. Returns (price, interval, pricing_path)
+    with pricing_path 'price_table', 'cache' or 'model' (all None on failure).
+    """
+    refresh_model_if_stale()
+    if model is None or encoder is None:
+        return None, None, None
     
     try:
-        job_df = pd.DataFrame([job_data])
-        job_df = pd.get_dummies(job_df, columns=['material', 'cutting_type'], 
-                                prefix=['mat', 'cut'])
+        job_data = normalize_job_features(job_data)
         
-        for col in columns:
-            if col not in job_df.columns:
-                job_df[col] = 0
+        # Hold the swap lock so encoder, model, table and cache version always belong together
+        with model_swap_lock:
+            cache_key = prediction_cache.make_key(job_data, encoder)
+            
+            standard = price_table.get(cache_key) if price_table is not None else None
+            cached = prediction_cache.get(cache_key) if standard is None else None
+            if standard is not None:
+                final_price, interval = standard
+                pricing_path = 'price_table'
+                print(f"Standard price: ₦{final_price:,.2f}")
+            elif cached is not None:
+                final_price, interval = cached
+                pricing_path = 'cache'
+                print(f"Cached price: ₦{final_price:,.2f}")
+            else:
+                pricing_path = 'model'
+                raw_prices, low, high = predict_with_intervals(encoder.encode([job_data]))
+                raw_price = raw_prices[0]
+                
+                # Apply smart rounding
+                final_price = round_price_smartly(raw_price)
+                interval = build_price_intervals(np.array([final_price]), low, high)[0]
+                
+                print(f"Raw price: ₦{raw_price:,.2f} → Rounded: ₦{final_price:,.2f}")
+                
+                prediction_cache.put(cache_key, (final_price, interval))
         
-        job_df = job_df[columns]
-        raw_price = model.predict(job_df)[0]
+        return final_price, interval, pricing_path
         
-        # Apply smart rounding
-        final_price = round_price_smartly(raw_price)
+    except Exception as e:
+        print(f"Error predicting price: {e}")
+        return None, None, None
+
+def predict_prices(jobs, with_interval=False):
+    """
+    Predict prices for many jobs at once - one encoded matrix, one model.predict call.
+    Returns a list of rounded prices in the same order as `jobs`, or None on failure.
+    With with_interval=True returns (prices, intervals).
+    Jobs go through normalize_job_features() like price_job(), so a job prices
+    the same here as on the single-item path.
+    """
+    refresh_model_if_stale()
+    if model is None or encoder is None:
+        return (None, None) if with_interval else None
+    
+    if not jobs:
+        return ([], []) if with_interval else []
+    
+    try:
+        jobs = [normalize_job_features(job_data) for job_data in jobs]
+        with model_swap_lock:
+            X = encoder.encode(jobs)
+            if with_interval:
+                raw_prices, low, high = predict_with_intervals(X)
+            else:
+                raw_prices = predict_feature_matrix(X)
+        final_prices = round_prices_smartly(raw_prices)
         
-        print(f"Raw price: ₦{raw_price:,.2f} → Rounded: ₦{final_price:,.2f}")
+        print(f"Batch priced {len(jobs)} items: raw total ₦{raw_prices.sum():,.2f} → "
+              f"rounded total ₦{final_prices.sum():,.2f}")
         
-        return final_price
+        prices = [int(p) for p in final_prices]
+        if with_interval:
+            return prices, build_price_intervals(final_prices, low, high)
+        return prices
         
     except Exception as e:
-        print(f"Error predicting price: {e}")
+        print(f"Error predicting batch prices: {e}")
+        return (None, None) if with_interval else None
+
+# ========================================
+# STANDARD PRICE TABLE
+# ========================================
+
+# Common walk-in jobs priced once per model version. A standard job is a plain
+# rectangle blank: STANDARD_JOB_FIELDS fixed, cutting time from its perimeter.
+# PRICE_TABLE_GRID may point at a JSON file overriding any of these axes.
+STANDARD_SHEET_MM = (1220, 2440)
+STANDARD_PRICE_GRID = {
+    'materials': None,  # None = every material the model was trained on
+    'thicknesses_mm': [1.5, 3, 4, 6, 9, 12, 18],
+    # Sheet fractions: full, half, quarter, eighth, sixteenth, thirty-second
+    'sizes_mm': [[1220, 2440], [1220, 1220], [610, 1220], [610, 610], [305, 610], [305, 305]],
+    'cutting_types': None,  # None = every cutting type the model was trained on
+    'quantities': [1, 2, 5, 10]
+}
+STANDARD_JOB_FIELDS = {
+    'num_letters': 0,
+    'num_shapes': 1,
+    'complexity_score': 1,
+    'has_intricate_details': 0,
+    'rush_job': 0
+}
+USE_PRICE_TABLE = os.environ.get('USE_PRICE_TABLE', '1') != '0'
+
+def load_price_table_grid():
+    """STANDARD_PRICE_GRID with any overrides from the PRICE_TABLE_GRID JSON file"""
+    grid = dict(STANDARD_PRICE_GRID)
+    grid_path = os.environ.get('PRICE_TABLE_GRID')
+    if grid_path:
+        try:
+            with open(grid_path) as f:
+                grid.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"⚠ Could not read PRICE_TABLE_GRID {grid_path}: {e} - using the default grid")
+    return grid
+
+def standard_cutting_time(width_mm, height_mm):
+    """Cutting time of a plain rectangle blank, as the file analyser would estimate it"""
+    return round(estimate_cutting_time(2 * (width_mm + height_mm), width_mm, height_mm), 1)
+
+def standard_price_jobs(feature_encoder, grid=None):
+    """Every job of the grid as normalized job_data dicts"""
+    grid = grid or load_price_table_grid()
+    materials = grid['materials'] or list(feature_encoder.category_index['material'])
+    cutting_types = grid['cutting_types'] or list(feature_encoder.category_index['cutting_type'])
+    
+    jobs = []
+    for material in materials:
+        for thickness in grid['thicknesses_mm']:
+            for width, height in grid['sizes_mm']:
+                cutting_time = standard_cutting_time(width, height)
+                for cutting_type in cutting_types:
+                    for quantity in grid['quantities']:
+                        jobs.append(normalize_job_features(dict(
+                            STANDARD_JOB_FIELDS,
+                            material=material,
+                            thickness_mm=thickness,
+                            width_mm=width,
+                            height_mm=height,
+                            cutting_type=cutting_type,
+                            cutting_time_minutes=cutting_time,
+                            quantity=quantity
+                        )))
+    return jobs
+
+class PriceTable:
+    """
+    Exact-match lookup of precomputed standard-job prices for one model
+    version, keyed like the prediction cache (resolved category slots plus
+    normalized numbers) so a hit needs no encoding at all.
+    """
+    def __init__(self, keys, prices, intervals):
+        self._entries = dict(zip(keys, zip(prices, intervals)))
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['keys'], data['prices'], data['intervals'])
+    
+    def to_dict(self):
+        keys = list(self._entries)
+        return {
+            'keys': keys,
+            'prices': [self._entries[key][0] for key in keys],
+            'intervals': [self._entries[key][1] for key in keys]
+        }
+    
+    def get(self, key):
+        return self._entries.get(key)
+    
+    def __len__(self):
+        return len(self._entries)
+
+def build_price_table(estimator, serving_forest, metadata, grid=None):
+    """Score the whole grid with one batched predict for the given model"""
+    started = time.perf_counter()
+    feature_encoder = build_feature_encoder(metadata['columns'], metadata.get('categories'))
+    jobs = standard_price_jobs(feature_encoder, grid)
+    if not jobs:
+        return None
+    
+    raw_prices, low, high = predict_with_intervals(feature_encoder.encode(jobs), estimator, serving_forest)
+    final_prices = round_prices_smartly(raw_prices)
+    table = PriceTable(
+        [prediction_cache.make_key(job, feature_encoder) for job in jobs],
+        [int(p) for p in final_prices],
+        build_price_intervals(final_prices, low, high)
+    )
+    print(f"✓ Standard price table: {len(table)} jobs in {time.perf_counter() - started:.3f}s")
+    return table
+
+def load_price_table(artifact_path, estimator, serving_forest, metadata):
+    """The table saved at promotion, or build it now (legacy models, manual activations)"""
+    if not USE_PRICE_TABLE or estimator is None:
+        return None
+    try:
+        table_path = price_table_path(artifact_path)
+        if artifact_path.endswith('.joblib') and os.path.exists(table_path):
+            return PriceTable.from_dict(joblib.load(table_path))
+        return build_price_table(estimator, serving_forest, metadata)
+    except Exception as e:
+        print(f"Standard price table unavailable, pricing everything with the model: {e}")
         return None
+
+price_table = load_price_table(MODEL_PATH, model, flat_forest, model_metadata) if columns else None
+
+def parse_job_data(data):
+    """Build the model's job_data dict from a pricing form / bulk item payload"""
+    return {
+        'material': data['material'],
+        'thickness_mm': float(data['thickness']),
+        'num_letters': int(data.get('letters', 0)),
+        'num_shapes': int(data.get('shapes', 1)),
+        'complexity_score': int(data.get('complexity', 3)),
+        'has_intricate_details': int(data.get('details', 0)),
+        'width_mm': float(data['width']),
+        'height_mm': float(data['height']),
+        'cutting_type': data['cuttingType'],
+        'cutting_time_minutes': float(data['time']),
+        'quantity': int(data.get('quantity', 1)),
+        'rush_job': int(data.get('rush', 0))
+    }
 # ========================================
 # HELPER FUNCTIONS
 # ========================================
@@ -1672,8 +2962,9 @@ def analyze_file():
         return jsonify({'success': False, 'error': 'Only SVG files supported'})
     
     try:
-        svg_content = file.read().decode('utf-8')
-        analysis = analyze_svg_file(svg_content)
+        analysis = cached_analysis(
+            'svg', file.stream, lambda: analyze_svg_file(file.stream.read().decode('utf-8'))
+        )
         return jsonify(analysis)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -2359,8 +3650,8 @@ def analyze_dxf_file_route():
         return jsonify({'success': False, 'error': 'Only DXF files supported'})
     
     try:
-        dxf_content = file.read()
-        analysis = analyze_dxf_file(dxf_content)
+        # The upload's own stream - large files are analyzed without reading them into memory
+        analysis = cached_analysis('dxf', file.stream, lambda: analyze_dxf_file(file.stream))
         return jsonify(analysis)
     except Exception as e:
         import traceback
@@ -2405,6 +3696,77 @@ def debug_upload():
 # SMART PRICING WITH INVENTORY INTEGRATION
 # ========================================
 
+def inventory_missing_result(material, thickness, color, alternatives):
+    """check_material_availability() answer when no stock row matched (alternatives: same material/thickness, any colour)"""
+    if alternatives:
+        alt_colors = [
+            f"{item.color} ({item.quantity_on_hand} sheets)" 
+            for item in alternatives 
+            if item.quantity_on_hand > 0
+        ]
+        
+        return {
+            'available': False,
+            'in_stock': False,
+            'stock_count': 0,
+            'material_cost': 0,
+            'message': f'{material} {thickness}mm in {color} not found',
+            'alternatives': alt_colors,
+            'warning': f'Available in: {", ".join(alt_colors)}' if alt_colors else 'Material not in inventory'
+        }
+    else:
+        return {
+            'available': False,
+            'in_stock': False,
+            'stock_count': 0,
+            'material_cost': 0,
+            'message': f'{material} ({thickness}mm) not found in inventory',
+            'warning': 'Material not tracked in inventory'
+        }
+
+def inventory_found_result(inventory_item, width_mm, height_mm):
+    """check_material_availability() answer for the matched stock row"""
+    # Calculate area needed in square feet
+    area_sq_mm = width_mm * height_mm
+    area_sq_ft = area_sq_mm / 92903
+    
+    # Calculate material cost
+    material_cost = area_sq_ft * inventory_item.price_per_sq_ft
+    
+    # Check if enough stock
+    in_stock = inventory_item.quantity_on_hand > 0
+    
+    result = {
+        'available': True,
+        'in_stock': in_stock,
+        'stock_count': inventory_item.quantity_on_hand,
+        'material_cost': round(material_cost, 2),
+        'price_per_sq_ft': inventory_item.price_per_sq_ft,
+        'price_per_sheet': inventory_item.price_per_sheet,
+        'area_sq_ft': round(area_sq_ft, 4),
+        'color': inventory_item.color,
+        'inventory_id': inventory_item.id
+    }
+    
+    if in_stock:
+        result['message'] = f'✅ In Stock ({inventory_item.quantity_on_hand} sheets available)'
+    else:
+        result['message'] = f'❌ Out of Stock - Need to reorder'
+        result['warning'] = 'Material currently unavailable'
+    
+    return result
+
+def inventory_error_result(e):
+    print(f"Error checking inventory: {e}")
+    return {
+        'available': False,
+        'in_stock': False,
+        'stock_count': 0,
+        'material_cost': 0,
+        'message': 'Error checking inventory',
+        'error': str(e)
+    }
+
 def check_material_availability(material, thickness, width_mm, height_mm, color=None):
     """
     Check if material is available in inventory (with color matching)
@@ -2420,81 +3782,70 @@ def check_material_availability(material, thickness, width_mm, height_mm, color=
         if color:
             query = query.filter(db.func.lower(Inventory.color) == color.lower())
         
-        inventory_item = query.first()
+        inventory_item = query.order_by(Inventory.id).first()
         
         if not inventory_item:
             # Check if material exists in other colors
             alternatives = Inventory.query.filter(
                 db.func.lower(Inventory.material_name) == material.lower(),
                 Inventory.thickness_mm == thickness
-            ).all()
+            ).order_by(Inventory.id).all()
             
-            if alternatives:
-                alt_colors = [
-                    f"{item.color} ({item.quantity_on_hand} sheets)" 
-                    for item in alternatives 
-                    if item.quantity_on_hand > 0
-                ]
-                
-                return {
-                    'available': False,
-                    'in_stock': False,
-                    'stock_count': 0,
-                    'material_cost': 0,
-                    'message': f'{material} {thickness}mm in {color} not found',
-                    'alternatives': alt_colors,
-                    'warning': f'Available in: {", ".join(alt_colors)}' if alt_colors else 'Material not in inventory'
-                }
-            else:
-                return {
-                    'available': False,
-                    'in_stock': False,
-                    'stock_count': 0,
-                    'material_cost': 0,
-                    'message': f'{material} ({thickness}mm) not found in inventory',
-                    'warning': 'Material not tracked in inventory'
-                }
+            return inventory_missing_result(material, thickness, color, alternatives)
         
-        # Calculate area needed in square feet
-        area_sq_mm = width_mm * height_mm
-        area_sq_ft = area_sq_mm / 92903
-        
-        # Calculate material cost
-        material_cost = area_sq_ft * inventory_item.price_per_sq_ft
-        
-        # Check if enough stock
-        in_stock = inventory_item.quantity_on_hand > 0
-        
-        result = {
-            'available': True,
-            'in_stock': in_stock,
-            'stock_count': inventory_item.quantity_on_hand,
-            'material_cost': round(material_cost, 2),
-            'price_per_sq_ft': inventory_item.price_per_sq_ft,
-            'price_per_sheet': inventory_item.price_per_sheet,
-            'area_sq_ft': round(area_sq_ft, 4),
-            'color': inventory_item.color,
-            'inventory_id': inventory_item.id
-        }
+        return inventory_found_result(inventory_item, width_mm, height_mm)
         
-        if in_stock:
-            result['message'] = f'✅ In Stock ({inventory_item.quantity_on_hand} sheets available)'
-        else:
-            result['message'] = f'❌ Out of Stock - Need to reorder'
-            result['warning'] = 'Material currently unavailable'
+    except Exception as e:
+        return inventory_error_result(e)
+
+class InventoryResolver:
+    """
+    Answers check_material_availability() for many items from a single
+    Inventory query. Every needed (material, thickness) is loaded up front and
+    indexed by lower-cased material, thickness and colour; results are built by
+    the same helpers as the single-item path, so they match it exactly.
+    """
+    def __init__(self, material_thicknesses):
+        needed = {(str(material).lower(), float(thickness)) for material, thickness in material_thicknesses}
+        self.rows = {}        # (material, thickness) -> stock rows in id order
+        self.by_color = {}    # (material, thickness, colour) -> first stock row in id order
+        self.error = None
+        if not needed:
+            return
         
-        return result
+        try:
+            items = Inventory.query.filter(
+                db.func.lower(Inventory.material_name).in_({material for material, _ in needed}),
+                Inventory.thickness_mm.in_({thickness for _, thickness in needed})
+            ).order_by(Inventory.id).all()
+        except Exception as e:
+            self.error = e
+            return
         
-    except Exception as e:
-        print(f"Error checking inventory: {e}")
-        return {
-            'available': False,
-            'in_stock': False,
-            'stock_count': 0,
-            'material_cost': 0,
-            'message': 'Error checking inventory',
-            'error': str(e)
-        }
+        for item in items:
+            key = (item.material_name.lower(), item.thickness_mm)
+            if key not in needed:
+                continue
+            self.rows.setdefault(key, []).append(item)
+            self.by_color.setdefault(key + ((item.color or '').lower(),), item)
+    
+    def check(self, material, thickness, width_mm, height_mm, color=None):
+        """Same answer as check_material_availability() for one item"""
+        if self.error is not None:
+            return inventory_error_result(self.error)
+        try:
+            key = (material.lower(), float(thickness))
+            if color:
+                inventory_item = self.by_color.get(key + (color.lower(),))
+            else:
+                inventory_item = (self.rows.get(key) or [None])[0]
+            
+            if not inventory_item:
+                return inventory_missing_result(material, thickness, color, self.rows.get(key, []))
+            
+            return inventory_found_result(inventory_item, width_mm, height_mm)
+        except Exception as e:
+            return inventory_error_result(e)
 
 # ========================================
 # UPDATED CALCULATE PRICE ROUTE
@@ -2506,26 +3857,13 @@ def calculate_price():
     try:
         data = request.get_json()
         
-        job_data = {
-            'material': data['material'],
-            'thickness_mm': float(data['thickness']),
-            'num_letters': int(data.get('letters', 0)),
-            'num_shapes': int(data.get('shapes', 1)),
-            'complexity_score': int(data.get('complexity', 3)),
-            'has_intricate_details': int(data.get('details', 0)),
-            'width_mm': float(data['width']),
-            'height_mm': float(data['height']),
-            'cutting_type': data['cuttingType'],
-            'cutting_time_minutes': float(data['time']),
-            'quantity': int(data.get('quantity', 1)),
-            'rush_job': int(data.get('rush', 0))
-        }
+        job_data = parse_job_data(data)
         
         # Get color if provided
         color = data.get('color')
         
-        # Get AI predicted price
-        price = predict_price(job_data)
+        # Get AI predicted price and how far the individual trees disagree
+        price, interval, pricing_path = price_job(job_data)
         
         if price is None:
             return jsonify({'success': False, 'error': 'Could not calculate price'})
@@ -2543,6 +3881,8 @@ def calculate_price():
         response = {
             'success': True,
             'price': price,
+            'price_interval': interval,
+            'pricing_path': pricing_path,
             'inventory': inventory_check
         }
         
@@ -2571,7 +3911,11 @@ def calculate_price():
 
 @app.route('/calculate_bulk_prices', methods=['POST'])
 def calculate_bulk_prices():
-    """Calculate prices for multiple items with inventory checks"""
+    """
+    Calculate prices for multiple items with inventory checks.
+    An item whose fields cannot be parsed gets price null and an error of its
+    own; the rest of the order is still priced.
+    """
     try:
         items = request.get_json().get('items', [])
         results = []
@@ -2580,33 +3924,51 @@ def calculate_bulk_prices():
         all_in_stock = True
         warnings = []
         
+        parsed = []  # job_data, or the error message for an item that could not be parsed
         for item in items:
-            job_data = {
-                'material': item['material'],
-                'thickness_mm': float(item['thickness']),
-                'num_letters': int(item.get('letters', 0)),
-                'num_shapes': int(item.get('shapes', 1)),
-                'complexity_score': int(item.get('complexity', 3)),
-                'has_intricate_details': int(item.get('details', 0)),
-                'width_mm': float(item['width']),
-                'height_mm': float(item['height']),
-                'cutting_type': item['cuttingType'],
-                'cutting_time_minutes': float(item['time']),
-                'quantity': int(item.get('quantity', 1)),
-                'rush_job': int(item.get('rush', 0))
-            }
+            try:
+                parsed.append(parse_job_data(item))
+            except KeyError as e:
+                parsed.append(f"Missing field {e}")
+            except (TypeError, ValueError) as e:
+                parsed.append(f"Invalid value: {e}")
+        job_list = [job for job in parsed if isinstance(job, dict)]
+        
+        # One vectorized prediction for the whole order
+        prices, intervals = predict_prices(job_list, with_interval=True)
+        if prices is None:
+            prices = intervals = [None] * len(job_list)
+        priced = iter(zip(prices, intervals))
+        
+        # One inventory query for every material/thickness in the order
+        resolver = InventoryResolver({(job['material'], job['thickness_mm']) for job in job_list})
+        
+        for item, job_data in zip(items, parsed):
+            if not isinstance(job_data, dict):
+                results.append({
+                    'item_id': item.get('id'),
+                    'price': None,
+                    'price_interval': None,
+                    'inventory': None,
+                    'material_cost': 0,
+                    'error': job_data
+                })
+                warnings.append(f"{item.get('name', 'Item')}: could not be priced ({job_data})")
+                continue
             
-            price = predict_price(job_data)
-            inventory_check = check_material_availability(
+            price, interval = next(priced)
+            inventory_check = resolver.check(
                 job_data['material'],
                 job_data['thickness_mm'],
                 job_data['width_mm'],
-                job_data['height_mm']
+                job_data['height_mm'],
+                item.get('color')  # Same colour matching as calculate_price
             )
             
             item_result = {
                 'item_id': item.get('id'),
                 'price': price,
+                'price_interval': interval,
                 'inventory': inventory_check,
                 'material_cost': inventory_check['material_cost'] * job_data['quantity']
             }
@@ -2632,18 +3994,229 @@ def calculate_bulk_prices():
         return jsonify({'success': False, 'error': str(e)})
 
 # ========================================
-# QUOTE MANAGEMENT ROUTES
+# WHAT-IF PRICE MATRIX
 # ========================================
 
-# ========================================
-# APPLY DISCOUNT TO QUOTE
-# ========================================
+# Form fields a what-if axis may vary (the keys parse_job_data reads)
+PRICE_MATRIX_AXES = ['material', 'thickness', 'width', 'height', 'cuttingType', 'quantity',
+                     'time', 'letters', 'shapes', 'complexity', 'details', 'rush']
+MAX_PRICE_MATRIX_CELLS = int(os.environ.get('MAX_PRICE_MATRIX_CELLS', 2000))
 
-@app.route('/api/quote/<int:quote_id>/apply-discount', methods=['POST'])
-def apply_discount_to_quote(quote_id):
+@app.route('/calculate_price_matrix', methods=['POST'])
+def calculate_price_matrix():
     """
-    Apply discount to an existing saved quote
-    Allows: 2%, 5%, 10%, or custom percentage
+    Price one job across every combination of the given axes, e.g.
+    {"job": {...pricing form...}, "axes": {"quantity": [1, 5, 10], "thickness": [3, 6]}}.
+    All cells are scored in one vectorized predict and stock comes from one inventory query.
+    Cells are returned in row-major order of the axes as given.
+    """
+    try:
+        import itertools
+        
+        data = request.get_json() or {}
+        base = data.get('job') or {}
+        axes = data.get('axes') or {}
+        
+        unknown = [name for name in axes if name not in PRICE_MATRIX_AXES]
+        if unknown:
+            return jsonify({'success': False, 'error': f"Cannot vary {', '.join(unknown)}. "
+                                                       f"Allowed axes: {', '.join(PRICE_MATRIX_AXES)}"}), 400
+        if not axes or any(not isinstance(values, list) or not values for values in axes.values()):
+            return jsonify({'success': False, 'error': 'Give at least one axis with a list of values'}), 400
+        
+        axis_names = list(axes)
+        shape = [len(axes[name]) for name in axis_names]
+        if int(np.prod(shape)) > MAX_PRICE_MATRIX_CELLS:
+            return jsonify({'success': False, 'error': f'Too many combinations ({int(np.prod(shape))}). '
+                                                       f'Maximum: {MAX_PRICE_MATRIX_CELLS}'}), 400
+        
+        combinations = list(itertools.product(*[axes[name] for name in axis_names]))
+        job_list = [parse_job_data(dict(base, **dict(zip(axis_names, values)))) for values in combinations]
+        
+        # One vectorized prediction for the whole grid
+        prices, intervals = predict_prices(job_list, with_interval=True)
+        if prices is None:
+            return jsonify({'success': False, 'error': 'Could not calculate price'})
+        
+        # One inventory query for every material/thickness in the grid
+        color = base.get('color')
+        resolver = InventoryResolver({(job['material'], job['thickness_mm']) for job in job_list})
+        
+        inventory_by_size = {}
+        cells = []
+        for values, job_data, price, interval in zip(combinations, job_list, prices, intervals):
+            size_key = (job_data['material'], job_data['thickness_mm'], job_data['width_mm'], job_data['height_mm'])
+            if size_key not in inventory_by_size:
+                inventory_by_size[size_key] = resolver.check(*size_key, color)
+            inventory_check = inventory_by_size[size_key]
+            
+            cells.append({
+                'values': dict(zip(axis_names, values)),
+                'price': price,
+                'price_interval': interval,
+                'material_cost': round(inventory_check['material_cost'] * job_data['quantity'], 2),
+                'in_stock': inventory_check['in_stock']
+            })
+        
+        # Stock and unit cost per material/thickness cell (at the job's size)
+        inventory = []
+        seen = set()
+        for job_data in job_list:
+            key = (job_data['material'], job_data['thickness_mm'])
+            if key in seen:
+                continue
+            seen.add(key)
+            inventory.append({
+                'material': job_data['material'],
+                'thickness': job_data['thickness_mm'],
+                'inventory': inventory_by_size[key + (job_data['width_mm'], job_data['height_mm'])]
+            })
+        
+        return jsonify({
+            'success': True,
+            # A list, since JSON objects do not keep the axis order the cells follow
+            'axes': [{'name': name, 'values': axes[name]} for name in axis_names],
+            'shape': shape,
+            'cells': cells,
+            'inventory': inventory
+        })
+        
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': f'Invalid job data: {e}'}), 400
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)})
+
+# ========================================
+# ANALYZE AND PRICE PIPELINE
+# ========================================
+
+def dxf_item_pricing_form(item, shared):
+    """Pricing form (the fields parse_job_data reads) for one analyzed DXF job"""
+    return dict(
+        shared,
+        letters=item['num_letters'],
+        shapes=item['num_shapes'],
+        complexity=item['complexity_score'],
+        details=item['has_intricate_details'],
+        width=item['width_mm'],
+        height=item['height_mm'],
+        time=item['cutting_time_minutes']
+    )
+
+@app.route('/analyze_and_price', methods=['POST'])
+def analyze_and_price():
+    """
+    Analyze an uploaded DXF and price every job found in it in one round trip.
+    Multipart form: file plus the job parameters shared by all items
+    (material, thickness, color, cuttingType, quantity, rush).
+    Stock for the shared material is loaded once before analysis, each item's
+    job data and stock check are built as soon as its cluster is analyzed, and
+    all items are priced by a single vectorized predict at the end. A file seen
+    before skips analysis via analysis_cache; only pricing and stock run again.
+    """
+    if 'file' not in request.files:
+        return jsonify({'success': False, 'error': 'No file uploaded'})
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'success': False, 'error': 'No file selected'})
+    
+    if not file.filename.lower().endswith('.dxf'):
+        return jsonify({'success': False, 'error': 'Only DXF files supported'})
+    
+    material = request.form.get('material', '').strip()
+    thickness = request.form.get('thickness', '').strip()
+    if not material or not thickness:
+        return jsonify({'success': False, 'error': 'Material and thickness are required'}), 400
+    
+    try:
+        color = request.form.get('color') or None
+        shared = {
+            'material': material,
+            'thickness': float(thickness),
+            'cuttingType': request.form.get('cuttingType') or 'Laser Cutting',
+            'quantity': int(request.form.get('quantity') or 1),
+            'rush': int(request.form.get('rush') or 0)
+        }
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid job data: {e}'}), 400
+    
+    try:
+        # Every item shares the material, so one inventory query covers the file
+        resolver = InventoryResolver({(material, shared['thickness'])})
+        
+        staged = {}  # id(analyzed item) -> (job_data, inventory_check)
+        
+        def stage_item(item):
+            job_data = parse_job_data(dxf_item_pricing_form(item, shared))
+            inventory_check = resolver.check(job_data['material'], job_data['thickness_mm'],
+                                             job_data['width_mm'], job_data['height_mm'], color)
+            staged[id(item)] = (job_data, inventory_check)
+            return staged[id(item)]
+        
+        analysis = cached_analysis('dxf', file.stream,
+                                   lambda: analyze_dxf_file(file.stream, on_job=stage_item))
+        if not analysis['success']:
+            return jsonify(analysis)
+        
+        # Cached analyses and fallback items (e.g. the default "Design") never went
+        # through a cluster here, so they are staged now
+        items = analysis['items']
+        staged_items = [staged.get(id(item)) or stage_item(item) for item in items]
+        
+        # One vectorized prediction for every job in the file
+        prices, intervals = predict_prices([job_data for job_data, _ in staged_items], with_interval=True)
+        if prices is None:
+            return jsonify({'success': False, 'error': 'Could not calculate price'})
+        
+        total_price = 0
+        total_material_cost = 0
+        all_in_stock = True
+        warnings = []
+        
+        for item, (job_data, inventory_check), price, interval in zip(items, staged_items, prices, intervals):
+            item.update({
+                'price': price,
+                'price_interval': interval,
+                'inventory': inventory_check,
+                'material_cost': round(inventory_check['material_cost'] * job_data['quantity'], 2)
+            })
+            total_price += price
+            total_material_cost += item['material_cost']
+            
+            if not inventory_check['in_stock']:
+                all_in_stock = False
+                warnings.append(f"{item['name']}: {inventory_check['message']}")
+        
+        analysis.update({
+            'job': dict(shared, color=color),
+            'total_price': total_price,
+            'total_material_cost': round(total_material_cost, 2),
+            'all_in_stock': all_in_stock,
+            'warnings': warnings if warnings else None
+        })
+        return jsonify(analysis)
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)})
+
+# ========================================
+# QUOTE MANAGEMENT ROUTES
+# ========================================
+
+# ========================================
+# APPLY DISCOUNT TO QUOTE
+# ========================================
+
+@app.route('/api/quote/<int:quote_id>/apply-discount', methods=['POST'])
+def apply_discount_to_quote(quote_id):
+    """
+    Apply discount to an existing saved quote
+    Allows: 2%, 5%, 10%, or custom percentage
     Minimum amount: ₦10,500
     """
     try:
@@ -3646,7 +5219,27 @@ def add_training_job():
         db.session.add(new_entry)
         db.session.commit()
         
-        return jsonify({"success": True, "message": "Job added to database!"})
+        response = {"success": True, "message": "Job added to database!"}
+        
+        # Keep the encoded feature store current so retraining skips data preparation
+        if USE_FEATURE_STORE:
+            try:
+                training_feature_store.sync()
+            except Exception as e:
+                print(f"⚠ Feature store append failed ({e}) - the next retrain will catch up")
+        
+        # Cheap warm-start refresh every few new jobs, if enabled. Counted from the
+        # last attempt too, so a rejected or failed refresh is not resubmitted per job
+        if INCREMENTAL_RETRAIN_EVERY > 0:
+            last_id = read_model_metadata().get('last_training_id')
+            attempted_id = read_incremental_watermark()
+            if last_id is not None and attempted_id is not None:
+                last_id = max(last_id, attempted_id)
+            if last_id is not None and new_entry.id - last_id >= INCREMENTAL_RETRAIN_EVERY:
+                status, _ = training_jobs.submit(mode='incremental')
+                response['retrain_job_id'] = status['job_id']
+        
+        return jsonify(response)
         
     except Exception as e:
         print(f"ERROR Adding Job: {e}") 
@@ -3657,12 +5250,11 @@ def add_training_job():
 def get_training_stats():
     """Get current training data statistics"""
     try:
-        # Try to load model metadata first
-        if os.path.exists(MODEL_PATH):
-            with open(MODEL_PATH, 'rb') as f:
-                saved_data = pickle.load(f)
-                total_jobs = saved_data.get('total_jobs', 0)
-                r2_score_val = saved_data.get('r2_score', 0)
+        # Try to load model metadata first (sidecar only - never the estimator)
+        saved_data = read_model_metadata()
+        if saved_data:
+            total_jobs = saved_data.get('total_jobs', 0)
+            r2_score_val = saved_data.get('r2_score', 0)
         else:
             # Fallback to CSV count
             if os.path.exists(CSV_PATH):
@@ -3681,127 +5273,1426 @@ def get_training_stats():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/retrain_model', methods=['POST'])
-@requires_auth
-def retrain_model():
-    """Retrain the pricing model with current data from Supabase"""
-    # Declare globals at the start of the function
-    global model, columns, MODEL_PATH
-    
-    try:
-        from sklearn.model_selection import train_test_split
-        from sklearn.metrics import mean_absolute_error, r2_score as calculate_r2
-        from sklearn.ensemble import RandomForestRegressor
-        import pandas as pd
-        import pickle
-        import os
+# ========================================
+# MODEL TRAINING PIPELINE
+# ========================================
 
-        # 1. Load data from Supabase instead of CSV
-        # We query the TrainingData model and convert it to a DataFrame
-        records = TrainingData.query.all()
-        if not records:
-             return jsonify({
-                'success': False,
-                'error': 'The training_data table is empty. Add some jobs first!'
+class RetrainRejected(Exception):
+    """Training data does not meet the retrain requirements (message is user-facing)"""
+
+# Feature columns pulled for training, in model order, with the compact dtypes they are stored as.
+# Trees split on float32 anyway, so float32 features lose nothing.
+TRAINING_COLUMN_DTYPES = {
+    'material': 'category',
+    'thickness_mm': np.float32,
+    'num_letters': np.int32,
+    'num_shapes': np.int32,
+    'complexity_score': np.int16,
+    'has_intricate_details': np.int16,
+    'width_mm': np.float32,
+    'height_mm': np.float32,
+    'cutting_type': 'category',
+    'cutting_time_minutes': np.float32,
+    'quantity': np.int32,
+    'rush_job': np.int16,
+    'price': np.float64
+}
+TRAINING_LOAD_CHUNK_SIZE = int(os.environ.get('TRAINING_LOAD_CHUNK_SIZE', 5000))
+
+def load_training_dataframe(chunk_size=None, recent=None, since_id=None):
+    """
+    Load the training_data table into a cleaned, compactly typed DataFrame (needs app context).
+    Selects only the feature columns with a Core query and streams them in chunks
+    (server-side cursor on Postgres), so no ORM objects or per-row dicts are built.
+    `recent` limits the load to the newest N rows. `since_id` loads only rows
+    with a higher id, adds an `id` column and may return an empty frame.
+    """
+    from sqlalchemy import select
+    
+    chunk_size = chunk_size or TRAINING_LOAD_CHUNK_SIZE
+    dtypes = dict(TRAINING_COLUMN_DTYPES)
+    if since_id is not None:
+        dtypes = {'id': np.int64, **dtypes}
+    names = list(dtypes)
+    table = TrainingData.__table__
+    
+    # 1. Load data from Supabase instead of CSV
+    stmt = select(*[table.c[name] for name in names])
+    if since_id is not None:
+        stmt = stmt.where(table.c.id > since_id).order_by(table.c.id)
+    elif recent:
+        stmt = stmt.order_by(table.c.id.desc()).limit(recent)
+    else:
+        stmt = stmt.order_by(table.c.id)
+    result = db.session.execute(
+        stmt.execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    
+    chunks = {name: [] for name in names}
+    for partition in result.partitions():
+        raw = dict(zip(names, zip(*partition)))
+        
+        # 2. Data Cleaning - NULL/non-numeric values become NaN and their rows are dropped
+        columns_in_chunk = {}
+        valid = np.ones(len(partition), dtype=bool)
+        for name, dtype in dtypes.items():
+            if dtype == 'category':
+                values = np.array(raw[name], dtype=object)
+                valid &= np.array([v is not None for v in values], dtype=bool)
+            else:
+                try:
+                    # Core rows are already typed; NULLs become NaN
+                    values = np.array(raw[name], dtype=np.float64)
+                except (TypeError, ValueError):
+                    values = pd.to_numeric(np.array(raw[name], dtype=object), errors='coerce').astype(np.float64)
+                valid &= ~np.isnan(values)
+            columns_in_chunk[name] = values
+        
+        for name, dtype in dtypes.items():
+            values = columns_in_chunk[name][valid]
+            chunks[name].append(values if dtype == 'category' else values.astype(dtype))
+    
+    if not chunks['price'] or sum(len(c) for c in chunks['price']) == 0:
+        if since_id is not None:
+            return pd.DataFrame({
+                name: pd.Categorical([]) if dtype == 'category' else np.empty(0, dtype=dtype)
+                for name, dtype in dtypes.items()
             })
-            
-        df = pd.DataFrame([r.to_dict() for r in records])
-        
-        # 2. Data Cleaning (Ensuring all numeric fields are proper floats/ints)
-        numeric_cols = [
-            'thickness_mm', 'width_mm', 'height_mm', 'num_letters', 
-            'num_shapes', 'complexity_score', 'cutting_time_minutes', 
-            'quantity', 'price'
-        ]
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        # Remove any rows that failed conversion
-        df = df.dropna()
+        raise RetrainRejected('The training_data table is empty. Add some jobs first!')
+    
+    frame = pd.DataFrame({
+        name: pd.Categorical(np.concatenate(chunks[name])) if dtype == 'category'
+              else np.concatenate(chunks[name])
+        for name, dtype in dtypes.items()
+    })
+    # Newest-first query, but callers always get rows in id order
+    return frame.iloc[::-1].reset_index(drop=True) if recent and since_id is None else frame
 
-        # 3. Training Requirements Logic
-        prev_total = 0
-        if os.path.exists(MODEL_PATH):
-            try:
-                with open(MODEL_PATH, 'rb') as f:
-                    prev_saved = pickle.load(f)
-                    prev_total = int(prev_saved.get('total_jobs', 0) or 0)
-            except Exception:
-                prev_total = 0
+# ============================================================================
+# ENCODED FEATURE STORE
+# ============================================================================
 
-        new_jobs = max(0, len(df) - prev_total)
+FEATURE_STORE_PATH = os.path.join(INSTANCE_PATH, 'feature_store')
+USE_FEATURE_STORE = os.environ.get('USE_FEATURE_STORE', '1') != '0'
+# Ids are assigned at insert but visible only at commit, so concurrent inserts can commit
+# out of order - each sync re-checks this many ids below the store's last_id for late rows
+FEATURE_STORE_RESCAN_IDS = int(os.environ.get('FEATURE_STORE_RESCAN_IDS', 200))
 
-        # Requirement: At least 20 total jobs, and 20 NEW jobs if a model exists
-        if prev_total > 0:
-            if new_jobs < 20:
-                return jsonify({
-                    'success': False,
-                    'error': f'Need at least 20 NEW jobs since last model. New jobs: {new_jobs} (Total: {len(df)})'
-                })
+class TrainingFeatureStore:
+    """
+    Append-only, column-per-file copy of training_data on the instance volume.
+    Each column is a raw NumPy array file that retraining memory-maps. material
+    and cutting_type are stored as int16 codes into an append-only category
+    dictionary, so a new material extends the dictionary and no old row is
+    rewritten. header.json holds the committed row count; bytes past it belong
+    to an interrupted append and are truncated before the next one. Rows are
+    never updated in place: each sync compares a fingerprint of the stored rows
+    with the table and rebuilds the store when they differ (edited or deleted
+    rows); rebuild() does it on demand.
+    """
+    
+    CODE_DTYPE = np.int16
+    
+    def __init__(self, root):
+        self.root = root
+        self.columns = {'id': np.dtype(np.int64)}
+        for name, dtype in TRAINING_COLUMN_DTYPES.items():
+            self.columns[name] = np.dtype(self.CODE_DTYPE if dtype == 'category' else dtype)
+    
+    def column_path(self, name):
+        return os.path.join(self.root, f'{name}.bin')
+    
+    @property
+    def header_path(self):
+        return os.path.join(self.root, 'header.json')
+    
+    def read_header(self):
+        try:
+            with open(self.header_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self.empty_header()
+    
+    def _locked(self):
+        """Exclusive lock shared by every gunicorn worker (released when the file closes)"""
+        import fcntl
+        os.makedirs(self.root, exist_ok=True)
+        handle = open(os.path.join(self.root, 'store.lock'), 'w')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+    
+    def _append(self, header, df):
+        """Append a frame from load_training_dataframe(since_id=...) (caller holds the lock)"""
+        rows = header['rows']
+        encoded = {}
+        for name in CATEGORICAL_FEATURES:
+            dictionary = header['categories'][name]
+            index = {value: code for code, value in enumerate(dictionary)}
+            values = df[name].astype(object).to_numpy()
+            for value in pd.unique(values):
+                if value not in index:
+                    index[value] = len(dictionary)
+                    dictionary.append(value)
+            encoded[name] = np.array([index[v] for v in values], dtype=self.CODE_DTYPE)
+        
+        for name, dtype in self.columns.items():
+            values = encoded[name] if name in encoded else df[name].to_numpy(dtype=dtype)
+            with open(self.column_path(name), 'ab') as f:
+                f.truncate(rows * dtype.itemsize)
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        
+        header['rows'] = rows + len(df)
+        header['last_id'] = max(header['last_id'], int(df['id'].max()))
+        write_json_atomic(self.header_path, header)
+    
+    def stored_ids(self, header, above_id):
+        """Ids of the stored rows greater than above_id"""
+        ids = np.memmap(self.column_path('id'), dtype=self.columns['id'], mode='r', shape=(header['rows'],))
+        return np.asarray(ids[ids > above_id])
+    
+    def empty_header(self):
+        return {'rows': 0, 'last_id': 0, 'categories': {name: [] for name in CATEGORICAL_FEATURES}}
+    
+    def fingerprint(self, header):
+        """Row count and column sums of the stored rows, comparable with table_fingerprint()"""
+        rows = header['rows']
+        columns = {
+            name: np.memmap(self.column_path(name), dtype=self.columns[name], mode='r', shape=(rows,))
+            for name in ('id', 'quantity', 'price', *CATEGORICAL_FEATURES)
+        }
+        fingerprint = {
+            'rows': rows,
+            'id': int(columns['id'].sum(dtype=np.int64)),
+            'quantity': int(columns['quantity'].sum(dtype=np.int64)),
+            'price': float(columns['price'].sum())
+        }
+        for name in CATEGORICAL_FEATURES:
+            lengths = np.array([len(value) for value in header['categories'][name]] or [0], dtype=np.int64)
+            fingerprint[name] = int(lengths[columns[name]].sum())
+        return fingerprint
+    
+    def table_fingerprint(self, last_id):
+        """The same row count and sums over training_data rows up to last_id (needs app context)"""
+        from sqlalchemy import func, select
+        
+        table = TrainingData.__table__
+        row = db.session.execute(
+            select(
+                func.count(table.c.id),
+                func.sum(table.c.id),
+                func.sum(table.c.quantity),
+                func.sum(table.c.price),
+                *[func.sum(func.length(table.c[name])) for name in CATEGORICAL_FEATURES]
+            ).where(table.c.id <= last_id)
+        ).one()
+        fingerprint = {
+            'rows': int(row[0]),
+            'id': int(row[1] or 0),
+            'quantity': int(row[2] or 0),
+            'price': float(row[3] or 0)
+        }
+        for name, total in zip(CATEGORICAL_FEATURES, row[4:]):
+            fingerprint[name] = int(total or 0)
+        return fingerprint
+    
+    def matches_table(self, header):
+        stored, table = self.fingerprint(header), self.table_fingerprint(header['last_id'])
+        # Float sums depend on the order they were added in
+        price_close = math.isclose(stored.pop('price'), table.pop('price'), rel_tol=1e-9, abs_tol=1e-6)
+        return price_close and stored == table
+    
+    def sync(self):
+        """
+        Append any training_data rows the store does not have yet (needs app context):
+        rows past last_id plus rows in the FEATURE_STORE_RESCAN_IDS ids below it that
+        committed after a higher id was synced. Rows are stored in sync order.
+        Rebuilds from scratch if the stored rows no longer match the table
+        (rows edited or deleted, or a late row below the re-scan window).
+        Returns the number of rows appended.
+        """
+        with self._locked():
+            header = self.read_header()
+            if header['rows']:
+                since_id = max(0, header['last_id'] - FEATURE_STORE_RESCAN_IDS)
+                df = load_training_dataframe(since_id=since_id)
+                df = df[~df['id'].isin(self.stored_ids(header, since_id))]
+                if len(df):
+                    self._append(header, df)
+                if self.matches_table(header):
+                    return len(df)
+                print("⚠ training_data rows were edited or deleted since the feature store synced - rebuilding it")
+            return self._rebuild()
+    
+    def rebuild(self):
+        """Re-encode the whole table (needs app context). Returns the number of rows stored."""
+        with self._locked():
+            return self._rebuild()
+    
+    def _rebuild(self):
+        header = self.empty_header()
+        df = load_training_dataframe(since_id=0)
+        if len(df):
+            self._append(header, df)
         else:
-            if len(df) < 20:
-                return jsonify({
-                    'success': False,
-                    'error': f'Need at least 20 total jobs to train. Current: {len(df)}'
-                })
-        
-        # 4. Feature Engineering (One-Hot Encoding)
-        # This handles 'material' and 'cutting_type' strings automatically
-        df_encoded = pd.get_dummies(df, columns=['material', 'cutting_type'], prefix=['mat', 'cut'])
-        
-        X = df_encoded.drop(['price'], axis=1)
-        y = df_encoded['price']
-        
-        # 5. Model Training
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+            write_json_atomic(self.header_path, header)
+        return len(df)
+    
+    def load_dataframe(self, recent=None):
+        """Memory-map the store as the typed frame load_training_dataframe() returns"""
+        header = self.read_header()
+        rows = header['rows']
+        if rows == 0:
+            raise RetrainRejected('The training_data table is empty. Add some jobs first!')
+        start = max(0, rows - recent) if recent else 0
+        
+        frame = {}
+        for name, dtype in self.columns.items():
+            if name == 'id':
+                continue
+            values = np.memmap(self.column_path(name), dtype=dtype, mode='r', shape=(rows,))[start:]
+            if name in CATEGORICAL_FEATURES:
+                values = pd.Categorical.from_codes(
+                    values, categories=header['categories'][name]
+                ).remove_unused_categories()
+            frame[name] = values
+        return pd.DataFrame(frame, copy=False)
+
+training_feature_store = TrainingFeatureStore(FEATURE_STORE_PATH)
+
+def load_training_frame(recent=None):
+    """Training rows for a retrain: the synced feature store, or the table itself (needs app context)"""
+    if USE_FEATURE_STORE:
+        try:
+            appended = training_feature_store.sync()
+            if appended:
+                print(f"✓ Feature store: appended {appended} new row(s)")
+            return training_feature_store.load_dataframe(recent=recent)
+        except RetrainRejected:
+            raise
+        except Exception as e:
+            print(f"⚠ Feature store unavailable ({e}) - loading training_data directly")
+    return load_training_dataframe(recent=recent)
+
+def training_data_watermark():
+    """(highest training_data id, row count) - the high-water mark a model was trained up to"""
+    max_id, count = db.session.query(db.func.max(TrainingData.id), db.func.count(TrainingData.id)).one()
+    return (max_id or 0), count
+
+def check_retrain_requirements(df):
+    """Raise RetrainRejected unless there are enough (new) jobs to retrain"""
+    # 3. Training Requirements Logic
+    # Incremental refreshes move total_jobs forward - new jobs count from the last full fit
+    try:
+        metadata = read_model_metadata()
+        prev_total = int(metadata.get('last_full_total_jobs', metadata.get('total_jobs', 0)) or 0)
+    except Exception:
+        prev_total = 0
+
+    new_jobs = max(0, len(df) - prev_total)
+
+    # Requirement: At least 20 total jobs, and 20 NEW jobs if a model exists
+    if prev_total > 0:
+        if new_jobs < 20:
+            raise RetrainRejected(
+                f'Need at least 20 NEW jobs since last model. New jobs: {new_jobs} (Total: {len(df)})'
+            )
+    else:
+        if len(df) < 20:
+            raise RetrainRejected(f'Need at least 20 total jobs to train. Current: {len(df)}')
+
+# Hyperparameters used when no search is run
+DEFAULT_FOREST_PARAMS = {
+    'n_estimators': 150,
+    'max_depth': 20,
+    'min_samples_split': 5,
+    'min_samples_leaf': 2
+}
+# Small grid searched by the tuning mode (cheapest configurations are tried first)
+FOREST_SEARCH_SPACE = {
+    'n_estimators': [50, 100, 150],
+    'max_depth': [8, 12, 20],
+    'min_samples_leaf': [1, 2, 4]
+}
+TUNING_CV_FOLDS = int(os.environ.get('TUNING_CV_FOLDS', 5))
+TUNING_TIME_BUDGET = float(os.environ.get('TUNING_TIME_BUDGET', 120))  # seconds
+# A smaller forest wins if its CV MAE is within this fraction of the best one
+TUNING_MAE_TOLERANCE = float(os.environ.get('TUNING_MAE_TOLERANCE', 0.01))
+# Tune on every retrain unless the request says otherwise
+TRAINING_TUNE_DEFAULT = os.environ.get('TRAINING_TUNE', '0') == '1'
+
+def forest_cost(params):
+    """Relative size/prediction cost of a forest configuration (bigger leaves mean fewer nodes)"""
+    return params['n_estimators'] * (params['max_depth'] or 32) / params.get('min_samples_leaf', 1)
+
+def tune_forest_hyperparameters(X, y, n_jobs=1, job_id=None):
+    """
+    k-fold cross-validated search over FOREST_SEARCH_SPACE within TUNING_TIME_BUDGET;
+    a candidate whose estimated CV time would overrun the budget is skipped. Folds run in a joblib process pool of n_jobs workers. Picks the cheapest
+    configuration whose mean CV MAE is within TUNING_MAE_TOLERANCE of the best.
+    Returns (params, search summary for the model metadata).
+    """
+    from itertools import product
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.model_selection import KFold, cross_validate
+    
+    keys = list(FOREST_SEARCH_SPACE)
+    candidates = [
+        dict(DEFAULT_FOREST_PARAMS, **dict(zip(keys, values)))
+        for values in product(*FOREST_SEARCH_SPACE.values())
+    ]
+    # Baseline first so it is always measured, then cheapest first so a tight budget still finds small models
+    candidates.sort(key=lambda p: (p != DEFAULT_FOREST_PARAMS, forest_cost(p)))
+    
+    folds = max(2, min(TUNING_CV_FOLDS, len(X) // 5))
+    cv = KFold(n_splits=folds, shuffle=True, random_state=42)
+    
+    started = time.time()
+    results = []
+    for i, params in enumerate(candidates):
+        if results:
+            # Fit time grows with the tree count: scale the baseline's measured CV time (all folds) to
+            # this candidate and skip it if it would overrun the budget - a later, smaller one may still fit
+            baseline = results[0]
+            estimate = baseline['seconds'] * params['n_estimators'] / baseline['params']['n_estimators']
+            if time.time() - started + estimate > TUNING_TIME_BUDGET:
+                continue
         
-        new_model = RandomForestRegressor(
-            n_estimators=150,
-            max_depth=20,
-            min_samples_split=5,
-            min_samples_leaf=2,
-            random_state=42,
-            n_jobs=-1
+        candidate_started = time.time()
+        scores = cross_validate(
+            RandomForestRegressor(**params, random_state=42, n_jobs=1),
+            X, y, cv=cv, scoring='neg_mean_absolute_error', n_jobs=n_jobs
         )
+        fold_mae = -scores['test_score']
+        results.append({
+            'params': params,
+            'cv_mae': round(float(fold_mae.mean()), 2),
+            'cv_mae_std': round(float(fold_mae.std()), 2),
+            'seconds': round(time.time() - candidate_started, 2)
+        })
         
-        new_model.fit(X_train, y_train)
-        
-        # 6. Evaluation
-        y_pred = new_model.predict(X_test)
-        mae = mean_absolute_error(y_test, y_pred)
-        r2 = calculate_r2(y_test, y_pred)
-        
-        # 7. Save to Persistent Storage (ALWAYS save to instance/)
-        # Construct the persistent storage path for the new model
-        persistent_model_path = os.path.join(INSTANCE_PATH, MODEL_FILENAME)
-        
-        model_data = {
-            'model': new_model,
-            'columns': X.columns.tolist(), # Store columns as list for easier matching
-            'training_date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'total_jobs': len(df),
-            'r2_score': r2,
-            'mae': mae
+        if job_id:
+            update_training_job(job_id, stage='tuning', progress=35 + int(30 * (i + 1) / len(candidates)))
+    
+    best = min(results, key=lambda r: r['cv_mae'])
+    allowed_mae = best['cv_mae'] * (1 + TUNING_MAE_TOLERANCE)
+    chosen = min(
+        (r for r in results if r['cv_mae'] <= allowed_mae),
+        key=lambda r: (forest_cost(r['params']), r['cv_mae'])
+    )
+    
+    summary = {
+        'folds': folds,
+        'time_budget_seconds': TUNING_TIME_BUDGET,
+        'elapsed_seconds': round(time.time() - started, 2),
+        'mae_tolerance': TUNING_MAE_TOLERANCE,
+        'candidates_evaluated': len(results),
+        'candidates_skipped': len(candidates) - len(results),
+        'best_cv_mae': best['cv_mae'],
+        'chosen_cv_mae': chosen['cv_mae'],
+        'results': results
+    }
+    print(f"Tuning: {len(results)}/{len(candidates)} configs in {summary['elapsed_seconds']}s, "
+          f"best CV MAE ₦{best['cv_mae']:,.2f}, chose {chosen['params']} (CV MAE ₦{chosen['cv_mae']:,.2f})")
+    return chosen['params'], summary
+
+# Model families retraining can produce; the winner's name is stored as metadata['engine']
+MODEL_ENGINES = ['random_forest', 'hist_gradient_boosting']
+TRAINING_ENGINES = [
+    engine for engine in os.environ.get('TRAINING_ENGINES', ','.join(MODEL_ENGINES)).split(',')
+    if engine.strip() in MODEL_ENGINES
+] or ['random_forest']
+# Candidates slower than this for a single quote only win if nothing meets the budget
+PREDICTION_LATENCY_BUDGET_MS = float(os.environ.get('PREDICTION_LATENCY_BUDGET_MS', 5))
+HIST_GB_PARAMS = {
+    'max_iter': 300,
+    'learning_rate': 0.05,
+    'max_leaf_nodes': 15,
+    'min_samples_leaf': 5,
+    'l2_regularization': 1.0
+}
+
+def encode_ordinal_features(df):
+    """
+    Numeric columns plus one integer-code column per categorical field, for
+    engines that split on categories natively. Returns (X, columns, categories).
+    """
+    numeric = [col for col in df.columns if col not in CATEGORICAL_FEATURES and col != 'price']
+    columns = numeric + list(CATEGORICAL_FEATURES)
+    
+    X = np.empty((len(df), len(columns)), dtype=np.float64)
+    X[:, :len(numeric)] = df[numeric].to_numpy(dtype=np.float64)
+    
+    categories = {}
+    for offset, field in enumerate(CATEGORICAL_FEATURES):
+        values = pd.Categorical(df[field])
+        categories[field] = [str(c) for c in values.categories]
+        codes = values.codes.astype(np.float64)
+        codes[codes < 0] = np.nan
+        X[:, len(numeric) + offset] = codes
+    return X, columns, categories
+
+def measure_prediction_latency(candidate, X, repeats=50):
+    """Median single-row predict time in ms, through the path that would serve the candidate"""
+    if candidate.get('flat_forest') is not None:
+        predict = candidate['flat_forest'].predict
+    else:
+        predict = candidate['estimator'].predict
+    
+    row = np.asarray(X[:1], dtype=np.float64)
+    timings = []
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='X does not have valid feature names')
+        predict(row)  # Warm-up
+        for _ in range(repeats):
+            started = time.perf_counter()
+            predict(row)
+            timings.append(time.perf_counter() - started)
+    return round(float(np.median(timings)) * 1000, 4)
+
+def export_flat_forest(estimator, X_check, expected):
+    """Flatten a forest for fast inference; only keep it if it reproduces sklearn on X_check"""
+    new_flat_forest = FlatForest.from_estimator(estimator)
+    flat_max_diff = float(np.max(np.abs(new_flat_forest.predict(X_check) - expected)))
+    if flat_max_diff > 1e-6:
+        print(f"⚠ Flat forest disagrees with sklearn (max diff {flat_max_diff}) - not exporting it")
+        new_flat_forest = None
+    return new_flat_forest, flat_max_diff
+
+# Compaction: cheaper forests tried on the inner validation split after the full fit
+MODEL_COMPACTION = os.environ.get('MODEL_COMPACTION', '1') != '0'
+# The smallest variant wins if its MAE is within this fraction of the full forest's
+COMPACTION_MAE_TOLERANCE = float(os.environ.get('COMPACTION_MAE_TOLERANCE', 0.02))
+COMPACTION_TREE_COUNTS = [25, 50, 75, 100]
+COMPACTION_DEPTHS = [8, 12]
+COMPACTION_MIN_SAMPLES_LEAF = [5]  # Larger leaves prune the deepest splits
+COMPACTION_MIN_HOLDOUT_ROWS = 30  # Too few validation rows to trust a smaller forest
+
+def compact_random_forest(full_model, forest_params, X_train, y_train, X_val, y_val, n_jobs):
+    """
+    Try fewer trees, shallower trees and larger (pruned) leaves and keep the
+    variant with the fewest nodes whose validation MAE is within
+    COMPACTION_MAE_TOLERANCE of the full forest. X_val/y_val come from the
+    training rows, never the test split the promotion gate scores.
+    Tree counts come free from each fit: a forest's first k trees are exactly
+    the forest sklearn would grow with n_estimators=k, so only depth/leaf
+    variants are refitted (with at most max(COMPACTION_TREE_COUNTS) trees) and
+    all prefixes are scored from one per-tree matrix.
+    Returns (estimator, params, report).
+    """
+    import copy
+    from sklearn.ensemble import RandomForestRegressor
+    
+    X_val_matrix = np.asarray(X_val, dtype=np.float64)
+    y_true = np.asarray(y_val, dtype=np.float64)
+    
+    structures = [(forest_params, full_model)]
+    full_depth = forest_params.get('max_depth') or float('inf')
+    full_leaf = forest_params.get('min_samples_leaf', 1)
+    for depth in [None] + [d for d in COMPACTION_DEPTHS if d < full_depth]:
+        for leaf in [full_leaf] + [l for l in COMPACTION_MIN_SAMPLES_LEAF if l > full_leaf]:
+            if depth is None and leaf == full_leaf:
+                continue  # The full forest itself
+            # Refits only need as many trees as the largest prefix tried
+            params = dict(
+                forest_params,
+                min_samples_leaf=leaf,
+                n_estimators=min(forest_params['n_estimators'], max(COMPACTION_TREE_COUNTS))
+            )
+            if depth is not None:
+                params['max_depth'] = depth
+            forest = RandomForestRegressor(**params, random_state=42, n_jobs=n_jobs)
+            forest.fit(X_train, y_train)
+            structures.append((params, forest))
+    
+    variants = []
+    for params, forest in structures:
+        flat = FlatForest.from_estimator(forest)
+        per_tree_sum = np.cumsum(flat.tree_predictions(X_val_matrix), axis=1)
+        total_trees = len(forest.estimators_)
+        for n_trees in sorted({n for n in COMPACTION_TREE_COUNTS if n < total_trees} | {total_trees}):
+            node_count = int(flat.roots[n_trees]) if n_trees < total_trees else len(flat.value)
+            variants.append({
+                'params': dict(params, n_estimators=n_trees),
+                'forest': forest,
+                'mae': float(np.mean(np.abs(per_tree_sum[:, n_trees - 1] / n_trees - y_true))),
+                'nodes': node_count,
+                'is_full': forest is full_model and n_trees == total_trees
+            })
+    
+    full = next(v for v in variants if v['is_full'])
+    mae_limit = full['mae'] * (1 + COMPACTION_MAE_TOLERANCE)
+    chosen = min((v for v in variants if v['mae'] <= mae_limit), key=lambda v: (v['nodes'], v['mae']))
+    
+    def build(variant):
+        estimator = variant['forest']
+        n_trees = variant['params']['n_estimators']
+        if n_trees < len(estimator.estimators_):
+            estimator = copy.copy(estimator)
+            estimator.estimators_ = estimator.estimators_[:n_trees]
+            estimator.n_estimators = n_trees
+        return estimator
+    
+    def describe(variant, estimator):
+        flat = FlatForest.from_estimator(estimator)
+        return {
+            **{key: variant['params'][key] for key in ('n_estimators', 'max_depth', 'min_samples_leaf')},
+            'validation_mae': round(variant['mae'], 2),
+            'nodes': variant['nodes'],
+            'flat_forest_bytes': int(sum(flat.to_dict()[key].nbytes for key in ('feature', 'threshold', 'left', 'right', 'value'))),
+            'latency_ms': measure_prediction_latency({'flat_forest': flat}, X_val_matrix)
         }
+    
+    estimator = build(chosen)
+    report = {
+        'mae_tolerance': COMPACTION_MAE_TOLERANCE,
+        'variants_tried': len(variants),
+        'full': describe(full, full_model),
+        'chosen': describe(chosen, estimator)
+    }
+    print(f"Compaction: {report['full']['nodes']:,} → {report['chosen']['nodes']:,} nodes, "
+          f"validation MAE {report['full']['validation_mae']} → {report['chosen']['validation_mae']}")
+    return estimator, chosen['params'], report
+
+def train_random_forest_candidate(df, train_idx, eval_idx, n_jobs, job_id=None, tune=False, forest_params=None):
+    """
+    One-hot RandomForest with its flat-array export, scored on eval_idx.
+    Without forest_params the configuration is chosen here (optionally tuned,
+    then compacted against eval_idx), so eval_idx must be validation rows;
+    with them the forest is just fitted, e.g. the chosen one on the test split.
+    """
+    from sklearn.metrics import mean_absolute_error, r2_score as calculate_r2
+    from sklearn.ensemble import RandomForestRegressor
+    
+    # 4. Feature Engineering (One-Hot Encoding)
+    # This handles 'material' and 'cutting_type' strings automatically
+    df_encoded = pd.get_dummies(df, columns=['material', 'cutting_type'], prefix=['mat', 'cut'])
+    
+    X = df_encoded.drop(['price'], axis=1)
+    y = df_encoded['price']
+    X_train, X_test = X.iloc[train_idx], X.iloc[eval_idx]
+    y_train, y_test = y.iloc[train_idx], y.iloc[eval_idx]
+    
+    choose = forest_params is None
+    forest_params, tuning = dict(forest_params or DEFAULT_FOREST_PARAMS), None
+    if choose and tune:
+        if job_id:
+            update_training_job(job_id, stage='tuning', progress=35)
+        forest_params, tuning = tune_forest_hyperparameters(X_train, y_train, n_jobs, job_id)
+    
+    if job_id:
+        update_training_job(job_id, stage='fitting', progress=65 if tune else 40)
+    
+    new_model = RandomForestRegressor(
+        **forest_params,
+        random_state=42,
+        n_jobs=n_jobs
+    )
+    
+    new_model.fit(X_train, y_train)
+    
+    compaction = None
+    if choose and MODEL_COMPACTION and len(eval_idx) < COMPACTION_MIN_HOLDOUT_ROWS:
+        compaction = {'skipped': f'only {len(eval_idx)} validation rows (need {COMPACTION_MIN_HOLDOUT_ROWS})'}
+    elif choose and MODEL_COMPACTION:
+        if job_id:
+            update_training_job(job_id, stage='compacting', progress=50)
+        new_model, forest_params, compaction = compact_random_forest(
+            new_model, forest_params, X_train, y_train, X_test, y_test, n_jobs
+        )
+    
+    # 6. Evaluation
+    y_pred = new_model.predict(X_test)
+    
+    X_test_matrix = X_test.to_numpy(dtype=np.float64)
+    new_flat_forest, flat_max_diff = export_flat_forest(new_model, X_test_matrix, y_pred)
+    
+    candidate = {
+        'engine': 'random_forest',
+        'estimator': new_model,
+        'flat_forest': new_flat_forest,
+        'columns': X.columns.tolist(), # Store columns as list for easier matching
+        'categories': None,
+        'hyperparameters': forest_params,
+        'mae': float(mean_absolute_error(y_test, y_pred)),
+        'r2': float(calculate_r2(y_test, y_pred)),
+        'extra_metadata': {'flat_forest_max_abs_diff': flat_max_diff}
+    }
+    if tuning:
+        candidate['extra_metadata']['tuning'] = tuning
+    if compaction:
+        candidate['extra_metadata']['compaction'] = compaction
+    candidate['latency_ms'] = measure_prediction_latency(candidate, X_test_matrix)
+    return candidate
+
+def train_hist_gradient_boosting_candidate(df, train_idx, eval_idx, n_jobs):
+    """HistGradientBoosting on category codes - no dummy columns per material - scored on eval_idx"""
+    from sklearn.metrics import mean_absolute_error, r2_score as calculate_r2
+    from sklearn.ensemble import HistGradientBoostingRegressor
+    from threadpoolctl import threadpool_limits
+    
+    X, feature_columns, categories = encode_ordinal_features(df)
+    y = df['price'].to_numpy(dtype=np.float64)
+    categorical_mask = [col in CATEGORICAL_FEATURES for col in feature_columns]
+    
+    new_model = HistGradientBoostingRegressor(
+        **HIST_GB_PARAMS,
+        categorical_features=categorical_mask,
+        random_state=42
+    )
+    # Its OpenMP threads obey the same CPU cap as the forest's workers
+    with threadpool_limits(limits=max(1, n_jobs)):
+        new_model.fit(X[train_idx], y[train_idx])
+    
+    y_pred = new_model.predict(X[eval_idx])
+    candidate = {
+        'engine': 'hist_gradient_boosting',
+        'estimator': new_model,
+        'flat_forest': None,
+        'columns': feature_columns,
+        'categories': categories,
+        'hyperparameters': dict(HIST_GB_PARAMS, n_iter=int(new_model.n_iter_)),
+        'mae': float(mean_absolute_error(y[eval_idx], y_pred)),
+        'r2': float(calculate_r2(y[eval_idx], y_pred)),
+        'extra_metadata': {}
+    }
+    candidate['latency_ms'] = measure_prediction_latency(candidate, X[eval_idx])
+    return candidate
+
+def select_engine_candidate(candidates):
+    """Lowest validation MAE among candidates within the latency budget (any, if none are)"""
+    within_budget = [c for c in candidates if c['latency_ms'] <= PREDICTION_LATENCY_BUDGET_MS]
+    winner = min(within_budget or candidates, key=lambda c: c['mae'])
+    
+    selection = {
+        'split': 'validation',
+        'latency_budget_ms': PREDICTION_LATENCY_BUDGET_MS,
+        'winner': winner['engine'],
+        'candidates': [
+            {
+                'engine': c['engine'],
+                'mae': round(c['mae'], 2),
+                'r2_score': round(c['r2'], 4),
+                'latency_ms': c['latency_ms'],
+                'within_budget': c['latency_ms'] <= PREDICTION_LATENCY_BUDGET_MS
+            }
+            for c in candidates
+        ]
+    }
+    return winner, selection
+
+def newest_holdout_split(n_rows, test_size=0.2):
+    """
+    Hold out the newest rows (frames are in training_data id order). Besides
+    matching how the model is used - pricing jobs that come after its data -
+    this keeps validation rows out of the incumbent model's training set.
+    """
+    n_test = max(1, int(round(n_rows * test_size))) if n_rows > 1 else 0
+    positions = np.arange(n_rows)
+    return positions[:n_rows - n_test], positions[n_rows - n_test:]
+
+def fit_pricing_model(df, n_jobs=-1, job_id=None, tune=False, last_training_id=None, force=False):
+    """
+    Fit every engine in TRAINING_ENGINES on the same split, keep the one with
+    the lowest validation MAE inside the latency budget, refit it on all
+    training rows, run it through the promotion gate and save it to instance/
+    as an inactive registry version. Engine, tuning and compaction choices use
+    an inner validation split of the training rows; the test split is only
+    used for the promotion gate and the reported r2/mae.
+    Pure CPU work with no database access, so it can run in a training process;
+    the caller activates the version if it was promoted.
+    Returns the saved metadata (including the artifact path).
+    """
+    # 5. Model Training - one shared split so engines (and the incumbent) are compared fairly
+    train_idx, test_idx = newest_holdout_split(len(df))
+    # Choices are made on the newest training rows, so the test split stays unseen until the gate
+    inner_fit, inner_val = newest_holdout_split(len(train_idx))
+    fit_idx, val_idx = train_idx[inner_fit], train_idx[inner_val]
+    
+    candidates = []
+    if 'random_forest' in TRAINING_ENGINES:
+        candidates.append(train_random_forest_candidate(df, fit_idx, val_idx, n_jobs, job_id, tune))
+    if 'hist_gradient_boosting' in TRAINING_ENGINES:
+        if job_id:
+            update_training_job(job_id, stage='fitting_hist_gradient_boosting', progress=60)
+        candidates.append(train_hist_gradient_boosting_candidate(df, fit_idx, val_idx, n_jobs))
+    
+    winner, engine_selection = select_engine_candidate(candidates)
+    print(f"Engine selection: {engine_selection}")
+    
+    # Refit the chosen engine and configuration on every training row; only it is scored on the test split
+    if job_id:
+        update_training_job(job_id, stage='refitting', progress=65)
+    if winner['engine'] == 'random_forest':
+        final = train_random_forest_candidate(
+            df, train_idx, test_idx, n_jobs, forest_params=winner['hyperparameters']
+        )
+        # Tuning/compaction reports come from the choosing fit
+        final['extra_metadata'] = dict(winner['extra_metadata'], **final['extra_metadata'])
+        if 'chosen' in final['extra_metadata'].get('compaction', {}):
+            final['extra_metadata']['compaction']['chosen']['test_mae'] = round(final['mae'], 2)
+    else:
+        final = train_hist_gradient_boosting_candidate(df, train_idx, test_idx, n_jobs)
+    winner = final
+    
+    if job_id:
+        update_training_job(job_id, stage='saving', progress=85)
+    
+    # 7. Save to Persistent Storage (ALWAYS save to instance/)
+    metadata = {
+        'engine': winner['engine'],
+        'columns': winner['columns'],
+        'training_date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'total_jobs': len(df),
+        'r2_score': winner['r2'],
+        'mae': winner['mae'],
+        'latency_ms': winner['latency_ms'],
+        'hyperparameters': winner['hyperparameters'],
+        'engine_selection': engine_selection,
+        'last_training_id': last_training_id
+    }
+    if winner['categories']:
+        metadata['categories'] = winner['categories']
+    metadata.update(winner['extra_metadata'])
+    
+    # Everything in this frame is new to the incumbent beyond the jobs it was trained on
+    metadata['promotion'] = evaluate_promotion(
+        winner['estimator'], winner['flat_forest'], metadata, df, test_idx,
+        unseen_rows=len(df) - int(read_model_metadata().get('total_jobs', 0) or 0),
+        force=force
+    )
+    
+    # Promoted models ship with their standard price table, ready before the manifest flips
+    standard_prices = None
+    if metadata['promotion']['promoted'] and USE_PRICE_TABLE:
+        standard_prices = build_price_table(winner['estimator'], winner['flat_forest'], metadata)
+    
+    # New registry version (estimator + forest + sidecar); TrainingJobRunner flips the manifest if promoted
+    version, persistent_model_path = model_registry.publish(
+        winner['estimator'], metadata, flat_forest=winner['flat_forest'],
+        activate=False, price_table=standard_prices
+    )
+    
+    print(f"Model v{version} saved to persistent storage: {persistent_model_path}")
+    
+    return dict(metadata, version=version, artifact_path=persistent_model_path)
+
+# Incremental (warm-start) refresh of the active random forest
+INCREMENTAL_TREES = int(os.environ.get('INCREMENTAL_TREES', 10))  # Trees grown per refresh
+INCREMENTAL_MAX_ESTIMATORS = int(os.environ.get('INCREMENTAL_MAX_ESTIMATORS', 200))  # Oldest trees pruned beyond this
+INCREMENTAL_WINDOW = int(os.environ.get('INCREMENTAL_WINDOW', 200))  # Newest rows the new trees learn from
+INCREMENTAL_MIN_NEW_JOBS = int(os.environ.get('INCREMENTAL_MIN_NEW_JOBS', 3))
+# add_training_job starts an incremental refresh every N new jobs (0 = never)
+INCREMENTAL_RETRAIN_EVERY = int(os.environ.get('INCREMENTAL_RETRAIN_EVERY', 0))
+
+def check_incremental_requirements(metadata):
+    """Raise RetrainRejected unless the active model can take a warm-start refresh"""
+    if metadata.get('engine', 'random_forest') != 'random_forest':
+        raise RetrainRejected('Incremental retraining needs a random forest model. Run a full retrain instead.')
+    if metadata.get('last_training_id') is None or model_registry.read_manifest() is None:
+        raise RetrainRejected('The current model predates incremental training. Run a full retrain first.')
+    
+    new_jobs = TrainingData.query.filter(TrainingData.id > metadata['last_training_id']).count()
+    if new_jobs < INCREMENTAL_MIN_NEW_JOBS:
+        raise RetrainRejected(
+            f'Need at least {INCREMENTAL_MIN_NEW_JOBS} new jobs for an incremental update. New jobs: {new_jobs}'
+        )
+    return new_jobs
+
+def fit_incremental_update(recent_df, total_jobs, last_training_id, new_jobs, n_jobs=-1, job_id=None, force=False):
+    """
+    Warm-start the active random forest: grow INCREMENTAL_TREES trees on the
+    newest rows, prune the oldest trees beyond INCREMENTAL_MAX_ESTIMATORS so the
+    ensemble stays bounded, and publish the result as a new (inactive) registry
+    version for the caller to activate if promoted.
+    """
+    from sklearn.metrics import mean_absolute_error, r2_score as calculate_r2
+    
+    manifest = model_registry.read_manifest()
+    base_path = model_registry.artifact_path(manifest['version'])
+    base_model, base_metadata = load_model_artifact(base_path)
+    feature_columns = base_metadata['columns']
+    base_encoder = FeatureEncoder(feature_columns)
+    
+    # New trees must share the old feature layout - a new material needs a full retrain
+    for field in CATEGORICAL_FEATURES:
+        unseen = [str(v) for v in recent_df[field].unique() if base_encoder.lookup(field, v) is None]
+        if unseen:
+            raise RetrainRejected(
+                f"New {field} value(s) {', '.join(unseen)} since the last full retrain. Run a full retrain instead."
+            )
+    
+    df_encoded = pd.get_dummies(recent_df, columns=['material', 'cutting_type'], prefix=['mat', 'cut'])
+    X = df_encoded.drop(['price'], axis=1).reindex(columns=feature_columns, fill_value=0)
+    y = df_encoded['price']
+    
+    # Hold out the newest part of the window so the update is scored on rows it did not fit
+    if len(X) >= 10:
+        train_idx, test_idx = newest_holdout_split(len(X))
+    else:
+        train_idx = test_idx = np.arange(len(X))
+    X_train, X_test = X.iloc[train_idx], X.iloc[test_idx]
+    y_train, y_test = y.iloc[train_idx], y.iloc[test_idx]
+    
+    if job_id:
+        update_training_job(job_id, stage='growing_trees', progress=40)
+    
+    old_trees = len(base_model.estimators_)
+    base_model.set_params(warm_start=True, n_estimators=old_trees + INCREMENTAL_TREES, n_jobs=n_jobs)
+    base_model.fit(X_train, y_train)
+    
+    trees_pruned = max(0, len(base_model.estimators_) - INCREMENTAL_MAX_ESTIMATORS)
+    if trees_pruned:
+        base_model.estimators_ = base_model.estimators_[trees_pruned:]
+    base_model.set_params(warm_start=False, n_estimators=len(base_model.estimators_))
+    
+    if job_id:
+        update_training_job(job_id, stage='evaluating', progress=70)
+    
+    y_pred = base_model.predict(X_test)
+    X_test_matrix = X_test.to_numpy(dtype=np.float64)
+    new_flat_forest, flat_max_diff = export_flat_forest(base_model, X_test_matrix, y_pred)
+    
+    candidate = {'estimator': base_model, 'flat_forest': new_flat_forest}
+    metadata = {
+        key: value for key, value in base_metadata.items()
+        if key not in ('version', 'engine_selection', 'tuning', 'compaction', 'promotion')
+    }
+    metadata.update({
+        'training_date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'total_jobs': total_jobs,
+        'r2_score': float(calculate_r2(y_test, y_pred)),
+        'mae': float(mean_absolute_error(y_test, y_pred)),
+        'latency_ms': measure_prediction_latency(candidate, X_test_matrix),
+        'flat_forest_max_abs_diff': flat_max_diff,
+        'hyperparameters': dict(base_metadata.get('hyperparameters') or DEFAULT_FOREST_PARAMS,
+                                n_estimators=len(base_model.estimators_)),
+        'last_training_id': last_training_id,
+        'last_full_training_date': base_metadata.get('last_full_training_date', base_metadata.get('training_date')),
+        'last_full_total_jobs': base_metadata.get('last_full_total_jobs', base_metadata.get('total_jobs')),
+        'last_full_training_id': base_metadata.get('last_full_training_id', base_metadata.get('last_training_id')),
+        'incremental': {
+            'base_version': manifest['version'],
+            'new_jobs': new_jobs,
+            'window_rows': len(recent_df),
+            'trees_added': INCREMENTAL_TREES,
+            'trees_pruned': trees_pruned,
+            'scored_on': 'holdout of recent window' if len(X) >= 10 else 'recent window (too small to hold out)'
+        }
+    })
+    
+    # The base version saw everything up to its own total_jobs; the rest of the window is new to it
+    metadata['promotion'] = evaluate_promotion(
+        base_model, new_flat_forest, metadata, recent_df, test_idx,
+        unseen_rows=total_jobs - int(base_metadata.get('total_jobs', 0) or 0),
+        force=force
+    )
+    
+    if job_id:
+        update_training_job(job_id, stage='saving', progress=85)
+    
+    standard_prices = None
+    if metadata['promotion']['promoted'] and USE_PRICE_TABLE:
+        standard_prices = build_price_table(base_model, new_flat_forest, metadata)
+    
+    version, persistent_model_path = model_registry.publish(
+        base_model, metadata, flat_forest=new_flat_forest,
+        activate=False, price_table=standard_prices
+    )
+    print(f"Model v{version} (incremental: +{INCREMENTAL_TREES}/-{trees_pruned} trees) saved: {persistent_model_path}")
+    
+    return dict(metadata, version=version, artifact_path=persistent_model_path)
+
+# ============================================================================
+# PROMOTION GATE
+# ============================================================================
+
+MODEL_KEEP_VERSIONS = int(os.environ.get('MODEL_KEEP_VERSIONS', 5))  # Promoted registry versions kept on disk
+# Never-promoted candidates kept (for inspection or a forced activation), pruned separately
+MODEL_KEEP_CANDIDATES = int(os.environ.get('MODEL_KEEP_CANDIDATES', 2))
+# Candidate MAE may be at most this fraction worse than the incumbent's
+PROMOTION_MAE_TOLERANCE = float(os.environ.get('PROMOTION_MAE_TOLERANCE', 0.02))
+# Candidate R² may be at most this much lower than the incumbent's
+PROMOTION_R2_TOLERANCE = float(os.environ.get('PROMOTION_R2_TOLERANCE', 0.02))
+# Candidate may be at most this many times slower - or anything within PREDICTION_LATENCY_BUDGET_MS
+PROMOTION_LATENCY_TOLERANCE = float(os.environ.get('PROMOTION_LATENCY_TOLERANCE', 1.5))
+PROMOTION_MIN_ROWS = 5  # Unseen validation rows needed to compare accuracy
+PROMOTION_LATENCY_REPEATS = 200
+
+def load_serving_artifact():
+    """(estimator, metadata, flat_forest) of the model all workers currently serve, None if there is none"""
+    manifest = model_registry.read_manifest()
+    artifact_path = model_registry.artifact_path(manifest['version']) if manifest else MODEL_PATH
+    try:
+        if artifact_path.endswith('.joblib'):
+            estimator, metadata = load_model_artifact(artifact_path)
+        else:
+            estimator, metadata = load_legacy_model_pickle(artifact_path)
+    except Exception as e:
+        print(f"No incumbent model to compare against ({e})")
+        return None
+    serving_forest = load_flat_forest(artifact_path, estimator) if USE_FLAT_FOREST else None
+    return estimator, dict(metadata, version=manifest['version'] if manifest else None), serving_forest
+
+def score_model_on_jobs(estimator, serving_forest, metadata, jobs, y_true):
+    """MAE, R² and single-row latency of a model on job dicts, encoded the way it is served"""
+    from sklearn.metrics import mean_absolute_error, r2_score as calculate_r2
+    
+    X = build_feature_encoder(metadata['columns'], metadata.get('categories')).encode(jobs)
+    if serving_forest is not None:
+        y_pred = serving_forest.predict(X)
+    else:
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='X does not have valid feature names')
+            y_pred = estimator.predict(X)
+    
+    return {
+        'mae': round(float(mean_absolute_error(y_true, y_pred)), 2),
+        'r2_score': round(float(calculate_r2(y_true, y_pred)), 4) if len(y_true) > 1 else None,
+        'latency_ms': measure_prediction_latency(
+            {'estimator': estimator, 'flat_forest': serving_forest}, X, repeats=PROMOTION_LATENCY_REPEATS
+        )
+    }
+
+def evaluate_promotion(estimator, serving_forest, metadata, df, test_idx, unseen_rows, force=False):
+    """
+    Score the candidate and the incumbent on the same validation rows and the
+    same latency micro-benchmark. Accuracy is only compared on validation rows
+    the incumbent never trained on (the last `unseen_rows` of df); with fewer
+    than PROMOTION_MIN_ROWS of them only latency can block promotion.
+    """
+    incumbent = load_serving_artifact()
+    if incumbent is None:
+        return {'promoted': True, 'forced': False, 'failures': [], 'reason': 'no incumbent model'}
+    incumbent_model, incumbent_metadata, incumbent_forest = incumbent
+    
+    fresh_idx = test_idx[test_idx >= len(df) - max(0, unseen_rows)]
+    accuracy_compared = len(fresh_idx) >= PROMOTION_MIN_ROWS
+    rows = fresh_idx if accuracy_compared else test_idx
+    jobs = df.iloc[rows].drop(columns=['price']).to_dict('records')
+    y_true = df['price'].to_numpy(dtype=np.float64)[rows]
+    
+    candidate_scores = score_model_on_jobs(estimator, serving_forest, metadata, jobs, y_true)
+    incumbent_scores = score_model_on_jobs(incumbent_model, incumbent_forest, incumbent_metadata, jobs, y_true)
+    
+    failures = []
+    if accuracy_compared:
+        mae_limit = incumbent_scores['mae'] * (1 + PROMOTION_MAE_TOLERANCE)
+        if candidate_scores['mae'] > mae_limit:
+            failures.append(f"MAE ₦{candidate_scores['mae']:,.2f} is worse than the incumbent's "
+                            f"₦{incumbent_scores['mae']:,.2f} (limit ₦{mae_limit:,.2f})")
+        if (candidate_scores['r2_score'] is not None and incumbent_scores['r2_score'] is not None
+                and candidate_scores['r2_score'] < incumbent_scores['r2_score'] - PROMOTION_R2_TOLERANCE):
+            failures.append(f"R² {candidate_scores['r2_score']} dropped from {incumbent_scores['r2_score']}")
+    
+    latency_limit = max(incumbent_scores['latency_ms'] * PROMOTION_LATENCY_TOLERANCE, PREDICTION_LATENCY_BUDGET_MS)
+    if candidate_scores['latency_ms'] > latency_limit:
+        failures.append(f"prediction takes {candidate_scores['latency_ms']}ms vs the incumbent's "
+                        f"{incumbent_scores['latency_ms']}ms (limit {latency_limit:.4f}ms)")
+    
+    promotion = {
+        'promoted': force or not failures,
+        'forced': bool(force and failures),
+        'failures': failures,
+        'incumbent_version': incumbent_metadata.get('version'),
+        'validation_rows': len(rows),
+        'accuracy_compared': accuracy_compared,
+        'candidate': candidate_scores,
+        'incumbent': incumbent_scores
+    }
+    print(f"Promotion gate vs v{promotion['incumbent_version'] or ' (unversioned)'}: "
+          f"{'promote' if promotion['promoted'] else 'keep incumbent'} {failures or ''}")
+    return promotion
+
+def install_model_artifact(artifact_path, version=None):
+    """Load a saved artifact and make it the model this worker prices with"""
+    global model, model_metadata, flat_forest, columns, encoder, model_version, price_table, MODEL_PATH
+    
+    new_model, metadata = load_model_artifact(artifact_path)
+    new_flat_forest = load_flat_forest(artifact_path, new_model) if USE_FLAT_FOREST else None
+    new_encoder = build_feature_encoder(metadata['columns'], metadata.get('categories'))
+    new_price_table = load_price_table(artifact_path, new_model, new_flat_forest, metadata)
+    
+    # Update global variables so the app uses the new model immediately
+    with model_swap_lock:
+        model = new_model
+        model_metadata = metadata
+        flat_forest = new_flat_forest
+        columns = metadata['columns']
+        encoder = new_encoder
+        price_table = new_price_table
+        model_version = version
+        prediction_cache.bump_version()
+        MODEL_PATH = artifact_path  # Update to point to persistent storage
+    
+    print(f"Worker {os.getpid()} now pricing with model v{version}: {artifact_path}")
+
+# After a failed load, a worker waits this long before trying the new manifest again
+MODEL_RELOAD_RETRY_SECONDS = float(os.environ.get('MODEL_RELOAD_RETRY_SECONDS', 5))
+model_reload_retry_at = 0
+
+def refresh_model_if_stale():
+    """
+    Called before predicting: one stat() of the registry manifest. When another
+    worker has published (or rolled back to) a different version, load it here.
+    The stamp is only recorded once the load succeeded; a failed load (e.g. a
+    volume still syncing) is retried after MODEL_RELOAD_RETRY_SECONDS.
+    """
+    global model_manifest_stamp, model_reload_retry_at
+    
+    stamp = model_registry.manifest_stamp()
+    if stamp is None or stamp == model_manifest_stamp or time.time() < model_reload_retry_at:
+        return
+    
+    manifest = model_registry.read_manifest()
+    try:
+        if manifest is None:
+            raise ValueError('manifest could not be read')
+        if manifest['version'] != model_version:
+            install_model_artifact(model_registry.artifact_path(manifest['version']), manifest['version'])
+    except Exception as e:
+        # Keep serving the current model until a retry succeeds
+        model_reload_retry_at = time.time() + MODEL_RELOAD_RETRY_SECONDS
+        print(f"⚠ Error loading model v{(manifest or {}).get('version')}: {e} - "
+              f"retrying in {MODEL_RELOAD_RETRY_SECONDS:g}s")
+        return
+    model_manifest_stamp = stamp
+
+# ========================================
+# BACKGROUND TRAINING JOBS
+# ========================================
+
+# Training never uses more than this many cores, so quoting stays responsive
+TRAINING_MAX_CPUS = max(1, int(os.environ.get('TRAINING_MAX_CPUS', max(1, (os.cpu_count() or 2) - 1))))
+# A job gets this long from start to finished fit; its lock is considered dead after that (plus a grace for activation)
+TRAINING_JOB_TIMEOUT = int(os.environ.get('TRAINING_JOB_TIMEOUT', 1800))
+TRAINING_LOCK_GRACE = 120
+# The training process is spawned and imports this module to run its task - it must not start the
+# scheduler or run init_app() a second time
+IS_TRAINING_PROCESS = multiprocessing.parent_process() is not None
+TRAINING_JOBS_PATH = os.path.join(INSTANCE_PATH, 'training_jobs')
+
+def training_job_path(job_id):
+    return os.path.join(TRAINING_JOBS_PATH, f"{job_id}.json")
+
+def incremental_attempt_path():
+    return os.path.join(TRAINING_JOBS_PATH, 'incremental_attempt.json')
+
+def read_incremental_watermark():
+    """training_data id the last incremental refresh was attempted at (promoted or not), None if never"""
+    try:
+        with open(incremental_attempt_path()) as f:
+            return json.load(f).get('last_training_id')
+    except (OSError, ValueError):
+        return None
+
+def record_incremental_attempt(job_id, last_training_id):
+    """Remember an incremental refresh ran, so add_training_job waits for more jobs before the next one"""
+    os.makedirs(TRAINING_JOBS_PATH, exist_ok=True)
+    write_json_atomic(incremental_attempt_path(), {
+        'job_id': job_id,
+        'last_training_id': last_training_id,
+        'attempted_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+def read_training_job(job_id):
+    """Status dict for a job id, or None if unknown"""
+    try:
+        with open(training_job_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def update_training_job(job_id, **fields):
+    """
+    Merge fields into a job's status file. Status lives on the instance/
+    volume so any gunicorn worker (or the training process) can report it.
+    """
+    status = read_training_job(job_id) or {'job_id': job_id}
+    status.update(fields)
+    status['updated_at'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    write_json_atomic(training_job_path(job_id), status)
+    return status
+
+def _init_training_process():
+    """Runs once in the spawned training process"""
+    try:
+        os.nice(10)  # Quote requests win any CPU contention
+    except OSError:
+        pass
+
+class TrainingJobRunner:
+    """
+    Runs retraining in the background: data is loaded in a thread of this
+    worker, the fit runs in a single-process pool capped at TRAINING_MAX_CPUS,
+    and progress is written to instance/training_jobs/<job_id>.json.
+    Only one job runs at a time across all workers (lock file); overlapping
+    submissions are coalesced onto the running job. The training process only
+    saves inactive versions - activation happens here once the fit returned
+    within the timeout, and a fit that overruns it is killed.
+    """
+    def __init__(self, jobs_path, max_cpus, timeout):
+        self.jobs_path = jobs_path
+        self.lock_path = os.path.join(jobs_path, 'active.lock')
+        self.max_cpus = max_cpus
+        self.timeout = timeout
+        self._executor = None
+        self._executor_lock = threading.Lock()
+    
+    def _get_executor(self):
+        from concurrent.futures import ProcessPoolExecutor
+        
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn, not fork: this worker runs threads (scheduler, request threads) and a forked
+                # child can deadlock on a lock one of them held at fork time
+                self._executor = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_training_process
+                )
+            return self._executor
+    
+    def _terminate_executor(self):
+        """Kill the training process - a timed-out future keeps running otherwise - so the next job gets a fresh pool"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _read_lock(self):
+        """The lock's owner ({'job_id', 'pid', 'host'}) plus its age in seconds, or None when unlocked"""
+        try:
+            with open(self.lock_path) as f:
+                content = f.read().strip()
+            age = time.time() - os.path.getmtime(self.lock_path)
+        except OSError:
+            return None
+        try:
+            owner = json.loads(content)
+        except ValueError:
+            owner = None
+        if not isinstance(owner, dict):
+            owner = {'job_id': content}  # Lock written by an older release (job id only)
+        owner['age'] = age
+        return owner
+    
+    def _lock_dead_reason(self, owner):
+        """Why the lock's owner can no longer be running, or None if it may still be"""
+        if owner['age'] >= self.timeout + TRAINING_LOCK_GRACE:
+            return 'Training job timed out'
         
-        with open(persistent_model_path, 'wb') as f:
-            pickle.dump(model_data, f)
+        pid = owner.get('pid')
+        if pid and owner.get('host') == socket.gethostname():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return 'Training stopped before finishing (its worker exited)'
+            except OSError:
+                pass  # Exists but belongs to another user
+        return None
+    
+    def _owns_lock(self, job_id):
+        owner = self._read_lock()
+        return owner is not None and owner['job_id'] == job_id
+    
+    def _acquire_lock(self, job_id):
+        """Create the lock file; returns the running job id instead if one holds it"""
+        os.makedirs(self.jobs_path, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'job_id': job_id, 'pid': os.getpid(), 'host': socket.gethostname()}, f)
+                return None
+            except FileExistsError:
+                owner = self._read_lock()
+                if owner is None:
+                    continue  # Released between our checks - try again
+                
+                reason = self._lock_dead_reason(owner)
+                if reason is None:
+                    return owner['job_id']
+                
+                print(f"⚠ Training lock held by {owner['job_id']} for {owner['age']:.0f}s - {reason}, taking over")
+                self._fail_unfinished(owner['job_id'], reason)
+                self._release_lock(owner['job_id'])
+        return None
+    
+    def _release_lock(self, job_id):
+        """Remove the lock - only while it is still ours, a job that was taken over must not free its successor's"""
+        if not self._owns_lock(job_id):
+            return
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+    
+    def _fail_unfinished(self, job_id, error):
+        status = read_training_job(job_id)
+        if status is None or status.get('state') in ('queued', 'running'):
+            status = update_training_job(job_id, state='failed', stage='error', error=error)
+        return status
+    
+    def submit(self, tune=False, mode='full', force=False):
+        """Start a retrain job ('full' or 'incremental'). Returns (status, coalesced)."""
+        job_id = datetime.utcnow().strftime('%Y%m%d%H%M%S') + '-' + os.urandom(3).hex()
+        
+        running_id = self._acquire_lock(job_id)
+        if running_id:
+            return (read_training_job(running_id) or {'job_id': running_id, 'state': 'running'}), True
+        
+        status = update_training_job(
+            job_id,
+            state='queued',
+            stage='queued',
+            progress=0,
+            submitted_at=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            max_cpus=self.max_cpus,
+            tune=tune,
+            mode=mode,
+            force=force,
+            timeout_seconds=self.timeout
+        )
+        threading.Thread(target=self._run, args=(job_id, tune, mode, force), daemon=True).start()
+        return status, False
+    
+    def _run(self, job_id, tune=False, mode='full', force=False):
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        from concurrent.futures.process import BrokenProcessPool
         
-        print(f"Model saved to persistent storage: {persistent_model_path}")
+        # The timeout covers the whole job (data loading included), so the lock never outlives it
+        deadline = time.time() + self.timeout
+        try:
+            update_training_job(job_id, state='running', stage='loading_data', progress=10)
+            with app.app_context():
+                max_id, total_jobs = training_data_watermark()
+                if mode == 'incremental':
+                    record_incremental_attempt(job_id, max_id)
+                    new_jobs = check_incremental_requirements(read_model_metadata())
+                    df = load_training_frame(recent=INCREMENTAL_WINDOW)
+                else:
+                    df = load_training_frame()
+                    check_retrain_requirements(df)
+            
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError(f'Training job exceeded {self.timeout}s while loading data')
+            
+            update_training_job(job_id, stage='training', progress=30)
+            if mode == 'incremental':
+                future = self._get_executor().submit(
+                    fit_incremental_update, df, total_jobs, max_id, new_jobs, self.max_cpus, job_id, force
+                )
+            else:
+                future = self._get_executor().submit(
+                    fit_pricing_model, df, self.max_cpus, job_id, tune, max_id, force
+                )
+            try:
+                result = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                self._terminate_executor()
+                raise TimeoutError(f'Training job exceeded {self.timeout}s and was stopped')
+            except BrokenProcessPool:
+                self._terminate_executor()  # The training process died - later jobs need a new pool
+                raise
+            promotion = result['promotion']
+            
+            if not self._owns_lock(job_id):
+                # Another worker declared this job dead and may be training already - leave v{version} inactive
+                raise RuntimeError(f"Training lock was taken over - v{result['version']} was saved but not activated")
+            
+            if promotion['promoted']:
+                update_training_job(job_id, stage='installing', progress=95)
+                model_registry.activate(result['version'])
+                install_model_artifact(result['artifact_path'], result['version'])
+                message = ('Model refreshed incrementally with the newest jobs!' if mode == 'incremental'
+                           else 'Model retrained successfully using Supabase data!')
+            else:
+                incumbent = (f"v{promotion['incumbent_version']}" if promotion['incumbent_version']
+                             else 'the current model')
+                message = f"Model v{result['version']} was trained but not promoted - still serving {incumbent}"
+            model_registry.prune(MODEL_KEEP_VERSIONS, MODEL_KEEP_CANDIDATES)
+            
+            update_training_job(
+                job_id,
+                state='completed',
+                stage='completed',
+                progress=100,
+                message=message,
+                version=result['version'],
+                promoted=promotion['promoted'],
+                promotion_failures=promotion['failures'],
+                total_jobs=result['total_jobs'],
+                r2_score=round(result['r2_score'], 3),
+                mae=round(result['mae'], 2),
+                hyperparameters=result['hyperparameters']
+            )
+            
+        except RetrainRejected as e:
+            update_training_job(job_id, state='failed', stage='rejected', error=str(e))
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            update_training_job(job_id, state='failed', stage='error', error=str(e))
+        finally:
+            self._release_lock(job_id)
+    
+    def check_alive(self, status):
+        """
+        Report a queued/running job as failed once its lock is gone, expired or
+        owned by an exited process - the worker running it died without writing
+        a final state
+        """
+        if status.get('state') not in ('queued', 'running'):
+            return status
+        
+        job_id = status['job_id']
+        owner = self._read_lock()
+        if owner is not None and owner['job_id'] == job_id:
+            reason = self._lock_dead_reason(owner)
+            if reason is None:
+                return status
+        else:
+            reason = 'Training stopped before finishing (its worker exited)'
         
-        # Update global variables so the app uses the new model immediately
-        model = new_model
-        columns = X.columns.tolist()  # Convert to list for consistency with saved format
-        MODEL_PATH = persistent_model_path  # Update to point to persistent storage
+        # The final state is written before the lock is released - re-read to not race a finishing job
+        return self._fail_unfinished(job_id, reason)
+
+training_jobs = TrainingJobRunner(TRAINING_JOBS_PATH, TRAINING_MAX_CPUS, TRAINING_JOB_TIMEOUT)
+
+@app.route('/retrain_model', methods=['POST'])
+@requires_auth
+def retrain_model():
+    """
+    Start a background retrain with current data from Supabase - returns a job id to poll.
+    JSON body {"tune": true} runs the cross-validated hyperparameter search first;
+    {"mode": "incremental"} only grows a few warm-start trees on the newest jobs;
+    {"force": true} promotes the new model even if it fails the promotion gate.
+    """
+    try:
+        options = request.get_json(silent=True) or {}
+        mode = options.get('mode', 'full')
+        if mode not in ('full', 'incremental'):
+            return jsonify({'success': False, 'error': f"Unknown retrain mode '{mode}'"}), 400
+        
+        status, coalesced = training_jobs.submit(
+            tune=bool(options.get('tune', TRAINING_TUNE_DEFAULT)),
+            mode=mode,
+            force=bool(options.get('force', False))
+        )
         
         return jsonify({
             'success': True,
-            'message': 'Model retrained successfully using Supabase data!',
-            'total_jobs': len(df),
-            'r2_score': round(r2, 3),
-            'mae': round(mae, 2)
-        })
+            'job_id': status['job_id'],
+            'state': status.get('state'),
+            'coalesced': coalesced,
+            'status_url': f"/retrain_model/status/{status['job_id']}",
+            'message': 'A retrain is already running - following that job' if coalesced
+                       else 'Retraining started in the background'
+        }), 202
         
     except Exception as e:
         import traceback
@@ -3811,6 +6702,354 @@ def retrain_model():
             'traceback': traceback.format_exc()
         })
 
+@app.route('/retrain_model/status/<job_id>', methods=['GET'])
+@requires_auth
+def retrain_model_status(job_id):
+    """Progress and final r2_score/mae of a background retrain"""
+    if not re.fullmatch(r'[0-9a-f\-]+', job_id):
+        return jsonify({'success': False, 'error': 'Invalid job id'}), 400
+    
+    status = read_training_job(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Training job not found'}), 404
+    
+    status = training_jobs.check_alive(status)
+    return jsonify(dict(status, success=True))
+
+@app.route('/api/admin/feature_store/rebuild', methods=['POST'])
+@requires_auth
+def rebuild_feature_store():
+    """Re-encode the feature store from training_data - run after editing or deleting training rows"""
+    if not USE_FEATURE_STORE:
+        return jsonify({'success': False, 'error': 'The feature store is disabled (USE_FEATURE_STORE=0)'}), 400
+    try:
+        rows = training_feature_store.rebuild()
+        return jsonify({'success': True, 'rows': rows, 'message': f'Feature store rebuilt with {rows} rows'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/models', methods=['GET'])
+@requires_auth
+def list_model_versions():
+    """Registry versions kept on disk with their validation scores and promotion result"""
+    manifest = model_registry.read_manifest() or {}
+    served = set(model_registry.promoted_versions(manifest))
+    versions = []
+    for version in reversed(model_registry.versions()):
+        try:
+            with open(model_metadata_path(model_registry.artifact_path(version))) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            continue
+        promotion = metadata.get('promotion') or {}
+        versions.append({
+            'version': version,
+            'active': version == manifest.get('version'),
+            'engine': metadata.get('engine', 'random_forest'),
+            'training_date': metadata.get('training_date'),
+            'total_jobs': metadata.get('total_jobs'),
+            'r2_score': metadata.get('r2_score'),
+            'mae': metadata.get('mae'),
+            'latency_ms': metadata.get('latency_ms'),
+            'incremental': 'incremental' in metadata,
+            'promoted': promotion.get('promoted'),
+            'served': version in served,
+            'promotion_failures': promotion.get('failures', [])
+        })
+    
+    return jsonify({
+        'success': True,
+        'active_version': manifest.get('version'),
+        'activated_at': manifest.get('activated_at'),
+        'keep_versions': MODEL_KEEP_VERSIONS,
+        'keep_candidates': MODEL_KEEP_CANDIDATES,
+        'versions': versions
+    })
+
+@app.route('/api/admin/models/<int:version>/activate', methods=['POST'])
+@requires_auth
+def activate_model_version(version):
+    """Roll back (or forward) to any kept version - every worker switches on its next request"""
+    try:
+        model_registry.activate(version)
+    except FileNotFoundError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    
+    # This worker switches now; the others notice the manifest change before their next prediction
+    refresh_model_if_stale()
+    
+    return jsonify({
+        'success': model_version == version,
+        'active_version': model_version,
+        'message': f'Now serving model v{version}' if model_version == version
+                   else f'Manifest points at v{version} but this worker could not load it'
+    })
+
+# =======================================
+# DRAFT QUOTE RE-PRICING
+# =======================================
+
+REPRICING_REPORTS_PATH = os.path.join(INSTANCE_PATH, 'repricing')
+REPRICE_CHUNK_SIZE = int(os.environ.get('REPRICE_CHUNK_SIZE', 1000))
+# Model features stored on Quote and QuoteItem rows, with the defaults used when saving
+QUOTE_JOB_FIELDS = {
+    'material': '',
+    'thickness_mm': 0.0,
+    'num_letters': 0,
+    'num_shapes': 1,
+    'complexity_score': 3,
+    'has_intricate_details': 0,
+    'width_mm': 0.0,
+    'height_mm': 0.0,
+    'cutting_type': '',
+    'cutting_time_minutes': 0.0,
+    'quantity': 1,
+    'rush_job': 0
+}
+
+def repricing_report_path(report_id):
+    return os.path.join(REPRICING_REPORTS_PATH, f'{report_id}.json')
+
+def quote_row_to_job(row):
+    """Model job_data from a Core Quote/QuoteItem row (NULLs get the save-time defaults)"""
+    return {
+        field: (row[field] if row[field] is not None else default)
+        for field, default in QUOTE_JOB_FIELDS.items()
+    }
+
+def discounted_prices(base_price, quote_row):
+    """(quoted_price, original_price, discount_amount) keeping a draft's discount percentage"""
+    if not quote_row['discount_applied']:
+        return base_price, quote_row['original_price'], quote_row['discount_amount']
+    discount_amount = round(base_price * (quote_row['discount_percentage'] or 0) / 100, 2)
+    return round(base_price - discount_amount, 2), base_price, discount_amount
+
+def build_draft_repricing_report():
+    """
+    Price every draft quote with the current model without changing anything.
+    Drafts are streamed REPRICE_CHUNK_SIZE at a time; each chunk loads its
+    items with one IN query and every quote/item in it is priced with one
+    vectorized predict_prices() call. Bulk quotes are re-priced item by item and
+    re-totalled; single-job quotes from their own fields.
+    """
+    from sqlalchemy import select
+    
+    started = time.perf_counter()
+    quote_table = Quote.__table__
+    item_table = QuoteItem.__table__
+    quote_columns = ['id', 'quote_number', 'customer_name', 'quoted_price', 'discount_applied',
+                     'discount_percentage', 'discount_amount', 'original_price'] + list(QUOTE_JOB_FIELDS)
+    item_columns = ['id', 'quote_id', 'item_name', 'item_price'] + list(QUOTE_JOB_FIELDS)
+    
+    stmt = (select(*[quote_table.c[name] for name in quote_columns])
+            .where(quote_table.c.status == 'draft')
+            .order_by(quote_table.c.id))
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=REPRICE_CHUNK_SIZE))
+    
+    rows = []
+    items_priced = 0
+    for partition in result.partitions():
+        quotes = [row._mapping for row in partition]
+        items_by_quote = {}
+        item_stmt = (select(*[item_table.c[name] for name in item_columns])
+                     .where(item_table.c.quote_id.in_([q['id'] for q in quotes]))
+                     .order_by(item_table.c.id))
+        for item in db.session.execute(item_stmt):
+            items_by_quote.setdefault(item.quote_id, []).append(item._mapping)
+        
+        # One job per item of a bulk quote, one per single-job quote
+        jobs = []
+        for quote_row in quotes:
+            sources = items_by_quote.get(quote_row['id']) or [quote_row]
+            jobs.extend(quote_row_to_job(source) for source in sources)
+        
+        prices = predict_prices(jobs)
+        if prices is None:
+            raise RuntimeError('The pricing model could not price the draft quotes')
+        items_priced += len(jobs)
+        
+        position = 0
+        for quote_row in quotes:
+            quote_items = items_by_quote.get(quote_row['id'], [])
+            count = len(quote_items) or 1
+            new_prices = prices[position:position + count]
+            position += count
+            
+            base_price = float(sum(new_prices))
+            new_price, original_price, discount_amount = discounted_prices(base_price, quote_row)
+            old_price = float(quote_row['quoted_price'])
+            rows.append({
+                'quote_id': quote_row['id'],
+                'quote_number': quote_row['quote_number'],
+                'customer_name': quote_row['customer_name'],
+                'old_price': old_price,
+                'new_price': new_price,
+                'change': round(new_price - old_price, 2),
+                'change_pct': round((new_price - old_price) / old_price * 100, 2) if old_price else None,
+                'original_price': original_price,
+                'discount_amount': discount_amount,
+                'items': [
+                    {
+                        'item_id': item['id'],
+                        'item_name': item['item_name'],
+                        'old_price': float(item['item_price']),
+                        'new_price': float(price)
+                    }
+                    for item, price in zip(quote_items, new_prices)
+                ]
+            })
+    
+    report_id = datetime.utcnow().strftime('%Y%m%d%H%M%S') + '-' + os.urandom(3).hex()
+    changed = [row for row in rows if row['change'] != 0]
+    report = {
+        'report_id': report_id,
+        'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        'model_version': model_version,
+        'applied_at': None,
+        'summary': {
+            'draft_quotes': len(rows),
+            'items_priced': items_priced,
+            'changed_quotes': len(changed),
+            'total_old': round(sum(row['old_price'] for row in rows), 2),
+            'total_new': round(sum(row['new_price'] for row in rows), 2),
+            'seconds': round(time.perf_counter() - started, 3)
+        },
+        'quotes': rows
+    }
+    os.makedirs(REPRICING_REPORTS_PATH, exist_ok=True)
+    write_json_atomic(repricing_report_path(report_id), report)
+    print(f"✓ Re-priced {len(rows)} draft quotes ({items_priced} jobs) in {report['summary']['seconds']}s")
+    return report
+
+def apply_draft_repricing_report(report):
+    """
+    Write a report's new prices in bulk. A quote is skipped if it is no longer a
+    draft, or its price, any of its item prices or its set of items changed since
+    the report was made. Returns (applied, skipped).
+    """
+    from sqlalchemy import select, update
+    
+    quote_table = Quote.__table__
+    item_table = QuoteItem.__table__
+    applied, skipped = [], []
+    changed_rows = [
+        row for row in report['quotes']
+        if row['change'] != 0 or any(item['old_price'] != item['new_price'] for item in row['items'])
+    ]
+    
+    for start in range(0, len(changed_rows), REPRICE_CHUNK_SIZE):
+        chunk = changed_rows[start:start + REPRICE_CHUNK_SIZE]
+        # Current quote and item prices in one query - a quote without items gets one row of NULLs
+        current_prices, current_items = {}, {}
+        for quote_id, quoted_price, item_id, item_price in db.session.execute(
+            select(quote_table.c.id, quote_table.c.quoted_price, item_table.c.id, item_table.c.item_price)
+            .select_from(quote_table.outerjoin(item_table, item_table.c.quote_id == quote_table.c.id))
+            .where(quote_table.c.id.in_([row['quote_id'] for row in chunk]))
+            .where(quote_table.c.status == 'draft')
+        ):
+            current_prices[quote_id] = quoted_price
+            items = current_items.setdefault(quote_id, {})
+            if item_id is not None:
+                items[item_id] = item_price
+        
+        quote_updates, item_updates = [], []
+        for row in chunk:
+            current_price = current_prices.get(row['quote_id'])
+            items = current_items.get(row['quote_id'], {})
+            if (
+                current_price is None
+                or abs(current_price - row['old_price']) > 0.005
+                or set(items) != {item['item_id'] for item in row['items']}
+                or any(abs(items[item['item_id']] - item['old_price']) > 0.005 for item in row['items'])
+            ):
+                skipped.append(row['quote_id'])
+                continue
+            quote_updates.append({
+                'id': row['quote_id'],
+                'quoted_price': row['new_price'],
+                'original_price': row['original_price'],
+                'discount_amount': row['discount_amount']
+            })
+            item_updates.extend({'id': item['item_id'], 'item_price': item['new_price']} for item in row['items'])
+            applied.append(row['quote_id'])
+        
+        # ORM bulk UPDATE by primary key - executemany, no objects loaded
+        if quote_updates:
+            db.session.execute(update(Quote), quote_updates)
+        if item_updates:
+            db.session.execute(update(QuoteItem), item_updates)
+    
+    db.session.commit()
+    return applied, skipped
+
+@app.route('/api/admin/reprice-drafts', methods=['POST'])
+@requires_auth
+def reprice_draft_quotes():
+    """Dry run: price every draft quote with the current model and save an old-vs-new report"""
+    try:
+        report = build_draft_repricing_report()
+        return jsonify({
+            'success': True,
+            'report_id': report['report_id'],
+            'model_version': report['model_version'],
+            'summary': report['summary'],
+            'report_url': f"/api/admin/reprice-drafts/{report['report_id']}",
+            'apply_url': f"/api/admin/reprice-drafts/{report['report_id']}/apply"
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/reprice-drafts/<report_id>', methods=['GET'])
+@requires_auth
+def get_repricing_report(report_id):
+    """Full old-vs-new report, quote by quote and item by item"""
+    if not re.fullmatch(r'[0-9a-f\-]+', report_id) or not os.path.exists(repricing_report_path(report_id)):
+        return jsonify({'success': False, 'error': 'Report not found'}), 404
+    with open(repricing_report_path(report_id)) as f:
+        return jsonify(dict(json.load(f), success=True))
+
+@app.route('/api/admin/reprice-drafts/<report_id>/apply', methods=['POST'])
+@requires_auth
+def apply_repricing_report(report_id):
+    """Apply a reviewed report's new prices to the drafts in bulk"""
+    try:
+        if not re.fullmatch(r'[0-9a-f\-]+', report_id) or not os.path.exists(repricing_report_path(report_id)):
+            return jsonify({'success': False, 'error': 'Report not found'}), 404
+        with open(repricing_report_path(report_id)) as f:
+            report = json.load(f)
+        
+        if report.get('applied_at'):
+            return jsonify({'success': False, 'error': f"Report already applied at {report['applied_at']}"}), 409
+        refresh_model_if_stale()
+        if report['model_version'] != model_version:
+            return jsonify({
+                'success': False,
+                'error': f"The model changed since this report (v{report['model_version']} → v{model_version}). "
+                         f"Run a new re-pricing report first."
+            }), 409
+        
+        applied, skipped = apply_draft_repricing_report(report)
+        
+        report['applied_at'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        report['applied_quotes'] = len(applied)
+        report['skipped_quotes'] = skipped
+        write_json_atomic(repricing_report_path(report_id), report)
+        
+        return jsonify({
+            'success': True,
+            'applied': len(applied),
+            'skipped': skipped,
+            'message': f'Updated {len(applied)} draft quotes'
+                       + (f' ({len(skipped)} changed since the report and were skipped)' if skipped else '')
+        })
+    except Exception as e:
+        db.session.rollback()
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # =======================================
 # HEALTH CHECK ROUTE
 # =======================================
@@ -3822,6 +7061,10 @@ def health():
     return jsonify({
         'status': 'running',
         'model_loaded': model is not None,
+        'model_version': model_version,
+        'prediction_cache': prediction_cache.stats(),
+        'analysis_cache': analysis_cache.stats(),
+        'price_table_size': len(price_table) if price_table is not None else 0,
         'company': 'BrainGain Tech Innovation Solutions'
     })
 
@@ -3865,6 +7108,9 @@ def init_app():
             ])
             df.to_csv(CSV_PATH, index=False)
             app.logger.info("Created empty training CSV")
+    
+    # Fail loudly at deploy time if an ezdxf upgrade broke the streaming DXF reader
+    verify_dxf_streaming_reader()
 
 # ========================================
 # SCHEDULED DAILY REPORT EMAIL
@@ -3877,7 +7123,8 @@ class Config:
 app.config.from_object(Config())
 scheduler = APScheduler()
 scheduler.init_app(app)
-scheduler.start()
+if not IS_TRAINING_PROCESS:
+    scheduler.start()
 
 def generate_monthly_report_pdf(year, month):
     """
@@ -4316,6 +7563,6 @@ if __name__ == '__main__':
     # Local development
     init_app()
     app.run(debug=True, host='0.0.0.0', port=5000)
-else:
+elif not IS_TRAINING_PROCESS:
     # Production - run init when imported by gunicorn
     init_app()
\ No newline at end of file
@@ -0,0 +1,378 @@
+"""
+Performance benchmarks for the pricing system.
+Runs against a throwaway SQLite database - never the configured DATABASE_URL.
+
+Usage:
+    python benchmark.py training_loader [--rows 100000]
+    python benchmark.py feature_store [--rows 100000]
+    python benchmark.py feature_encoder [--rows 100000]
+    python benchmark.py clustering [--sizes 1000 5000 20000 50000 100000 200000] [--legacy-max 5000]
+    python benchmark.py dxf_geometry [--sizes 10000 50000 200000]
+    python benchmark.py dxf_reader [--sizes 50000 200000]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Point the app at a scratch database BEFORE importing it
+BENCH_DIR = tempfile.mkdtemp(prefix='cnc_bench_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}"
+os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+
+import numpy as np
+import pandas as pd
+
+import ezdxf
+
+from app import (app, db, TrainingData, TrainingFeatureStore, FeatureEncoder, load_training_dataframe,
+                 EntityGeometry, analyze_dxf_file, detect_spatial_jobs, entity_points, extract_entity_geometry,
+                 grid_cluster_entities, is_meaningful_entity, merge_close_clusters)
+
+MATERIALS = ['Acrylic', 'Wood', 'Metal', 'MDF', 'Plywood', 'Foam', 'Cardboard', 'ACP']
+CUTTING_TYPES = ['Laser Cutting', 'CNC Router']
+
+
+def measure(fn):
+    """Run fn once, returning (result, seconds, peak traced MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def synthetic_training_rows(n, seed=42):
+    """Random but plausible training_data rows"""
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'material': MATERIALS[rng.integers(len(MATERIALS))],
+            'thickness_mm': float(rng.choice([1.5, 3, 4, 6, 9, 12, 18])),
+            'num_letters': int(rng.integers(0, 200)),
+            'num_shapes': int(rng.integers(1, 60)),
+            'complexity_score': int(rng.integers(1, 6)),
+            'has_intricate_details': int(rng.integers(0, 2)),
+            'width_mm': float(round(rng.uniform(50, 1220), 2)),
+            'height_mm': float(round(rng.uniform(50, 2440), 2)),
+            'cutting_type': CUTTING_TYPES[rng.integers(len(CUTTING_TYPES))],
+            'cutting_time_minutes': float(round(rng.uniform(5, 120), 1)),
+            'quantity': int(rng.integers(1, 50)),
+            'rush_job': int(rng.integers(0, 2)),
+            'price': float(round(rng.uniform(1000, 150000), 2))
+        }
+        for _ in range(n)
+    ]
+
+
+def legacy_training_dataframe():
+    """The pre-streaming loader: ORM objects -> to_dict -> DataFrame -> to_numeric"""
+    records = TrainingData.query.all()
+    df = pd.DataFrame([r.to_dict() for r in records])
+    for col in ['thickness_mm', 'width_mm', 'height_mm', 'num_letters', 'num_shapes',
+                'complexity_score', 'cutting_time_minutes', 'quantity', 'price']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df.dropna()
+
+
+def bench_training_loader(rows):
+    with app.app_context():
+        db.create_all()
+        print(f"Inserting {rows:,} synthetic training rows...")
+        db.session.execute(TrainingData.__table__.insert(), synthetic_training_rows(rows))
+        db.session.commit()
+        
+        for label, loader in [('legacy ORM + to_dict', legacy_training_dataframe),
+                              ('streaming typed', load_training_dataframe)]:
+            db.session.expunge_all()
+            df, elapsed, peak_mb = measure(loader)
+            frame_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+            print(f"  {label:<22} {elapsed:7.2f}s   peak {peak_mb:8.1f} MB   "
+                  f"DataFrame {frame_mb:7.1f} MB   rows {len(df):,}")
+
+
+def bench_feature_store(rows):
+    store = TrainingFeatureStore(os.path.join(BENCH_DIR, 'feature_store'))
+    with app.app_context():
+        db.create_all()
+        print(f"Inserting {rows:,} synthetic training rows...")
+        db.session.execute(TrainingData.__table__.insert(), synthetic_training_rows(rows))
+        db.session.commit()
+        
+        _, elapsed, peak_mb = measure(store.sync)
+        print(f"  {'initial store build':<22} {elapsed:7.2f}s   peak {peak_mb:8.1f} MB")
+        
+        db.session.execute(TrainingData.__table__.insert(), synthetic_training_rows(1, seed=7))
+        db.session.commit()
+        _, elapsed, peak_mb = measure(store.sync)
+        print(f"  {'append one job':<22} {elapsed * 1000:6.1f}ms   peak {peak_mb:8.1f} MB")
+        
+        def prepare(loader):
+            return lambda: pd.get_dummies(loader(), columns=['material', 'cutting_type'], prefix=['mat', 'cut'])
+        
+        for label, loader in [('table + get_dummies', load_training_dataframe),
+                              ('store + get_dummies', store.load_dataframe)]:
+            df, elapsed, peak_mb = measure(prepare(loader))
+            print(f"  {label:<22} {elapsed:7.2f}s   peak {peak_mb:8.1f} MB   rows {len(df):,}")
+
+
+def bench_feature_encoder(rows):
+    """FeatureEncoder against get_dummies + reindex - the matrices must match exactly"""
+    categorical = ['material', 'cutting_type']
+    train = pd.DataFrame(synthetic_training_rows(2_000)).drop(columns=['price'])
+    columns = pd.get_dummies(train, columns=categorical, prefix=['mat', 'cut']).columns
+    encoder = FeatureEncoder(columns)
+    
+    jobs = synthetic_training_rows(rows, seed=7)
+    # Other casings of trained names and unseen names get no one-hot slot, as with get_dummies
+    for job, material, cutting_type in zip(jobs, ['acrylic', 'WOOD', 'Granite'],
+                                           ['laser cutting', 'CNC Router', 'Waterjet']):
+        job['material'] = material
+        job['cutting_type'] = cutting_type
+    
+    def legacy():
+        frame = pd.get_dummies(pd.DataFrame(jobs).drop(columns=['price']), columns=categorical, prefix=['mat', 'cut'])
+        return frame.reindex(columns=columns, fill_value=0).to_numpy(dtype=np.float64)
+    
+    expected, legacy_seconds, legacy_mb = measure(legacy)
+    with contextlib.redirect_stdout(io.StringIO()):
+        X, seconds, peak_mb = measure(lambda: encoder.encode(jobs))
+    
+    print(f"  {'get_dummies + reindex':<22} {legacy_seconds:7.2f}s   peak {legacy_mb:8.1f} MB")
+    print(f"  {'FeatureEncoder':<22} {seconds:7.2f}s   peak {peak_mb:8.1f} MB")
+    mismatched = int((X != expected).any(axis=1).sum())
+    print(f"  rows {len(jobs):,}   mismatched rows {mismatched:,}")
+    return 1 if mismatched else 0
+
+
+def synthetic_nameplate_bounds(n, seed=42):
+    """
+    n entity boxes (min_x, min_y, max_x, max_y) laid out like a sheet of
+    nameplates: 80x40mm plates 100mm apart, each an outline plus a few holes
+    and short text strings.
+    """
+    rng = np.random.default_rng(seed)
+    per_plate = 8
+    columns = max(1, int(np.sqrt(n / per_plate)))
+    bounds = []
+    
+    plate = 0
+    while len(bounds) < n:
+        x0 = (plate % columns) * 180.0
+        y0 = (plate // columns) * 140.0
+        bounds.append((x0, y0, x0 + 80.0, y0 + 40.0))
+        for _ in range(per_plate - 1):
+            if len(bounds) >= n:
+                break
+            x, y = x0 + rng.uniform(2, 60), y0 + rng.uniform(2, 30)
+            bounds.append((x, y, x + rng.uniform(2, 18), y + rng.uniform(2, 8)))
+        plate += 1
+    return np.array(bounds)
+
+
+def synthetic_nameplate_sheet(n, seed=42):
+    """synthetic_nameplate_bounds() as EntityGeometry rows (no real DXF entities)"""
+    bounds = synthetic_nameplate_bounds(n, seed)
+    return EntityGeometry([None] * n, np.arange(n), np.zeros(n), bounds)
+
+
+def synthetic_nameplate_document(n, seed=42):
+    """An in-memory DXF document of n real entities with the synthetic_nameplate_bounds() layout"""
+    doc = ezdxf.new()
+    doc.header['$INSUNITS'] = 4
+    msp = doc.modelspace()
+    for k, (min_x, min_y, max_x, max_y) in enumerate(synthetic_nameplate_bounds(n, seed)):
+        if k % 8 == 0:
+            msp.add_lwpolyline([(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)], close=True)
+        elif k % 8 < 5:
+            msp.add_circle(((min_x + max_x) / 2, (min_y + max_y) / 2), (max_y - min_y) / 2)
+        else:
+            msp.add_text('NAME', dxfattribs={'height': max_y - min_y, 'insert': (min_x, min_y)})
+    return doc
+
+
+def synthetic_nameplate_drawing(n, seed=42):
+    """The modelspace of synthetic_nameplate_document()"""
+    return synthetic_nameplate_document(n, seed).modelspace()
+
+
+def legacy_entity_boxes(entities, unit_factor):
+    """The pre-columnar layout: one dict of dicts per entity, holding the live entity"""
+    entity_boxes = []
+    for entity in entities:
+        points = entity_points(entity, entity.dxftype())
+        xs = [p[0] * unit_factor for p in points]
+        ys = [p[1] * unit_factor for p in points]
+        bbox = {
+            'min_x': min(xs),
+            'min_y': min(ys),
+            'max_x': max(xs),
+            'max_y': max(ys),
+            'width': max(xs) - min(xs),
+            'height': max(ys) - min(ys)
+        }
+        if bbox['width'] > 0.1 and bbox['height'] > 0.1:
+            entity_boxes.append({
+                'entity': entity,
+                'bbox': bbox,
+                'center_x': bbox['min_x'] + bbox['width'] / 2,
+                'center_y': bbox['min_y'] + bbox['height'] / 2
+            })
+    return entity_boxes
+
+
+def legacy_greedy_clusters(geometry, cluster_threshold=50):
+    """The pre-grid rule: join the first cluster holding any entity closer than the threshold"""
+    clusters = []
+    for row, (x, y) in enumerate(zip(geometry.center_x.tolist(), geometry.center_y.tolist())):
+        for cluster in clusters:
+            if any(((x - other_x)**2 + (y - other_y)**2)**0.5 < cluster_threshold for _, other_x, other_y in cluster):
+                cluster.append((row, x, y))
+                break
+        else:
+            clusters.append([(row, x, y)])
+    return [[row for row, _, _ in cluster] for cluster in clusters]
+
+
+def legacy_merge_close_clusters(clusters, merge_threshold, geometry):
+    """The pre-sweep merge: pairwise passes, rescanning both clusters' boxes per check, until nothing changes"""
+    def should_merge(rows1, rows2):
+        bbox1, bbox2 = geometry.bbox(rows1), geometry.bbox(rows2)
+        horizontal_gap = max(0, bbox1['min_x'] - bbox2['max_x'], bbox2['min_x'] - bbox1['max_x'])
+        vertical_gap = max(0, bbox1['min_y'] - bbox2['max_y'], bbox2['min_y'] - bbox1['max_y'])
+        return max(horizontal_gap, vertical_gap) < merge_threshold
+    
+    merged = True
+    while merged and len(clusters) > 1:
+        merged = False
+        new_clusters = []
+        used = set()
+        for i in range(len(clusters)):
+            if i in used:
+                continue
+            for j in range(i + 1, len(clusters)):
+                if j not in used and should_merge(clusters[i], clusters[j]):
+                    clusters[i].extend(clusters[j])
+                    used.add(j)
+                    merged = True
+            new_clusters.append(clusters[i])
+            used.add(i)
+        clusters = new_clusters
+    return clusters
+
+
+def bench_clustering(sizes, legacy_max):
+    print(f"{'entities':>10} {'grid':>9} {'sweep merge':>12} {'legacy greedy':>14} {'legacy merge':>13} {'jobs':>7}")
+    for n in sizes:
+        geometry = synthetic_nameplate_sheet(n)
+        groups, grid_seconds, _ = measure(lambda: grid_cluster_entities(geometry.center_x, geometry.center_y, 50))
+        jobs, merge_seconds, _ = measure(lambda: merge_close_clusters(groups, 75, geometry))
+        
+        legacy_greedy = legacy_merge = 'skipped'
+        if n <= legacy_max:
+            clusters, seconds, _ = measure(lambda: legacy_greedy_clusters(geometry, 50))
+            legacy_greedy = f"{seconds:.3f}s"
+            legacy_jobs, seconds, _ = measure(lambda: legacy_merge_close_clusters(clusters, 75, geometry))
+            legacy_merge = f"{seconds:.3f}s"
+            if len(legacy_jobs) != len(jobs):
+                legacy_merge += f" ({len(legacy_jobs)} jobs)"
+        
+        print(f"{n:>10,} {grid_seconds:>8.3f}s {merge_seconds:>11.3f}s {legacy_greedy:>14} {legacy_merge:>13} {len(jobs):>7,}")
+
+
+def bench_dxf_geometry(sizes):
+    print(f"{'entities':>10} {'legacy dict boxes':>26} {'columnar arrays':>26} {'full detect_spatial_jobs':>26}")
+    for n in sizes:
+        entities = [entity for entity in synthetic_nameplate_drawing(n) if is_meaningful_entity(entity)]
+        
+        _, legacy_seconds, legacy_mb = measure(lambda: legacy_entity_boxes(entities, 1.0))
+        _, seconds, peak_mb = measure(lambda: extract_entity_geometry(entities, 1.0))
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, detect_seconds, detect_mb = measure(lambda: detect_spatial_jobs(entities, 1.0))
+        
+        print(f"{n:>10,} {legacy_seconds:>8.3f}s  peak {legacy_mb:>8.1f} MB "
+              f"{seconds:>8.3f}s  peak {peak_mb:>8.1f} MB {detect_seconds:>8.3f}s  peak {detect_mb:>8.1f} MB")
+
+
+def bench_dxf_reader(sizes):
+    """Both readers on the same file - their per-job output must be identical"""
+    print(f"{'entities':>10} {'file MB':>8} {'full document load':>26} {'streaming reader':>26} {'jobs':>12}")
+    mismatched = 0
+    for n in sizes:
+        path = os.path.join(BENCH_DIR, f'nameplates_{n}.dxf')
+        synthetic_nameplate_document(n).saveas(path)
+        file_mb = os.path.getsize(path) / 1024 / 1024
+        
+        row = f"{n:>10,} {file_mb:>8.1f}"
+        results = []
+        for streaming in (False, True):
+            def analyze():
+                with open(path, 'rb') as upload, contextlib.redirect_stdout(io.StringIO()):
+                    return analyze_dxf_file(upload, streaming=streaming)
+            result, seconds, peak_mb = measure(analyze)
+            results.append(result)
+            row += f" {seconds:>8.2f}s  peak {peak_mb:>8.1f} MB"
+            if not result['success']:
+                row += f" ({result['error']})"
+        
+        full, streamed = (result.get('items') for result in results)
+        if full == streamed:
+            row += f" {len(full or []):>6,} same"
+        else:
+            mismatched += 1
+            differing = sum(a != b for a, b in zip(full or [], streamed or []))
+            row += f" DIFFERENT ({len(full or [])} vs {len(streamed or [])} jobs, {differing} differ)"
+        print(row)
+    return 1 if mismatched else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+    
+    loader = sub.add_parser('training_loader', help='retrain data loading: ORM vs streaming typed loader')
+    loader.add_argument('--rows', type=int, default=100_000)
+    
+    store = sub.add_parser('feature_store', help='retrain data preparation: table vs encoded feature store')
+    store.add_argument('--rows', type=int, default=100_000)
+    
+    encoder = sub.add_parser('feature_encoder', help='job encoding: get_dummies + reindex vs FeatureEncoder (checks parity)')
+    encoder.add_argument('--rows', type=int, default=100_000)
+    
+    clustering = sub.add_parser('clustering', help='DXF entity clustering: grid union-find + sweep merge vs legacy')
+    clustering.add_argument('--sizes', type=int, nargs='+', default=[1_000, 5_000, 20_000, 50_000, 100_000, 200_000])
+    clustering.add_argument('--legacy-max', type=int, default=5_000,
+                            help='largest entity count to also run the quadratic legacy rules on')
+    
+    geometry = sub.add_parser('dxf_geometry', help='DXF entity geometry: per-entity dicts vs NumPy columns')
+    geometry.add_argument('--sizes', type=int, nargs='+', default=[10_000, 50_000, 200_000])
+    
+    reader = sub.add_parser('dxf_reader', help='DXF upload analysis: full document load vs streaming reader (checks parity)')
+    reader.add_argument('--sizes', type=int, nargs='+', default=[50_000, 200_000])
+    
+    args = parser.parse_args()
+    if args.benchmark == 'training_loader':
+        bench_training_loader(args.rows)
+    elif args.benchmark == 'feature_store':
+        bench_feature_store(args.rows)
+    elif args.benchmark == 'feature_encoder':
+        return bench_feature_encoder(args.rows)
+    elif args.benchmark == 'clustering':
+        bench_clustering(args.sizes, args.legacy_max)
+    elif args.benchmark == 'dxf_geometry':
+        bench_dxf_geometry(args.sizes)
+    elif args.benchmark == 'dxf_reader':
+        return bench_dxf_reader(args.sizes)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
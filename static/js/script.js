@@ -283,14 +283,24 @@ async function handleFile(file) {
     hideElement('multiItemInfo');
     document.getElementById('uploadCalcBtn').disabled = true;
     
+    // With the job options already chosen, a DXF is analyzed and priced in one request
+    const jobOptions = getUploadJobOptions();
+    const priceWithAnalysis = isDXF && jobOptions.material && jobOptions.thickness && jobOptions.color;
+    if (priceWithAnalysis) {
+        Object.entries(jobOptions).forEach(([key, value]) => formData.append(key, value));
+    }
+    
     try {
-        const endpoint = isDXF ? '/analyze_dxf_file' : '/analyze_file';
+        const endpoint = priceWithAnalysis ? '/analyze_and_price' : (isDXF ? '/analyze_dxf_file' : '/analyze_file');
         const response = await fetch(endpoint, { method: 'POST', body: formData });
         const result = await response.json();
         
         hideLoading('uploadLoading');
         
-        if (result.success) {
+        if (result.success && priceWithAnalysis) {
+            showNotification(`${result.message}`, 'success');
+            displayPricedDxfResults(result);
+        } else if (result.success) {
             if (result.file_type === 'dxf' && result.multiple_items && result.total_items > 1) {
                 showNotification(`${result.message}`, 'success');
                 displayDxfMultiItemResults(result);
@@ -358,6 +368,66 @@ async function displayDxfMultiItemResults(result) {
     }
 }
 
+function getUploadJobOptions() {
+    return {
+        material: document.getElementById('uploadMaterial').value,
+        thickness: document.getElementById('uploadThickness').value,
+        color: document.getElementById('uploadColor').value,
+        cuttingType: document.getElementById('uploadCuttingType').value,
+        quantity: document.getElementById('uploadQuantity').value,
+        rush: document.getElementById('uploadRush').checked ? 1 : 0
+    };
+}
+
+function dxfItemToJobData(item, job) {
+    return {
+        material: job.material,
+        thickness: job.thickness,
+        color: job.color || '',
+        letters: item.num_letters,
+        shapes: item.num_shapes,
+        complexity: item.complexity_score,
+        details: item.has_intricate_details,
+        width: item.width_mm,
+        height: item.height_mm,
+        cuttingType: job.cuttingType,
+        time: item.cutting_time_minutes,
+        quantity: job.quantity,
+        rush: job.rush
+    };
+}
+
+// Show the result of /analyze_and_price - every job already priced
+function displayPricedDxfResults(result) {
+    const job = result.job;
+    
+    if (result.multiple_items && result.total_items > 1) {
+        bulkItems = result.items.map((item, index) => ({
+            id: index,
+            name: item.name,
+            ...dxfItemToJobData(item, job),
+            price: item.price,
+            inventory: item.inventory
+        }));
+        
+        updateBulkItemsDisplay();
+        showTab('bulk');
+        
+        if (result.warnings) {
+            showNotification(result.warnings.join('<br>'), 'warning');
+        }
+        return;
+    }
+    
+    const item = result.items[0];
+    extractedData = item;
+    displayExtractedInfo(item);
+    document.getElementById('uploadCalcBtn').disabled = false;
+    
+    const warnings = item.inventory && !item.inventory.in_stock ? [item.inventory.message] : null;
+    displayResultWithInventory(item.price, dxfItemToJobData(item, job), item.inventory, warnings, item.price_interval);
+}
+
 function displayExtractedInfo(data) {
     document.getElementById('extractedWidth').textContent = data.width_mm + 'mm';
     document.getElementById('extractedHeight').textContent = data.height_mm + 'mm';
@@ -463,7 +533,7 @@ async function sendPriceRequest(jobData) {
         const result = await response.json();
         
         if (result.success) {
-            displayResultWithInventory(result.price, jobData, result.inventory, result.warnings);
+            displayResultWithInventory(result.price, jobData, result.inventory, result.warnings, result.price_interval);
         } else {
             showNotification('Error calculating price: ' + result.error, 'error');
         }
@@ -476,7 +546,7 @@ async function sendPriceRequest(jobData) {
 // NEW DISPLAY FUNCTION WITH INVENTORY INFO
 // ========================================
 
-function displayResultWithInventory(price, jobData, inventory, warnings) {
+function displayResultWithInventory(price, jobData, inventory, warnings, priceInterval) {
     // Store current quote data
     currentJobData = jobData;
     currentPrice = price;
@@ -488,6 +558,24 @@ function displayResultWithInventory(price, jobData, inventory, warnings) {
         maximumFractionDigits: 2
     });
     
+    // Show how much the model's trees disagree about this price
+    let intervalDisplay = document.getElementById('priceInterval');
+    if (!intervalDisplay) {
+        intervalDisplay = document.createElement('div');
+        intervalDisplay.id = 'priceInterval';
+        intervalDisplay.style.cssText = 'font-size: 14px; opacity: 0.85; margin-top: 5px;';
+        const priceDisplay = document.getElementById('priceDisplay');
+        priceDisplay.parentNode.insertBefore(intervalDisplay, priceDisplay.nextSibling);
+    }
+    if (priceInterval) {
+        const confidenceColors = { high: '#28a745', medium: '#ffc107', low: '#dc3545' };
+        intervalDisplay.innerHTML = `Likely range: ₦${priceInterval.low.toLocaleString()} – ₦${priceInterval.high.toLocaleString()} ` +
+            `<span style="color: ${confidenceColors[priceInterval.confidence]}; font-weight: bold;">(${priceInterval.confidence} confidence)</span>`;
+        intervalDisplay.style.display = 'block';
+    } else {
+        intervalDisplay.style.display = 'none';
+    }
+    
     // Display basic job details
     document.getElementById('resultMaterial').textContent = jobData.material + ' (' + jobData.thickness + 'mm)';
     document.getElementById('resultSize').textContent = jobData.width + 'mm × ' + jobData.height + 'mm';
@@ -1011,7 +1099,7 @@ async function updateTrainingStats() {
 }
 
 async function retrainModel() {
-    if (!confirm('Retrain the pricing model with current data? This may take 10-30 seconds.')) {
+    if (!confirm('Retrain the pricing model with current data? This runs in the background and may take a minute.')) {
         return;
     }
     
@@ -1023,9 +1111,24 @@ async function retrainModel() {
             method: 'POST'
         });
         
-        const result = await response.json();
+        const started = await response.json();
         
-        if (result.success) {
+        if (!started.success) {
+            throw new Error(started.error);
+        }
+        
+        const result = await pollRetrainStatus(started.status_url, statusDiv);
+        
+        if (result.state === 'completed' && result.promoted === false) {
+            statusDiv.innerHTML = `
+                <div class="error-box">
+                    <strong>${result.message}</strong>
+                    <p style="margin-top: 10px;">
+                        ${result.promotion_failures.join('<br>')}
+                    </p>
+                </div>
+            `;
+        } else if (result.state === 'completed') {
             statusDiv.innerHTML = `
                 <div class="success-box">
                     <strong>${result.message}</strong>
@@ -1055,6 +1158,35 @@ async function retrainModel() {
     }
 }
 
+// Poll a background retrain job until it completes or fails (or outlives the server's job timeout)
+async function pollRetrainStatus(statusUrl, statusDiv) {
+    let deadline = null;
+    
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        
+        const response = await fetch(statusUrl);
+        const status = await response.json();
+        
+        if (!status.success) {
+            throw new Error(status.error);
+        }
+        
+        if (status.state === 'completed' || status.state === 'failed') {
+            return status;
+        }
+        
+        // The server fails jobs past TRAINING_JOB_TIMEOUT; allow a minute of slack before giving up
+        if (deadline === null) {
+            deadline = Date.now() + ((status.timeout_seconds || 1800) + 60) * 1000;
+        } else if (Date.now() > deadline) {
+            throw new Error('Retraining did not finish in time. Check the training job status and try again.');
+        }
+        
+        statusDiv.innerHTML = `<div class="spinner"></div><p>Retraining model... ${status.stage.replaceAll('_', ' ')} (${status.progress}%)</p>`;
+    }
+}
+
 // Load training stats when Add Job tab is opened
 document.addEventListener('DOMContentLoaded', function() {
     const originalShowTab = window.showTab;
@@ -1531,20 +1663,21 @@ async function saveBulkQuote() {
         return;
     }
     
-    // Calculate prices for any items missing them
-    const itemsWithPrices = await Promise.all(
-        bulkItems.map(async (item) => {
-            if (item.price && item.price > 0) {
-                return item;
-            }
-            
-            try {
-                const priceResponse = await fetch('/calculate_price', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
+    // Price any items still missing a price in one batch request
+    let itemsWithPrices = bulkItems;
+    const unpriced = bulkItems.filter(item => !(item.price && item.price > 0) && item.material && item.thickness);
+    
+    if (unpriced.length > 0) {
+        try {
+            const priceResponse = await fetch('/calculate_bulk_prices', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    items: unpriced.map(item => ({
+                        id: item.id,
+                        name: item.name,
                         material: item.material,
                         thickness: item.thickness,
                         color: item.color,
@@ -1558,20 +1691,27 @@ async function saveBulkQuote() {
                         time: item.time || 10,
                         quantity: item.quantity || 1,
                         rush: item.rush || 0
-                    })
-                });
+                    }))
+                })
+            });
+            
+            const priceData = await priceResponse.json();
+            if (priceData.success) {
+                const pricesById = new Map(priceData.items.map(result => [result.item_id, result.price]));
+                itemsWithPrices = bulkItems.map(item =>
+                    pricesById.get(item.id) ? { ...item, price: pricesById.get(item.id) } : item
+                );
                 
-                const priceData = await priceResponse.json();
-                if (priceData.success) {
-                    return { ...item, price: priceData.price };
+                // Items the server could not parse come back unpriced with their own error
+                const failed = priceData.items.filter(result => result.error);
+                if (failed.length > 0) {
+                    showNotification(`${failed.length} item(s) could not be priced - check their dimensions and time.`, 'warning');
                 }
-            } catch (error) {
-                console.error('Error calculating price for item:', error);
             }
-            
-            return item;
-        })
-    );
+        } catch (error) {
+            console.error('Error calculating prices for items:', error);
+        }
+    }
     
     // Calculate total
     const subtotal = itemsWithPrices.reduce((sum, item) => sum + (item.price || 0), 0);